@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Admin Authentication
+Shared-token guard for operator endpoints under /admin
+"""
+
+import hmac
+import os
+from functools import wraps
+
+from flask import jsonify, request
+
+
+def admin_required(view):
+    """Allow the request only when X-Admin-Token matches ADMIN_TOKEN
+
+    Admin endpoints are disabled entirely while ADMIN_TOKEN is unset.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        expected = os.getenv("ADMIN_TOKEN", "")
+        if not expected:
+            return jsonify({"success": False, "error": "Admin endpoints are disabled"}), 404
+
+        provided = request.headers.get("X-Admin-Token", "")
+        if not hmac.compare_digest(provided.encode(), expected.encode()):
+            return jsonify({"success": False, "error": "Unauthorized"}), 401
+
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Semantic Answer Cache
+Cross-session cache of answers to first-turn questions, matched by embedding similarity
+
+Only context-free questions (the first message of a /chat or /chat/stream
+session, or a Zoho visitor's first message) are looked up and stored, so a
+cached answer never depends on someone else's conversation. Questions are
+embedded with the shared embedder and kept in one preallocated matrix; a
+lookup is a single matrix-vector product over all live entries.
+
+How close counts as the same question depends on the embedding backend.
+With Ollama embeddings a hit needs cosine similarity >= ANSWER_CACHE_THRESHOLD.
+The hash backend only sees word overlap ("a long day at work" and "a long
+night at work" score above 0.9), so with it a hit needs the same question up
+to case, punctuation and spacing; the vector search just finds the candidate.
+
+Entries expire after ANSWER_CACHE_TTL unless pinned. When the cache is full,
+expired entries go first, then the least recently used unpinned entry.
+Pinned entries (curated FAQ answers, added or pinned through the admin
+endpoints) are never evicted.
+
+Environment:
+    ANSWER_CACHE_ENABLED       true | false (default true; needs numpy)
+    ANSWER_CACHE_THRESHOLD     cosine similarity for a hit with Ollama embeddings, in (0, 1]
+                               (default 0.92; the hash backend always needs an exact match)
+    ANSWER_CACHE_MAX_ENTRIES   default 1000
+    ANSWER_CACHE_TTL           seconds (default 86400)
+"""
+
+import math
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from embeddings import WORD_RE, Embedder, embedder, np
+from runtime_config import settings
+
+
+def normalize_question(question: str) -> str:
+    """Lowercased words only: what has to match exactly under the hash backend"""
+    return " ".join(WORD_RE.findall(question.lower()))
+
+
+class _Entry:
+    __slots__ = ("entry_id", "slot", "question", "key", "answer", "model", "generation_seconds",
+                 "created_at", "last_hit", "hits", "pinned")
+
+    def __init__(self, slot: int, question: str, answer: str, model: str,
+                 generation_seconds: float, pinned: bool = False):
+        self.entry_id = uuid.uuid4().hex[:12]
+        self.slot = slot
+        self.question = question
+        self.key = normalize_question(question)
+        self.answer = answer
+        self.model = model
+        self.generation_seconds = generation_seconds
+        self.created_at = time.time()
+        self.last_hit = self.created_at
+        self.hits = 0
+        self.pinned = pinned
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.entry_id,
+            "question": self.question,
+            "answer": self.answer,
+            "model": self.model,
+            "hits": self.hits,
+            "pinned": self.pinned,
+            "generation_seconds": round(self.generation_seconds, 3),
+            "created_at": self.created_at,
+            "last_hit": self.last_hit
+        }
+
+
+class SemanticAnswerCache:
+    """Bounded, TTL'd nearest-neighbour cache of question -> answer"""
+
+    def __init__(self, embedder: Embedder, threshold: float = 0.92, max_entries: int = 1000,
+                 ttl: float = 86400.0, enabled: bool = True):
+        if not (math.isfinite(threshold) and 0 < threshold <= 1):
+            raise ValueError(f"ANSWER_CACHE_THRESHOLD must be in (0, 1], got {threshold!r}")
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.enabled = enabled and embedder.available()
+
+        self._lock = threading.Lock()
+        self._matrix = None  # (max_entries, dim), allocated on first store
+        self._live = None  # bool mask of occupied slots
+        self._slots: List[Optional[_Entry]] = [None] * self.max_entries
+        self._by_id: Dict[str, _Entry] = {}
+
+        self.stats = {
+            "lookups": 0,
+            "hits": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+            "generation_seconds_saved": 0.0
+        }
+
+    @classmethod
+    def from_env(cls, embedder: Embedder) -> "SemanticAnswerCache":
+        return cls(
+            embedder,
+            threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92")),
+            max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000")),
+            ttl=float(os.getenv("ANSWER_CACHE_TTL", "86400")),
+            enabled=os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+        )
+
+    def _embed(self, question: str):
+        # Always on the request path: bounded, and a miss rather than a wait
+        vectors = self.embedder.embed([question.strip()], timeout=settings().embed_timeout)
+        return None if vectors is None else vectors[0]
+
+    def _matches(self, entry: Optional[_Entry], similarity: float, question: str) -> bool:
+        """Whether a nearest neighbour is close enough to count as the same question"""
+        if entry is None:
+            return False
+        if self.embedder.backend == "hash":
+            return entry.key == normalize_question(question)
+        return similarity >= self.threshold
+
+    def _nearest_locked(self, vector) -> Tuple[Optional[_Entry], float]:
+        if self._matrix is None or not self._live.any() or self._matrix.shape[1] != len(vector):
+            return None, 0.0
+        scores = self._matrix @ vector
+        scores[~self._live] = -np.inf
+        slot = int(np.argmax(scores))
+        return self._slots[slot], float(scores[slot])
+
+    def _remove_locked(self, entry: _Entry):
+        self._live[entry.slot] = False
+        self._slots[entry.slot] = None
+        self._by_id.pop(entry.entry_id, None)
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return not entry.pinned and now - entry.created_at > self.ttl
+
+    def lookup(self, question: str) -> Optional[Dict]:
+        """Cached answer for a near-duplicate question, or None"""
+        if not self.enabled:
+            return None
+        vector = self._embed(question)
+        if vector is None:
+            return None
+
+        now = time.time()
+        with self._lock:
+            self.stats["lookups"] += 1
+            entry, similarity = self._nearest_locked(vector)
+            if not self._matches(entry, similarity, question):
+                return None
+            if self._expired(entry, now):
+                self._remove_locked(entry)
+                self.stats["expired"] += 1
+                return None
+            entry.hits += 1
+            entry.last_hit = now
+            self.stats["hits"] += 1
+            self.stats["generation_seconds_saved"] += entry.generation_seconds
+            return {**entry.to_dict(), "similarity": round(similarity, 4)}
+
+    def store(self, question: str, answer: str, model: str, generation_seconds: float,
+              pinned: bool = False) -> Optional[str]:
+        """Cache an answer unless a near-duplicate is already cached; returns the entry id"""
+        if not self.enabled or not answer.strip():
+            return None
+        vector = self._embed(question)
+        if vector is None:
+            return None
+
+        now = time.time()
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != len(vector):
+                self._matrix = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+                self._live = np.zeros(self.max_entries, dtype=bool)
+                self._slots = [None] * self.max_entries
+                self._by_id = {}
+
+            existing, similarity = self._nearest_locked(vector)
+            if self._matches(existing, similarity, question) and not self._expired(existing, now):
+                if pinned and not existing.pinned:
+                    existing.pinned = True
+                return existing.entry_id
+
+            slot = self._free_slot_locked(now)
+            if slot is None:
+                return None
+            entry = _Entry(slot, question.strip(), answer, model, generation_seconds, pinned)
+            self._matrix[slot] = vector
+            self._live[slot] = True
+            self._slots[slot] = entry
+            self._by_id[entry.entry_id] = entry
+            self.stats["stores"] += 1
+            return entry.entry_id
+
+    def _free_slot_locked(self, now: float) -> Optional[int]:
+        """An empty slot, making room by expiry and then LRU eviction if needed"""
+        free = np.flatnonzero(~self._live)
+        if len(free):
+            return int(free[0])
+
+        for entry in list(self._by_id.values()):
+            if self._expired(entry, now):
+                self._remove_locked(entry)
+                self.stats["expired"] += 1
+        free = np.flatnonzero(~self._live)
+        if len(free):
+            return int(free[0])
+
+        candidates = [e for e in self._by_id.values() if not e.pinned]
+        if not candidates:
+            return None
+        victim = min(candidates, key=lambda e: e.last_hit)
+        self._remove_locked(victim)
+        self.stats["evictions"] += 1
+        return victim.slot
+
+    def set_pinned(self, entry_id: str, pinned: bool) -> bool:
+        with self._lock:
+            entry = self._by_id.get(entry_id)
+            if entry is None:
+                return False
+            entry.pinned = pinned
+            if not pinned:
+                entry.created_at = time.time()  # fresh TTL once unpinned
+            return True
+
+    def purge(self, entry_id: Optional[str] = None, include_pinned: bool = False) -> int:
+        """Remove one entry, or every entry (pinned ones only when asked)"""
+        with self._lock:
+            if entry_id is not None:
+                entry = self._by_id.get(entry_id)
+                if entry is None:
+                    return 0
+                self._remove_locked(entry)
+                return 1
+            victims = [e for e in self._by_id.values() if include_pinned or not e.pinned]
+            for entry in victims:
+                self._remove_locked(entry)
+            return len(victims)
+
+    def entries(self) -> List[Dict]:
+        """All entries, most hit first, for the admin view"""
+        with self._lock:
+            return sorted((e.to_dict() for e in self._by_id.values()), key=lambda e: -e["hits"])
+
+    def get_stats(self) -> Dict:
+        """Summary for /stats"""
+        with self._lock:
+            entries = len(self._by_id)
+            pinned = sum(1 for e in self._by_id.values() if e.pinned)
+        lookups = self.stats["lookups"]
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "match": "exact" if self.embedder.get_stats()["backend"] == "hash" else "similarity",
+            "entries": entries,
+            "pinned": pinned,
+            "max_entries": self.max_entries,
+            **self.stats,
+            "generation_seconds_saved": round(self.stats["generation_seconds_saved"], 2),
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0
+        }
+
+
+# Shared by the API and the Zoho webhook blueprint
+answer_cache = SemanticAnswerCache.from_env(embedder)
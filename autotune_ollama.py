@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Ollama Option Autotuner
+Benchmarks num_thread / num_batch / num_ctx / concurrency on this host and writes a recommended generation profile
+
+For every option combination the tuner streams a representative prompt set
+through /api/generate and records time-to-first-token plus Ollama's own
+prompt-eval and eval token rates. The best combination is written to
+generation_profile.json, which runtime_config loads at startup (and on
+reload) underneath config.json.
+
+Usage:
+    python autotune_ollama.py                                 # local Ollama, default sweep
+    python autotune_ollama.py --standin --quick               # CI: built-in stand-in server
+    python autotune_ollama.py --threads 2,4,8 --batch 256,512 --ctx 2048,4096 --concurrency 1,2
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+from itertools import product
+from typing import Dict, List, Optional
+
+import requests
+
+# Short, medium and long prompts shaped like real /chat traffic
+REPRESENTATIVE_PROMPTS = [
+    "User: Hi! What can you help me with?\nAssistant:",
+    "User: Can you explain the difference between a process and a thread in simple terms?\nAssistant:",
+    "User: I run a small online store. Write a friendly three-paragraph email announcing free shipping "
+    "for orders over $50 this weekend, and suggest a subject line.\nAssistant:",
+    "User: What is your return policy?\nAssistant: Items can be returned within 30 days of delivery.\n"
+    "User: And how long does the refund take once you receive the item? Please also explain what happens "
+    "if the item was damaged during shipping and whether I need to keep the original packaging.\nAssistant:"
+]
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generation_profile.json")
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def run_generation(base_url: str, model: str, prompt: str, options: Dict, keep_alive: str,
+                   timeout: float) -> Optional[Dict]:
+    """Stream one generation and return TTFT and token rates"""
+    started = time.time()
+    ttft = None
+    final = None
+
+    try:
+        with requests.post(
+            f"{base_url}/api/generate",
+            json={"model": model, "prompt": prompt, "stream": True, "options": options, "keep_alive": keep_alive},
+            stream=True,
+            timeout=timeout
+        ) as response:
+            if response.status_code != 200:
+                return None
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if ttft is None and chunk.get("response"):
+                    ttft = time.time() - started
+                if chunk.get("done"):
+                    final = chunk
+                    break
+    except (requests.RequestException, json.JSONDecodeError) as e:
+        print(f"   ⚠️ Generation failed: {e}")
+        return None
+
+    if not final:
+        return None
+
+    def rate(count_key, duration_key):
+        duration = final.get(duration_key) or 0
+        return final.get(count_key, 0) / (duration / 1e9) if duration else 0.0
+
+    return {
+        "ttft": ttft if ttft is not None else time.time() - started,
+        "wall": time.time() - started,
+        "prompt_eval_tps": rate("prompt_eval_count", "prompt_eval_duration"),
+        "eval_tps": rate("eval_count", "eval_duration"),
+        "eval_count": final.get("eval_count", 0),
+        "eval_seconds": (final.get("eval_duration") or 0) / 1e9,
+        "load_seconds": (final.get("load_duration") or 0) / 1e9
+    }
+
+
+def benchmark_combination(base_url: str, model: str, prompts: List[str], options: Dict,
+                          keep_alive: str, concurrency: int, repeats: int, timeout: float) -> Optional[Dict]:
+    """Run the prompt set `repeats` times with `concurrency` parallel clients"""
+    samples: List[Dict] = []
+    lock = threading.Lock()
+    work = [p for _ in range(repeats) for p in prompts]
+
+    def client(items):
+        for prompt in items:
+            result = run_generation(base_url, model, prompt, options, keep_alive, timeout)
+            if result:
+                with lock:
+                    samples.append(result)
+
+    threads = [threading.Thread(target=client, args=(work[i::concurrency],)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if not samples:
+        return None
+
+    # Ollama's own eval time, so client overhead (and stand-in time compression) doesn't skew it
+    eval_seconds = sum(s["eval_seconds"] for s in samples) / concurrency
+
+    ttfts = sorted(s["ttft"] for s in samples)
+    return {
+        "samples": len(samples),
+        "ttft_p50": round(statistics.median(ttfts), 3),
+        "ttft_p90": round(ttfts[min(len(ttfts) - 1, int(len(ttfts) * 0.9))], 3),
+        "prompt_eval_tps": round(statistics.median(s["prompt_eval_tps"] for s in samples), 2),
+        "eval_tps": round(statistics.median(s["eval_tps"] for s in samples), 2),
+        # Aggregate output rate across parallel clients; what the whole node delivers
+        "node_tokens_per_second": round(sum(s["eval_count"] for s in samples) / eval_seconds, 2) if eval_seconds else 0.0,
+        "load_seconds_max": round(max(s["load_seconds"] for s in samples), 3)
+    }
+
+
+def score(result: Dict, objective: str) -> float:
+    """Higher is better"""
+    if objective == "ttft":
+        return -result["ttft_p90"]
+    # Throughput, lightly penalising slow first tokens
+    return result["node_tokens_per_second"] / (1.0 + result["ttft_p50"] / 10.0)
+
+
+def build_profile(best: Dict, keep_alive: str) -> Dict:
+    """Generation profile entries for every route; sampling options stay as configured"""
+    tuned = {
+        "num_thread": best["options"]["num_thread"],
+        "num_batch": best["options"]["num_batch"],
+        "num_ctx": best["options"]["num_ctx"],
+        "keep_alive": keep_alive
+    }
+    return {route: dict(tuned) for route in ("chat", "stream", "webhook")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Ollama runtime options and write a recommended profile")
+    parser.add_argument("--url", default=None, help="Ollama base URL (default: configured ollama_base_url)")
+    parser.add_argument("--model", default=None, help="Model to tune (default: configured model_name)")
+    parser.add_argument("--threads", default=None, help="num_thread values, e.g. 2,4,8 (default: around CPU count)")
+    parser.add_argument("--batch", default="128,256,512", help="num_batch values")
+    parser.add_argument("--ctx", default="2048,4096", help="num_ctx values")
+    parser.add_argument("--concurrency", default="1,2", help="Parallel clients, i.e. GENERATION_CONCURRENCY x workers")
+    parser.add_argument("--keep-alive", default="30m", help="keep_alive written to the profile")
+    parser.add_argument("--num-predict", type=int, default=96, help="Output tokens per benchmark generation")
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--prompts", default=None, help="JSON file with a list of prompts")
+    parser.add_argument("--objective", choices=["throughput", "ttft"], default="throughput")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--dry-run", action="store_true", help="Print the recommendation without writing it")
+    parser.add_argument("--standin", action="store_true", help="Run against a built-in stand-in server (CI)")
+    parser.add_argument("--quick", action="store_true", help="Small sweep for smoke tests")
+    args = parser.parse_args()
+
+    from runtime_config import settings
+    config = settings()
+    base_url = (args.url or config.ollama_base_url).rstrip("/")
+    model = args.model or config.model_name
+
+    standin = None
+    if args.standin:
+        from ollama_standin import start_in_background
+        standin = start_in_background(port=0, speed=50.0, load_seconds=0.5)
+        base_url = f"http://127.0.0.1:{standin.server_address[1]}"
+
+    cpu_count = os.cpu_count() or 4
+    threads = _int_list(args.threads) if args.threads else sorted({max(1, cpu_count // 2), cpu_count, cpu_count + 2})
+    batches = _int_list(args.batch)
+    contexts = _int_list(args.ctx)
+    concurrencies = _int_list(args.concurrency)
+    if args.quick:
+        threads, batches, contexts, concurrencies = threads[:2], batches[-1:], contexts[:1], concurrencies[:1]
+
+    prompts = REPRESENTATIVE_PROMPTS
+    if args.prompts:
+        with open(args.prompts, "r", encoding="utf-8") as f:
+            prompts = json.load(f)
+
+    # num_ctx must hold the longest prompt plus the output budget
+    longest_prompt_tokens = max(len(p) // 4 for p in prompts)
+    contexts = [c for c in contexts if c >= longest_prompt_tokens + args.num_predict] or [max(contexts)]
+
+    combos = list(product(threads, batches, contexts, concurrencies))
+    print("🔧 OLLAMA AUTOTUNER")
+    print("=" * 50)
+    print(f"🔗 Ollama: {base_url}{' (stand-in)' if standin else ''}")
+    print(f"📊 Model: {model}")
+    print(f"🧮 {len(combos)} combinations × {len(prompts) * args.repeats} generations")
+
+    try:
+        tags = requests.get(f"{base_url}/api/tags", timeout=5)
+        tags.raise_for_status()
+    except requests.RequestException as e:
+        print(f"❌ Ollama is not reachable at {base_url}: {e}")
+        sys.exit(1)
+
+    # Warm the model once so the first combination doesn't pay the load
+    run_generation(base_url, model, prompts[0], {"num_predict": 1}, args.keep_alive, args.timeout)
+
+    results = []
+    for num_thread, num_batch, num_ctx, concurrency in combos:
+        options = {"num_thread": num_thread, "num_batch": num_batch, "num_ctx": num_ctx,
+                   "num_predict": args.num_predict, "temperature": 0.7}
+        print(f"\n🧪 threads={num_thread} batch={num_batch} ctx={num_ctx} concurrency={concurrency}")
+        result = benchmark_combination(base_url, model, prompts, options, args.keep_alive,
+                                       concurrency, args.repeats, args.timeout)
+        if not result:
+            print("   ❌ No successful generations")
+            continue
+        print(f"   TTFT p50 {result['ttft_p50']}s · eval {result['eval_tps']} tok/s · "
+              f"prompt {result['prompt_eval_tps']} tok/s · node {result['node_tokens_per_second']} tok/s")
+        results.append({"options": options, "concurrency": concurrency, **result})
+
+    if standin:
+        standin.shutdown()
+
+    if not results:
+        print("\n❌ Autotuning failed: no combination produced results")
+        sys.exit(1)
+
+    best = max(results, key=lambda r: score(r, args.objective))
+    report = {
+        "generation_profiles": build_profile(best, args.keep_alive),
+        "recommended_concurrency": best["concurrency"],
+        "autotune": {
+            "generated_at": datetime.now().isoformat(),
+            "host": platform.node(),
+            "cpu_count": cpu_count,
+            "ollama_url": base_url,
+            "model": model,
+            "objective": args.objective,
+            "standin": bool(standin),
+            "best": best,
+            "results": results
+        }
+    }
+
+    print("\n" + "=" * 50)
+    print("✅ RECOMMENDATION")
+    print("=" * 50)
+    print(json.dumps(report["generation_profiles"]["chat"], indent=2))
+    print(f"💡 Concurrency {best['concurrency']}: set GENERATION_CONCURRENCY × gunicorn workers to match")
+
+    if args.dry_run:
+        return
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"📝 Profile written to {args.output} (loaded by the API at startup and on SIGHUP)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Hot Path Microbenchmarks
+Times the in-memory session paths and the /chat and /stats handlers at growing session counts
+
+The API keeps every session in process memory, and several paths touch all of
+it (cleanup_old_sessions scans every session; /stats runs that scan and sums
+every conversation). This suite fills the session tables with a synthetic
+population at each scale, then times:
+
+    get_session_id, get_conversation_history, add_to_conversation,
+    build_context_prompt, cleanup_old_sessions      called directly
+    GET /stats, POST /chat                          through Flask's test client
+
+Ollama is stubbed out (a canned answer fed through the output guard), so only
+the API's own overhead is measured. Each operation reports latency percentiles
+and the peak memory it allocated (tracemalloc, in a separate pass so tracing
+doesn't skew the timings); each scale reports the population's footprint.
+
+Results are written as JSON. Pass a previous run as --baseline to fail
+(exit 1) when any operation's p50 regresses by more than --tolerance.
+
+Usage:
+    python benchmark_hot_paths.py                              # 10k, 100k, 1M sessions
+    python benchmark_hot_paths.py --quick                      # 1k and 10k, for CI
+    python benchmark_hot_paths.py --baseline old.json --tolerance 1.25
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results.json")
+
+QUESTIONS = [
+    "What is your return policy?",
+    "Can you explain the difference between a process and a thread?",
+    "How long does shipping to Germany take?",
+    "Write a short welcome message for new customers.",
+    "Do you offer discounts for students?"
+]
+ANSWERS = [
+    "Items can be returned within 30 days of delivery for a full refund.",
+    "A process has its own memory space; threads share the memory of the process that owns them.",
+    "Orders to Germany usually arrive in three to five business days.",
+    "Welcome aboard! We're glad you're here. Let us know if there's anything we can help with.",
+    "Yes, students get 10% off with a valid student email address."
+]
+CANNED_CHUNKS = ["Thanks ", "for ", "your ", "question! ", "Here ", "is ", "a ", "short ", "answer."]
+
+# Operations whose cost grows with the session count get fewer iterations
+SCAN_OPS = ("cleanup_old_sessions", "stats_handler")
+
+
+def _prepare_environment():
+    """Quiet, in-process settings; must run before the API module is imported"""
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ["STARTUP_WARM_MODEL"] = "false"  # no model warm-up request to a real Ollama
+    os.environ.setdefault("EMBEDDING_BACKEND", "hash")
+    os.environ.pop("PERSISTENCE_DIR", None)
+    os.environ.pop("DEBUG_TOKEN", None)
+
+
+def _stub_ollama(api):
+    """Replace the Ollama round trip with a canned, instantly streamed answer"""
+    def stream_generation(payload, timeout, guard, cancelled=None, on_text=None):
+        for chunk in CANNED_CHUNKS:
+            text = guard.feed(chunk)
+            if text and on_text:
+                on_text(text)
+        tail = guard.flush()
+        if tail and on_text:
+            on_text(tail)
+        return {"status_code": 200, "truncated": None, "last_chunk": CANNED_CHUNKS[-1],
+                "final": {"done": True, "done_reason": "stop", "eval_count": len(CANNED_CHUNKS)}}
+
+    api.stream_generation = stream_generation
+    # No /api/ps or /api/tags polling from the residency manager
+    api.residency.ps_interval = float("inf")
+    api.residency._tag_sizes = {}
+
+
+def populate(api, target: int, exchanges: int, rng: random.Random) -> List[str]:
+    """Grow the session tables to `target` sessions; returns all session IDs"""
+    now = datetime.now()
+    session_ids = list(api.session_metadata)
+    for i in range(len(session_ids), target):
+        session_id = f"bench_{i:08d}"
+        # Recent activity, so cleanup scans every session without removing any
+        last_activity = (now - timedelta(seconds=rng.randint(0, 3600))).isoformat()
+        history = []
+        for n in range(exchanges):
+            k = rng.randrange(len(QUESTIONS))
+            history.append({
+                "user": QUESTIONS[k],
+                "assistant": ANSWERS[k],
+                "timestamp": (now - timedelta(seconds=n)).isoformat()
+            })
+        api.conversations[session_id] = history
+        api.session_metadata[session_id] = {
+            "created_at": last_activity,
+            "last_activity": last_activity,
+            "message_count": exchanges,
+            "ip_address": f"10.0.{i // 256 % 256}.{i % 256}"
+        }
+        session_ids.append(session_id)
+    return session_ids
+
+
+def time_op(fn: Callable[[], None], iterations: int, time_budget: float) -> Dict:
+    """Latency percentiles (ms) over up to `iterations` calls within `time_budget` seconds"""
+    samples = []
+    deadline = time.perf_counter() + time_budget
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+        if len(samples) >= 3 and time.perf_counter() > deadline:
+            break
+    samples.sort()
+
+    def pct(p: float) -> float:
+        return round(samples[min(int(p * len(samples)), len(samples) - 1)], 4)
+
+    return {
+        "iterations": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(samples[-1], 4),
+        "ops_per_second": round(1000 / statistics.fmean(samples), 1) if statistics.fmean(samples) else None
+    }
+
+
+def peak_alloc(fn: Callable[[], None], iterations: int = 3) -> int:
+    """Largest transient allocation (bytes) of one call, measured under tracemalloc"""
+    peak = 0
+    tracemalloc.start()
+    try:
+        for _ in range(iterations):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            fn()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def build_ops(api, client, session_ids: List[str], rng: random.Random) -> Dict[str, Callable[[], None]]:
+    """The measured operations, each picking a random existing session"""
+    def pick() -> str:
+        return session_ids[rng.randrange(len(session_ids))]
+
+    def get_session_id():
+        api.get_session_id(SimpleNamespace(headers={"X-Session-ID": pick()}, remote_addr="127.0.0.1"))
+
+    def get_conversation_history():
+        api.get_conversation_history(pick())
+
+    def add_to_conversation():
+        session_id = pick()
+        api.add_to_conversation(session_id, rng.choice(QUESTIONS), rng.choice(ANSWERS))
+        # Keep the population's shape stable across iterations
+        api.conversations[session_id].pop()
+
+    def build_context_prompt():
+        api.build_context_prompt(pick(), rng.choice(QUESTIONS))
+
+    def cleanup_old_sessions():
+        api.cleanup_old_sessions()
+
+    def stats_handler():
+        response = client.get("/stats")
+        assert response.status_code == 200, response.status_code
+
+    def chat_handler():
+        session_id = pick()
+        response = client.post("/chat", json={"message": rng.choice(QUESTIONS)},
+                               headers={"X-Session-ID": session_id})
+        assert response.status_code == 200, response.get_data(as_text=True)
+        api.conversations[session_id].pop()
+
+    return {
+        "get_session_id": get_session_id,
+        "get_conversation_history": get_conversation_history,
+        "add_to_conversation": add_to_conversation,
+        "build_context_prompt": build_context_prompt,
+        "cleanup_old_sessions": cleanup_old_sessions,
+        "stats_handler": stats_handler,
+        "chat_handler": chat_handler
+    }
+
+
+def compare(results: List[Dict], baseline: Dict, tolerance: float) -> List[str]:
+    """Operations whose p50 grew past tolerance × the baseline's, per scale"""
+    previous = {(s["sessions"], op): r for s in baseline.get("scales", []) for op, r in s["operations"].items()}
+    regressions = []
+    for scale in results:
+        for op, result in scale["operations"].items():
+            before = previous.get((scale["sessions"], op))
+            if before and before["p50_ms"] > 0 and result["p50_ms"] > before["p50_ms"] * tolerance:
+                regressions.append(f"{op} @ {scale['sessions']:,} sessions: "
+                                   f"p50 {before['p50_ms']}ms -> {result['p50_ms']}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API's in-memory hot paths at several session counts")
+    parser.add_argument("--scales", default="10000,100000,1000000", help="Session counts, e.g. 10000,100000")
+    parser.add_argument("--exchanges", type=int, default=4, help="Exchanges per synthetic session")
+    parser.add_argument("--iterations", type=int, default=2000, help="Calls per constant-time operation")
+    parser.add_argument("--scan-iterations", type=int, default=20, help="Calls per full-scan operation")
+    parser.add_argument("--time-budget", type=float, default=10.0, help="Seconds per operation per scale")
+    parser.add_argument("--ops", default=None, help="Only these operations, comma separated")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=None, help="Earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Allowed p50 slowdown vs the baseline")
+    parser.add_argument("--quick", action="store_true", help="Small scales and few iterations for smoke tests")
+    args = parser.parse_args()
+
+    scales = sorted(int(s) for s in args.scales.split(",") if s.strip())
+    if args.quick:
+        scales, args.iterations, args.scan_iterations, args.time_budget = [1000, 10000], 200, 5, 2.0
+
+    _prepare_environment()
+    import fast_chatbot_api as api
+    _stub_ollama(api)
+    client = api.app.test_client()
+    rng = random.Random(args.seed)
+    selected = set(args.ops.split(",")) if args.ops else None
+
+    print("⏱️  HOT PATH BENCHMARKS")
+    print("=" * 50)
+    print(f"📊 Scales: {', '.join(f'{s:,}' for s in scales)} sessions × {args.exchanges} exchanges")
+
+    results = []
+    for scale in scales:
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        session_ids = populate(api, scale, args.exchanges, rng)
+        populate_seconds = time.perf_counter() - started
+        population_bytes = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        print(f"\n🧪 {scale:,} sessions (populated in {populate_seconds:.1f}s)")
+        operations = {}
+        for name, fn in build_ops(api, client, session_ids, rng).items():
+            if selected and name not in selected:
+                continue
+            fn()  # warm up
+            iterations = args.scan_iterations if name in SCAN_OPS else args.iterations
+            result = time_op(fn, iterations, args.time_budget)
+            result["peak_alloc_bytes"] = peak_alloc(fn)
+            operations[name] = result
+            print(f"   {name:<26} p50 {result['p50_ms']:>10.4f}ms  p99 {result['p99_ms']:>10.4f}ms  "
+                  f"peak {result['peak_alloc_bytes'] / 1024:>9.1f} KB")
+
+        results.append({
+            "sessions": scale,
+            "exchanges_per_session": args.exchanges,
+            "populate_seconds": round(populate_seconds, 3),
+            "population_bytes": population_bytes,
+            "bytes_per_session": round(population_bytes / max(scale, 1)),
+            # ru_maxrss is KB on Linux
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "operations": operations
+        })
+
+    report = {
+        "generated_at": datetime.now().isoformat(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "settings": {"iterations": args.iterations, "scan_iterations": args.scan_iterations,
+                     "time_budget": args.time_budget, "seed": args.seed},
+        "scales": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📝 Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) beyond {args.tolerance}× baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print(f"\n✅ No regressions beyond {args.tolerance}× baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,193 +2,533 @@
 """
 Nginx Configuration Diagnostic Script
 Checks nginx status, configuration, and proxy setup for the Personal AI Assistant
+
+Every check is registered with the @check decorator and runs on a thread pool,
+so a full diagnosis takes about as long as the slowest check rather than the
+sum of all of them. Each check has its own timeout; one that overruns is
+reported as timed out and the rest of the report is unaffected. A check can
+require another (nginx -t needs nginx installed) and is skipped when that one
+didn't pass.
+
+Besides reachability, the latency probes time GET /health and POST /chat
+through nginx and directly against the backend, so proxy overhead shows up as
+a number. The chat probes run real generations; --no-chat leaves them out.
+
+Output is the usual readable report, or JSON with --json (stdout) or
+--output FILE. Exits 1 when any check failed or timed out.
+
+Usage:
+    sudo python check_nginx.py
+    python check_nginx.py --json --no-chat
+    python check_nginx.py --probes 5 --output nginx_report.json
 """
 
+import argparse
+import json
 import os
-import sys
+import platform
+import socket
+import statistics
 import subprocess
-import requests
+import sys
 import time
-from pathlib import Path
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
 
-def print_header(title):
-    """Print a formatted header"""
-    print("\n" + "="*60)
-    print(f"🔧 {title}")
-    print("="*60)
+import requests
+
+BACKEND_URL = "http://127.0.0.1:5000"
+NGINX_URL = "http://127.0.0.1"
+
+SITE_AVAILABLE = "/etc/nginx/sites-available/personal-ai-assistant"
+SITE_ENABLED = "/etc/nginx/sites-enabled/personal-ai-assistant"
+NGINX_CONF = "/etc/nginx/nginx.conf"
+
+# Per-check timeout unless the check sets its own, seconds
+DEFAULT_TIMEOUT = 10.0
+
+STATUS_ICONS = {"ok": "✅", "warn": "⚠️", "fail": "❌", "skip": "⏭️", "timeout": "⏰"}
+
+SECTIONS = ["nginx", "config", "backend", "proxy", "latency", "firewall"]
+SECTION_TITLES = {
+    "nginx": "NGINX STATUS CHECK",
+    "config": "NGINX CONFIGURATION CHECK",
+    "backend": "BACKEND SERVER CHECK",
+    "proxy": "PROXY CONNECTION TEST",
+    "latency": "LATENCY PROBES (NGINX VS DIRECT)",
+    "firewall": "FIREWALL CHECK"
+}
+
+
+class CheckResult:
+    """Outcome of one check: status, one-line summary, optional detail text and data for the JSON report"""
 
-def run_command(command, description):
-    """Run a shell command and return the result"""
-    print(f"\n📋 {description}")
-    print(f"Command: {command}")
+    def __init__(self, status: str, summary: str, details: str = "", hint: str = "",
+                 data: Optional[Dict] = None):
+        self.status = status
+        self.summary = summary
+        self.details = details
+        self.hint = hint
+        self.data = data or {}
+
+
+class Check:
+    """A registered diagnostic"""
+
+    def __init__(self, name: str, section: str, func: Callable[["RunOptions"], CheckResult],
+                 timeout: float, requires: Optional[str]):
+        self.name = name
+        self.section = section
+        self.func = func
+        self.timeout = timeout
+        self.requires = requires
+
+
+class RunOptions:
+    """Settings the checks read"""
+
+    def __init__(self, backend_url: str = BACKEND_URL, nginx_url: str = NGINX_URL,
+                 probes: int = 3, chat: bool = True):
+        self.backend_url = backend_url.rstrip("/")
+        self.nginx_url = nginx_url.rstrip("/")
+        self.probes = probes
+        self.chat = chat
+
+
+CHECKS: List[Check] = []
+
+
+def check(name: str, section: str, timeout: float = DEFAULT_TIMEOUT, requires: Optional[str] = None):
+    """Register a check; it runs concurrently with every check it doesn't require"""
+    def decorator(func):
+        CHECKS.append(Check(name, section, func, timeout, requires))
+        return func
+    return decorator
+
+
+def run_command(command: str, timeout: float = DEFAULT_TIMEOUT, sudo: bool = False) -> CheckResult:
+    """Run a shell command; ok on exit status 0
+
+    sudo commands use `sudo -n` when not already root, so a password prompt
+    fails the check instead of hanging the whole run.
+    """
+    if sudo and os.geteuid() != 0:
+        command = f"sudo -n {command}"
     try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=10)
-        if result.returncode == 0:
-            print("✅ Success")
-            if result.stdout.strip():
-                print(f"Output:\n{result.stdout}")
-            return True, result.stdout
-        else:
-            print("❌ Failed")
-            if result.stderr.strip():
-                print(f"Error:\n{result.stderr}")
-            return False, result.stderr
+        result = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=timeout)
     except subprocess.TimeoutExpired:
-        print("⏰ Command timed out")
-        return False, "Timeout"
-    except Exception as e:
-        print(f"💥 Exception: {e}")
-        return False, str(e)
-
-def check_nginx_status():
-    """Check if nginx is running and configured correctly"""
-    print_header("NGINX STATUS CHECK")
-
-    # Check if nginx is installed
-    success, output = run_command("nginx -v", "Checking nginx version")
-    if not success:
-        print("❌ Nginx is not installed or not in PATH")
-        print("💡 Install nginx: sudo apt update && sudo apt install nginx")
+        return CheckResult("timeout", f"`{command}` timed out after {timeout:g}s")
+    output = (result.stdout + result.stderr).strip()
+    status = "ok" if result.returncode == 0 else "fail"
+    return CheckResult(status, f"`{command}` exited {result.returncode}", details=output,
+                       data={"command": command, "returncode": result.returncode})
+
+
+def port_open(url: str, timeout: float = 2.0) -> bool:
+    """Whether something accepts TCP connections at the URL's host and port"""
+    parsed = urlparse(url)
+    try:
+        with socket.create_connection((parsed.hostname, parsed.port or 80), timeout=timeout):
+            return True
+    except OSError:
         return False
 
-    # Check nginx status
-    run_command("sudo systemctl status nginx --no-pager -l", "Checking nginx service status")
 
-    # Check if nginx is listening on port 80
-    run_command("sudo netstat -tlnp | grep :80", "Checking if port 80 is in use")
+def percentiles(samples: List[float]) -> Dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "min": round(ordered[0], 1),
+        "p50": round(statistics.median(ordered), 1),
+        "max": round(ordered[-1], 1)
+    }
 
-    # Test nginx configuration
-    run_command("sudo nginx -t", "Testing nginx configuration syntax")
 
-    return True
+# ----------------------------------------------------------------------
+# Nginx status
+# ----------------------------------------------------------------------
 
-def check_nginx_config():
-    """Check nginx configuration files"""
-    print_header("NGINX CONFIGURATION CHECK")
+@check("nginx_installed", "nginx")
+def check_nginx_installed(options: RunOptions) -> CheckResult:
+    result = run_command("nginx -v")
+    if result.status != "ok":
+        result.summary = "Nginx is not installed or not in PATH"
+        result.hint = "Install nginx: sudo apt update && sudo apt install nginx"
+    else:
+        result.summary = result.details or "nginx found"
+    return result
 
-    config_paths = [
-        "/etc/nginx/sites-available/personal-ai-assistant",
-        "/etc/nginx/sites-enabled/personal-ai-assistant",
-        "/etc/nginx/nginx.conf"
-    ]
 
-    for config_path in config_paths:
-        if os.path.exists(config_path):
-            print(f"\n✅ Found: {config_path}")
-            try:
-                with open(config_path, 'r') as f:
-                    content = f.read()
-                    print(f"Content preview (first 500 chars):")
-                    print("-" * 40)
-                    print(content[:500])
-                    if len(content) > 500:
-                        print("... (truncated)")
-                    print("-" * 40)
-            except PermissionError:
-                print("❌ Permission denied reading config file")
-                print("💡 Try: sudo cat", config_path)
-        else:
-            print(f"❌ Missing: {config_path}")
-
-    # Check if site is enabled
-    sites_enabled = "/etc/nginx/sites-enabled/personal-ai-assistant"
-    sites_available = "/etc/nginx/sites-available/personal-ai-assistant"
-
-    if os.path.exists(sites_available) and not os.path.exists(sites_enabled):
-        print(f"\n⚠️ Site exists but not enabled")
-        print(f"💡 Enable with: sudo ln -s {sites_available} {sites_enabled}")
-    elif os.path.exists(sites_enabled):
-        print(f"\n✅ Site is enabled")
-
-def check_backend_server():
-    """Check if the Flask backend is running on port 5000"""
-    print_header("BACKEND SERVER CHECK")
-
-    # Check if port 5000 is in use
-    success, output = run_command("netstat -tlnp | grep :5000", "Checking if port 5000 is in use")
-
-    if not success or "5000" not in output:
-        print("❌ No service running on port 5000")
-        print("💡 Start the backend server first:")
-        print("   cd /path/to/your/project")
-        print("   python fast_chatbot_api.py")
-        return False
+@check("nginx_service", "nginx", requires="nginx_installed")
+def check_nginx_service(options: RunOptions) -> CheckResult:
+    result = run_command("systemctl is-active nginx")
+    result.summary = f"Service is {result.details or 'unknown'}"
+    if result.status != "ok":
+        result.hint = "sudo systemctl start nginx && sudo systemctl enable nginx"
+    return result
 
-    # Test backend endpoints
-    endpoints = [
-        "/health",
-        "/stats",
-        "/webhook/zoho"
-    ]
 
-    for endpoint in endpoints:
-        url = f"http://localhost:5000{endpoint}"
-        try:
-            print(f"\n🧪 Testing: {url}")
-            if endpoint == "/webhook/zoho":
-                # POST request for webhook
-                response = requests.post(url, json={
-                    "message": {"text": "test"},
-                    "visitor": {"id": "test"},
-                    "chat": {"sessionId": "test", "messageCount": 1}
-                }, timeout=5)
-            else:
-                # GET request for others
-                response = requests.get(url, timeout=5)
-
-            print(f"   Status: {response.status_code}")
-            if response.status_code == 200:
-                print("   ✅ Endpoint is working")
-            else:
-                print(f"   ⚠️ Unexpected status: {response.status_code}")
+@check("nginx_listening", "nginx")
+def check_nginx_listening(options: RunOptions) -> CheckResult:
+    if port_open(options.nginx_url):
+        return CheckResult("ok", f"Something is accepting connections at {options.nginx_url}")
+    return CheckResult("fail", f"Nothing is listening at {options.nginx_url}",
+                       hint="sudo systemctl start nginx; check for conflicts with: sudo ss -tlnp | grep :80")
+
+
+@check("nginx_config_syntax", "nginx", timeout=15, requires="nginx_installed")
+def check_nginx_config_syntax(options: RunOptions) -> CheckResult:
+    result = run_command("nginx -t", timeout=10, sudo=True)
+    result.summary = "Configuration syntax is valid" if result.status == "ok" else "nginx -t failed"
+    if result.status != "ok":
+        result.hint = "Fix the errors above, then: sudo systemctl reload nginx"
+    return result
+
+
+# ----------------------------------------------------------------------
+# Configuration files
+# ----------------------------------------------------------------------
 
+def read_config(path: str) -> Optional[str]:
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+@check("config_files", "config")
+def check_config_files(options: RunOptions) -> CheckResult:
+    found = {path: os.path.exists(path) for path in (SITE_AVAILABLE, SITE_ENABLED, NGINX_CONF)}
+    lines = [f"{'found' if exists else 'missing'}: {path}" for path, exists in found.items()]
+
+    if found[SITE_AVAILABLE] and not found[SITE_ENABLED]:
+        return CheckResult("warn", "Site exists but is not enabled", "\n".join(lines),
+                           hint=f"Enable with: sudo ln -s {SITE_AVAILABLE} {SITE_ENABLED}", data=found)
+    if not found[SITE_ENABLED]:
+        return CheckResult("fail", "No personal-ai-assistant site configured", "\n".join(lines),
+                           hint="Run deploy_port80.sh or use the configuration below", data=found)
+    return CheckResult("ok", "Site is enabled", "\n".join(lines), data=found)
+
+
+@check("config_proxy_rules", "config")
+def check_config_proxy_rules(options: RunOptions) -> CheckResult:
+    if not os.path.exists(SITE_ENABLED):
+        return CheckResult("skip", "No enabled site to inspect")
+    content = read_config(SITE_ENABLED)
+    if content is None:
+        return CheckResult("warn", "Permission denied reading the site config",
+                           hint=f"Try: sudo cat {SITE_ENABLED}")
+
+    missing = []
+    if "proxy_pass http://127.0.0.1:5000" not in content and "proxy_pass http://localhost:5000" not in content:
+        missing.append("proxy_pass to the backend on port 5000")
+    if "location /ws" not in content:
+        missing.append("location /ws (WebSocket transport)")
+    if "Upgrade" not in content:
+        missing.append("Upgrade/Connection headers for WebSockets")
+
+    preview = content[:500] + ("\n... (truncated)" if len(content) > 500 else "")
+    if missing:
+        return CheckResult("warn", "Missing: " + "; ".join(missing), preview,
+                           hint="Compare with the recommended configuration below", data={"missing": missing})
+    return CheckResult("ok", "Proxy, WebSocket and upgrade rules present", preview)
+
+
+# ----------------------------------------------------------------------
+# Backend
+# ----------------------------------------------------------------------
+
+@check("backend_listening", "backend")
+def check_backend_listening(options: RunOptions) -> CheckResult:
+    if port_open(options.backend_url):
+        return CheckResult("ok", f"Backend is accepting connections at {options.backend_url}")
+    return CheckResult("fail", f"No service running at {options.backend_url}",
+                       hint="Start the backend: sudo systemctl start personal-ai-assistant "
+                            "(or python start_server.py)")
+
+
+def endpoint_check(path: str, method: str = "GET", body: Optional[Dict] = None) -> Callable:
+    def run(options: RunOptions) -> CheckResult:
+        url = f"{options.backend_url}{path}"
+        started = time.perf_counter()
+        try:
+            response = requests.request(method, url, json=body, timeout=5)
         except requests.RequestException as e:
-            print(f"   ❌ Failed to connect: {e}")
+            return CheckResult("fail", f"{method} {path} failed to connect: {e}")
+        ms = (time.perf_counter() - started) * 1000
+        status = "ok" if response.status_code == 200 else "warn"
+        return CheckResult(status, f"{method} {path} → {response.status_code} in {ms:.0f}ms",
+                           data={"url": url, "status_code": response.status_code, "ms": round(ms, 1)})
+    return run
+
+
+check("backend_health", "backend", requires="backend_listening")(endpoint_check("/health"))
+check("backend_stats", "backend", requires="backend_listening")(endpoint_check("/stats"))
+check("backend_zoho_webhook", "backend", requires="backend_listening")(endpoint_check(
+    "/webhook/zoho", "POST", {
+        "message": {"text": "test"},
+        "visitor": {"id": "test"},
+        "chat": {"sessionId": "test", "messageCount": 1}
+    }
+))
 
-    return True
 
-def check_proxy_connection():
-    """Test the nginx proxy connection"""
-    print_header("PROXY CONNECTION TEST")
+# ----------------------------------------------------------------------
+# Proxy
+# ----------------------------------------------------------------------
 
-    # Test direct connection to backend
-    print("\n🧪 Testing direct backend connection...")
+def health_via(url: str) -> CheckResult:
     try:
-        response = requests.get("http://localhost:5000/health", timeout=5)
-        print(f"Direct backend: {response.status_code} - {response.json().get('status', 'Unknown')}")
-    except Exception as e:
-        print(f"Direct backend failed: {e}")
+        response = requests.get(f"{url}/health", timeout=5)
+    except requests.RequestException as e:
+        return CheckResult("fail", f"{url}/health failed: {e}")
+    try:
+        health = response.json().get("status", "unknown")
+    except ValueError:
+        health = "non-JSON response"
+    status = "ok" if response.status_code == 200 else "warn"
+    return CheckResult(status, f"{url}/health → {response.status_code} ({health})",
+                       data={"status_code": response.status_code, "health": health})
+
 
-    # Test nginx proxy connection
-    print("\n🧪 Testing nginx proxy connection...")
+@check("proxy_direct", "proxy")
+def check_proxy_direct(options: RunOptions) -> CheckResult:
+    return health_via(options.backend_url)
+
+
+@check("proxy_nginx", "proxy")
+def check_proxy_nginx(options: RunOptions) -> CheckResult:
+    result = health_via(options.nginx_url)
+    if result.status == "fail":
+        result.hint = "Nginx isn't reaching the backend; check the site config and sudo nginx -t"
+    return result
+
+
+@check("proxy_local_ip", "proxy")
+def check_proxy_local_ip(options: RunOptions) -> CheckResult:
     try:
-        response = requests.get("http://localhost/health", timeout=5)
-        print(f"Nginx proxy: {response.status_code} - {response.json().get('status', 'Unknown')}")
-    except Exception as e:
-        print(f"Nginx proxy failed: {e}")
+        local_ip = socket.gethostbyname(socket.gethostname())
+    except OSError as e:
+        return CheckResult("skip", f"Could not resolve the local IP: {e}")
+    result = health_via(f"http://{local_ip}")
+    if result.status == "fail":
+        result.status = "warn"
+        result.hint = "Check the firewall and that nginx listens on all interfaces"
+    return result
+
+
+# ----------------------------------------------------------------------
+# Latency: the same requests through nginx and straight to the backend
+# ----------------------------------------------------------------------
+
+def probe(method: str, url: str, body: Optional[Dict], timeout: float) -> Dict:
+    """One timed request: total and time to first byte, milliseconds"""
+    started = time.perf_counter()
+    with requests.request(method, url, json=body, timeout=timeout, stream=True) as response:
+        first_byte = None
+        for _ in response.iter_content(chunk_size=None):
+            if first_byte is None:
+                first_byte = time.perf_counter()
+        done = time.perf_counter()
+    return {
+        "status_code": response.status_code,
+        "total_ms": (done - started) * 1000,
+        "ttfb_ms": ((first_byte or done) - started) * 1000
+    }
+
+
+def compare_paths(options: RunOptions, method: str, path: str, body_for: Callable[[], Optional[Dict]],
+                  timeout: float) -> CheckResult:
+    """Alternate direct and nginx probes so both see the same backend load"""
+    targets = {"direct": options.backend_url, "nginx": options.nginx_url}
+    samples: Dict[str, List[float]] = {name: [] for name in targets}
+    errors: Dict[str, str] = {}
+
+    for _ in range(options.probes):
+        for name, base in targets.items():
+            if name in errors:
+                continue
+            try:
+                result = probe(method, f"{base}{path}", body_for(), timeout)
+            except requests.RequestException as e:
+                errors[name] = str(e)
+                continue
+            if result["status_code"] != 200:
+                errors[name] = f"HTTP {result['status_code']}"
+                continue
+            samples[name].append(result["total_ms"])
+
+    data = {name: percentiles(values) for name, values in samples.items()}
+    if errors:
+        data["errors"] = errors
+    if not samples["direct"] or not samples["nginx"]:
+        return CheckResult("fail", f"{method} {path} could not be timed on both paths: {errors}", data=data)
+
+    overhead = data["nginx"]["p50"] - data["direct"]["p50"]
+    data["nginx_overhead_ms"] = round(overhead, 1)
+    summary = (f"{method} {path} p50 direct {data['direct']['p50']:.0f}ms, "
+               f"nginx {data['nginx']['p50']:.0f}ms (overhead {overhead:+.0f}ms)")
+    return CheckResult("ok", summary, data=data)
+
+
+@check("latency_health", "latency", timeout=30)
+def check_latency_health(options: RunOptions) -> CheckResult:
+    result = compare_paths(options, "GET", "/health", lambda: None, timeout=5)
+    overhead = result.data.get("nginx_overhead_ms")
+    if overhead is not None and overhead > 50:
+        result.status = "warn"
+        result.hint = "Proxy overhead on a trivial request is high; check upstream keepalive and DNS in proxy_pass"
+    return result
+
+
+@check("latency_chat", "latency", timeout=300)
+def check_latency_chat(options: RunOptions) -> CheckResult:
+    if not options.chat:
+        return CheckResult("skip", "Chat probes disabled (--no-chat)")
+
+    def body():
+        # A fresh session and message per probe, so neither the answer cache nor history helps
+        return {"message": f"Diagnostic latency probe {uuid.uuid4().hex[:8]}. Reply with OK.",
+                "session_id": f"nginx_probe_{uuid.uuid4().hex[:12]}"}
+
+    return compare_paths(options, "POST", "/chat", body, timeout=120)
+
+
+# ----------------------------------------------------------------------
+# Firewall
+# ----------------------------------------------------------------------
+
+@check("firewall_ufw", "firewall")
+def check_firewall_ufw(options: RunOptions) -> CheckResult:
+    result = run_command("ufw status", sudo=True)
+    if result.status == "ok":
+        result.summary = result.details.splitlines()[0] if result.details else "ufw status read"
+        if "Status: active" in result.details and "80" not in result.details:
+            result.status = "warn"
+            result.hint = "sudo ufw allow 80 && sudo ufw allow 443"
+    return result
+
+
+@check("firewall_iptables", "firewall")
+def check_firewall_iptables(options: RunOptions) -> CheckResult:
+    result = run_command("iptables -L INPUT -n", sudo=True)
+    if result.status == "ok":
+        relevant = [line for line in result.details.splitlines()
+                    if any(f"dpt:{port}" in line for port in (80, 443, 5000))]
+        result.details = "\n".join(relevant)
+        result.summary = f"{len(relevant)} INPUT rules mention ports 80/443/5000"
+    return result
+
+
+# ----------------------------------------------------------------------
+# Runner
+# ----------------------------------------------------------------------
+
+def run_checks(options: RunOptions, checks: List[Check], workers: int = 8) -> Dict[str, Dict]:
+    """Run every check concurrently, respecting `requires`; results keyed by check name"""
+    results: Dict[str, Dict] = {}
+    pending = list(checks)
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="check")
+
+    def call(item: Check) -> CheckResult:
+        try:
+            return item.func(options)
+        except Exception as e:
+            return CheckResult("fail", f"Check raised {type(e).__name__}: {e}")
+
+    def record(item: Check, result: CheckResult, seconds: float):
+        results[item.name] = {
+            "name": item.name,
+            "section": item.section,
+            "status": result.status,
+            "summary": result.summary,
+            "details": result.details,
+            "hint": result.hint,
+            "seconds": round(seconds, 3),
+            "data": result.data
+        }
 
-    # Test from external IP if available
     try:
-        # Get external IP
-        import socket
-        hostname = socket.gethostname()
-        local_ip = socket.gethostbyname(hostname)
+        while pending or running:
+            for item in list(pending):
+                if item.requires and item.requires not in results:
+                    continue
+                pending.remove(item)
+                if item.requires and results[item.requires]["status"] != "ok":
+                    record(item, CheckResult("skip", f"Skipped: {item.requires} did not pass"), 0.0)
+                    continue
+                running[executor.submit(call, item)] = (item, time.monotonic())
+
+            if not running:
+                # Whatever is left requires a check that isn't part of this run
+                for item in pending:
+                    record(item, CheckResult("skip", f"Skipped: {item.requires} was not run"), 0.0)
+                break
+            now = time.monotonic()
+            next_deadline = min(started + item.timeout for item, started in running.values())
+            done, _ = wait(list(running), timeout=max(next_deadline - now, 0), return_when=FIRST_COMPLETED)
+
+            now = time.monotonic()
+            for future, (item, started) in list(running.items()):
+                if future in done:
+                    record(item, future.result(), now - started)
+                elif now - started >= item.timeout:
+                    # Left to finish in the background; the report doesn't wait for it
+                    record(item, CheckResult("timeout", f"No result within {item.timeout:g}s"), now - started)
+                else:
+                    continue
+                del running[future]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+def build_report(options: RunOptions, results: Dict[str, Dict], elapsed: float) -> Dict:
+    ordered = [results[item.name] for item in CHECKS if item.name in results]
+    counts = {status: 0 for status in STATUS_ICONS}
+    for result in ordered:
+        counts[result["status"]] += 1
+    latency = {result["name"]: result["data"] for result in ordered if result["section"] == "latency"}
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "host": platform.node(),
+        "backend_url": options.backend_url,
+        "nginx_url": options.nginx_url,
+        "elapsed_seconds": round(elapsed, 3),
+        "sequential_seconds": round(sum(result["seconds"] for result in ordered), 3),
+        "summary": counts,
+        "latency": latency,
+        "checks": ordered
+    }
+
 
-        print(f"\n🧪 Testing from local IP: {local_ip}")
-        response = requests.get(f"http://{local_ip}/health", timeout=5)
-        print(f"Local IP access: {response.status_code} - {response.json().get('status', 'Unknown')}")
-    except Exception as e:
-        print(f"Local IP test failed: {e}")
+def print_header(title):
+    """Print a formatted header"""
+    print("\n" + "="*60)
+    print(f"🔧 {title}")
+    print("="*60)
 
-def check_firewall():
-    """Check firewall settings"""
-    print_header("FIREWALL CHECK")
 
-    # Check ufw status
-    run_command("sudo ufw status", "Checking UFW firewall status")
+def print_report(report: Dict):
+    for section in SECTIONS:
+        entries = [result for result in report["checks"] if result["section"] == section]
+        if not entries:
+            continue
+        print_header(SECTION_TITLES[section])
+        for result in entries:
+            print(f"\n{STATUS_ICONS[result['status']]} {result['name']} ({result['seconds']:.2f}s): {result['summary']}")
+            if result["details"] and result["status"] != "ok":
+                print("   " + result["details"].replace("\n", "\n   "))
+            if result["hint"]:
+                print(f"   💡 {result['hint']}")
 
-    # Check iptables
-    run_command("sudo iptables -L INPUT -n | grep -E '(80|443|5000)'", "Checking iptables for relevant ports")
 
 def provide_solutions():
     """Provide common solutions for nginx issues"""
@@ -283,6 +623,20 @@ def create_nginx_config():
         proxy_busy_buffers_size 256k;
     }
 
+    # WebSocket transport: one long-lived connection per browser
+    location /ws {
+        proxy_pass http://127.0.0.1:5000/ws;
+        proxy_http_version 1.1;
+        proxy_set_header Upgrade $http_upgrade;
+        proxy_set_header Connection "upgrade";
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_buffering off;
+        proxy_read_timeout 3600s;
+        proxy_send_timeout 3600s;
+    }
+
     # Health check endpoint
     location /health {
         proxy_pass http://127.0.0.1:5000/health;
@@ -311,29 +665,58 @@ def create_nginx_config():
 
 def main():
     """Main diagnostic function"""
-    print("🔍 NGINX CONFIGURATION DIAGNOSTICS")
-    print("=" * 60)
-    print("This script will help diagnose nginx configuration issues")
-    print("for the Personal AI Assistant application.")
-
-    # Check if running as root/sudo for some commands
-    if os.geteuid() != 0:
-        print("\n⚠️ Some checks require sudo privileges")
-        print("💡 Run with: sudo python check_nginx.py")
-
-    # Run all checks
-    check_nginx_status()
-    check_nginx_config()
-    check_backend_server()
-    check_proxy_connection()
-    check_firewall()
-    provide_solutions()
-    create_nginx_config()
-
-    print("\n" + "="*60)
-    print("✅ DIAGNOSTICS COMPLETE")
-    print("="*60)
-    print("Review the output above to identify and fix any issues.")
+    parser = argparse.ArgumentParser(description="Diagnose nginx and backend setup for the Personal AI Assistant")
+    parser.add_argument("--backend-url", default=BACKEND_URL, help="Backend base URL, bypassing nginx")
+    parser.add_argument("--nginx-url", default=NGINX_URL, help="Base URL through nginx")
+    parser.add_argument("--probes", type=int, default=3, help="Latency probes per path and endpoint")
+    parser.add_argument("--no-chat", action="store_true", help="Skip the /chat latency probes (no generations)")
+    parser.add_argument("--only", default=None, help="Only these sections, comma separated: " + ",".join(SECTIONS))
+    parser.add_argument("--workers", type=int, default=8, help="Checks run at once")
+    parser.add_argument("--json", action="store_true", help="Print the JSON report instead of the text report")
+    parser.add_argument("--output", default=None, help="Also write the JSON report here")
+    args = parser.parse_args()
+
+    options = RunOptions(args.backend_url, args.nginx_url, max(args.probes, 1), chat=not args.no_chat)
+    sections = set(args.only.split(",")) if args.only else set(SECTIONS)
+    checks = [item for item in CHECKS if item.section in sections]
+    # A required check outside the selected sections still has to run
+    names = {item.name for item in checks}
+    checks += [item for item in CHECKS if item.name not in names
+               and any(other.requires == item.name for other in checks)]
+
+    if not args.json:
+        print("🔍 NGINX CONFIGURATION DIAGNOSTICS")
+        print("=" * 60)
+        print(f"Running {len(checks)} checks concurrently...")
+        if os.geteuid() != 0:
+            print("\n⚠️ Some checks require sudo privileges")
+            print("💡 Run with: sudo python check_nginx.py")
+
+    started = time.monotonic()
+    results = run_checks(options, checks, args.workers)
+    report = build_report(options, results, time.monotonic() - started)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+        if report["summary"]["fail"] or report["summary"]["warn"] or report["summary"]["timeout"]:
+            provide_solutions()
+            create_nginx_config()
+
+        counts = ", ".join(f"{count} {status}" for status, count in report["summary"].items() if count)
+        print("\n" + "="*60)
+        print(f"✅ DIAGNOSTICS COMPLETE in {report['elapsed_seconds']:.1f}s "
+              f"({report['sequential_seconds']:.1f}s of checks): {counts}")
+        print("="*60)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        if not args.json:
+            print(f"\n📝 Report written to {args.output}")
+
+    sys.exit(1 if report["summary"]["fail"] or report["summary"]["timeout"] else 0)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Context Retrieval
+Picks the past exchanges most relevant to a new message, on top of the most recent turns
+
+Each exchange is embedded once, in the background, when it is stored. Every
+session keeps its vectors as one float16 matrix with a row per exchange, so
+scoring a new message against the whole history is a single matrix-vector
+product. build_context_prompt then sends the top-k relevant older exchanges
+plus the last few turns instead of only the last few turns.
+
+Exchanges restored from persistence (no vectors yet) are embedded in one
+background batch the first time their session needs retrieval. Only the query
+vector is embedded on the request path, within the caller's timeout (see
+Embedder.embed); when it can't be had in time, selection returns nothing and
+the prompt falls back to the recent turns alone.
+
+Environment:
+    RETRIEVAL_ENABLED       true | false (default true; needs numpy)
+    RETRIEVAL_MAX_ROWS      vectors kept per session (default 200)
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+
+from embeddings import Embedder, embedder, np
+
+logger = logging.getLogger(__name__)
+
+
+def exchange_text(exchange: Dict) -> str:
+    """What gets embedded for an exchange"""
+    return f"{exchange.get('user', '')}\n{exchange.get('assistant', '')}"
+
+
+class _SessionIndex:
+    """Vectors for one session's exchanges, keyed by exchange timestamp"""
+
+    __slots__ = ("keys", "positions", "matrix", "backend")
+
+    def __init__(self, dim: int, backend: str):
+        self.keys: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.matrix = np.zeros((0, dim), dtype=np.float16)
+        self.backend = backend
+
+    def upsert(self, keys: List[str], vectors: "np.ndarray", max_rows: int):
+        new_rows = []
+        for key, vector in zip(keys, vectors):
+            position = self.positions.get(key)
+            if position is not None:
+                self.matrix[position] = vector
+            else:
+                new_rows.append((key, vector))
+        if new_rows:
+            self.matrix = np.vstack([self.matrix, np.asarray([v for _, v in new_rows], dtype=np.float16)])
+            self.keys.extend(k for k, _ in new_rows)
+        if len(self.keys) > max_rows:
+            self.keys = self.keys[-max_rows:]
+            self.matrix = self.matrix[-max_rows:]
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+
+
+class ContextRetriever:
+    """Per-session vector indexes over conversation history"""
+
+    def __init__(self, embedder: Embedder, enabled: bool = True, max_rows: int = 200):
+        self.embedder = embedder
+        self.enabled = enabled and embedder.available()
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, _SessionIndex] = {}
+        self._backfilling: Set[str] = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedder") if self.enabled else None
+        self.stats = {"indexed": 0, "retrievals": 0, "selected": 0, "backfilled": 0}
+
+    @classmethod
+    def from_env(cls, embedder: Embedder) -> "ContextRetriever":
+        return cls(
+            embedder,
+            enabled=os.getenv("RETRIEVAL_ENABLED", "true").lower() == "true",
+            max_rows=int(os.getenv("RETRIEVAL_MAX_ROWS", "200"))
+        )
+
+    def index_exchange(self, session_id: str, exchange: Dict):
+        """Embed a stored (or updated) exchange off the request path"""
+        if self.enabled:
+            self._executor.submit(self._index, session_id, [exchange])
+
+    def _index(self, session_id: str, exchanges: List[Dict]) -> bool:
+        vectors = self.embedder.embed([exchange_text(e) for e in exchanges])
+        if vectors is None:
+            return False
+        backend = self.embedder.backend
+        with self._lock:
+            index = self._indexes.get(session_id)
+            if index is None or index.backend != backend or index.matrix.shape[1] != vectors.shape[1]:
+                index = self._indexes[session_id] = _SessionIndex(vectors.shape[1], backend)
+            index.upsert([e["timestamp"] for e in exchanges], vectors, self.max_rows)
+            self.stats["indexed"] += len(exchanges)
+        return True
+
+    def _backfill(self, session_id: str, exchanges: List[Dict]):
+        try:
+            if self._index(session_id, exchanges):
+                self.stats["backfilled"] += len(exchanges)
+        finally:
+            with self._lock:
+                self._backfilling.discard(session_id)
+
+    def select(self, session_id: str, query: str, candidates: List[Dict], top_k: int,
+               min_similarity: float, timeout: float = 1.0) -> List[Dict]:
+        """Up to top_k candidate exchanges most similar to the query, in conversation order
+
+        Waits at most `timeout` seconds for the query embedding; candidates not
+        indexed yet are embedded in the background and left out this time.
+        """
+        if not self.enabled or not candidates or top_k <= 0:
+            return []
+
+        with self._lock:
+            index = self._indexes.get(session_id)
+            known = set(index.positions) if index else set()
+            missing = [e for e in candidates if e.get("timestamp") not in known]
+            backfill = bool(missing) and session_id not in self._backfilling
+            if backfill:
+                self._backfilling.add(session_id)
+        if backfill:
+            # History restored from disk; embed it in one batch off the request path
+            self._executor.submit(self._backfill, session_id, missing)
+        if len(missing) == len(candidates):
+            return []
+
+        query_vector = self.embedder.embed([query], timeout=timeout)
+        if query_vector is None:
+            return []
+
+        with self._lock:
+            index = self._indexes.get(session_id)
+            if index is None:
+                return []
+            rows = [index.positions.get(e.get("timestamp")) for e in candidates]
+            usable = [i for i, row in enumerate(rows) if row is not None]
+            if not usable:
+                return []
+            matrix = index.matrix[[rows[i] for i in usable]].astype(np.float32)
+
+        scores = matrix @ query_vector[0]
+        k = min(top_k, len(usable))
+        best = np.argpartition(-scores, k - 1)[:k]
+        chosen = sorted(usable[i] for i in best if scores[i] >= min_similarity)
+
+        self.stats["retrievals"] += 1
+        self.stats["selected"] += len(chosen)
+        return [candidates[i] for i in chosen]
+
+    def discard(self, session_id: str):
+        with self._lock:
+            self._indexes.pop(session_id, None)
+            self._backfilling.discard(session_id)
+
+    def get_stats(self) -> Dict:
+        """Summary for /stats"""
+        with self._lock:
+            sessions = len(self._indexes)
+            rows = sum(len(index.keys) for index in self._indexes.values())
+            matrix_bytes = sum(index.matrix.nbytes for index in self._indexes.values())
+        retrievals = self.stats["retrievals"]
+        return {
+            "enabled": self.enabled,
+            "sessions": sessions,
+            "vectors": rows,
+            "matrix_bytes": matrix_bytes,
+            **self.stats,
+            "avg_selected": round(self.stats["selected"] / retrievals, 2) if retrievals else 0.0,
+            "embedder": self.embedder.get_stats()
+        }
+
+
+retriever = ContextRetriever.from_env(embedder)
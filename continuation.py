@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Continuations
+Resume state for answers that stopped early, so /chat/continue can pick up where they ended
+
+An answer is truncated when Ollama stops on num_predict (done_reason
+"length"), the read times out or the connection drops mid-stream, or the
+client goes away. The partial text is kept in the conversation with
+"truncated": true; this module keeps what is needed to resume it without
+regenerating what was already produced:
+
+    context     Ollama's token context from the final chunk. The resume call
+                sends it back (minus the last token) with the last streamed
+                chunk as a raw prompt, so the model carries on from exactly
+                the same tokens and the runner can reuse its cached prefix.
+    fallback    Without a context (timeouts, cancellations, or state lost in a
+                restart) the original prompt plus the partial answer is sent
+                as a raw prompt, which costs a prompt eval but no regeneration.
+
+Only each session's latest exchange can be continued, and state is bounded
+by RESUME_MAX_SESSIONS (least recently used dropped first).
+"""
+
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# Reasons an answer is stored as truncated
+TRUNCATION_REASONS = ("length", "timeout", "interrupted", "cancelled")
+
+
+class ContinuationStore:
+    """Bounded per-session resume state for the latest truncated answer"""
+
+    def __init__(self, max_sessions: int = 2000):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._states: "OrderedDict[str, Dict]" = OrderedDict()
+        self.stats = {
+            "truncated": {},
+            "continued": 0,
+            "continued_with_context": 0,
+            "continued_from_text": 0,
+            "tokens_reused": 0
+        }
+
+    @classmethod
+    def from_env(cls) -> "ContinuationStore":
+        return cls(max_sessions=int(os.getenv("RESUME_MAX_SESSIONS", "2000")))
+
+    def save(self, session_id: str, reason: str, model: str, route: str, prompt: str,
+             final: Dict, last_chunk: str, tokens: int):
+        """Remember how to resume a truncated answer"""
+        context = final.get("context") or []
+        state = {
+            "reason": reason,
+            "model": model,
+            "route": route,
+            "prompt": prompt,
+            # array('i') keeps a 4k-token context at 16 KB instead of ~140 KB of ints
+            "context": array("i", context) if context and last_chunk else None,
+            "last_chunk": last_chunk,
+            "tokens": tokens
+        }
+        with self._lock:
+            self._states[session_id] = state
+            self._states.move_to_end(session_id)
+            while len(self._states) > self.max_sessions:
+                self._states.popitem(last=False)
+            self.stats["truncated"][reason] = self.stats["truncated"].get(reason, 0) + 1
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._states.get(session_id)
+
+    def discard(self, session_id: str):
+        with self._lock:
+            self._states.pop(session_id, None)
+
+    def build_payload(self, state: Optional[Dict], partial: str, fallback_prompt: str) -> Dict:
+        """/api/generate fields that continue `partial` (raw, so no chat template is re-applied)"""
+        if state and state.get("context"):
+            # Context minus its last token, then that token's text as the prompt
+            return {"context": list(state["context"][:-1]), "prompt": state["last_chunk"], "raw": True}
+
+        prompt = state["prompt"] if state and state.get("prompt") else fallback_prompt
+        separator = "" if partial[:1].isspace() else " "
+        return {"prompt": f"{prompt}{separator}{partial}", "raw": True}
+
+    def record_continuation(self, state: Optional[Dict], payload: Dict):
+        with self._lock:
+            self.stats["continued"] += 1
+            if "context" in payload:
+                self.stats["continued_with_context"] += 1
+            else:
+                self.stats["continued_from_text"] += 1
+            if state:
+                self.stats["tokens_reused"] += state.get("tokens", 0)
+
+    def get_stats(self) -> Dict:
+        """Summary for /stats"""
+        with self._lock:
+            return {
+                "resumable_sessions": len(self._states),
+                **self.stats,
+                "truncated": dict(self.stats["truncated"])
+            }
+
+
+# Shared by /chat, /chat/stream and /chat/continue
+continuations = ContinuationStore.from_env()
@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+"""
+Conversation Persistence
+Write-behind append log with compacted snapshots so conversations survive service restarts
+
+Layout of the persistence directory:
+    snapshot.jsonl              compacted state, one session per line
+    journal-<pid>-<n>.log       append-only segments, one record per line
+
+Every process writes its own segments and holds an flock on the active one.
+Any segment that can be locked is no longer being written and is folded into
+the snapshot by whichever process wins compact.lock.
+
+A worker that drains (lifecycle.py) flushes its journal and then touches the
+handover marker. Workers already running notice the new mtime and catch up
+on whatever other processes appended since their restore, so sessions
+finished by the old worker continue on the new one with full history.
+
+With gunicorn's preload_app the master restores once and its workers
+inherit the result; each worker refreshes it (journal catch-up, or a full
+restore if the snapshot was compacted meanwhile) before it starts writing.
+"""
+
+import fcntl
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "snapshot.jsonl"
+COMPACT_LOCK_FILE = "compact.lock"
+HANDOVER_FILE = "handover"
+SEGMENT_PATTERN = "journal-*.log"
+
+# Writer batching limits
+MAX_BATCH_RECORDS = 512
+QUEUE_POLL_SECONDS = 0.2
+
+# How often the request path may stat the handover marker
+HANDOVER_CHECK_SECONDS = 1.0
+
+
+def _apply_exchange(conversations: Dict[str, List[Dict]], session_metadata: Dict[str, Dict],
+                    session_id: str, exchange: Dict, metadata: Optional[Dict], max_length: int):
+    """Apply a journaled exchange; one already present is replaced (continued answers are re-recorded)"""
+    history = conversations.setdefault(session_id, [])
+
+    # Replays can overlap with the snapshot after an interrupted compaction
+    for i, existing in enumerate(history):
+        if existing.get("timestamp") == exchange.get("timestamp") and existing.get("user") == exchange.get("user"):
+            history[i] = exchange
+            if metadata:
+                session_metadata[session_id] = metadata
+            return
+
+    history.append(exchange)
+    if len(history) > max_length:
+        conversations[session_id] = history[-max_length:]
+
+    if metadata:
+        session_metadata[session_id] = metadata
+
+
+def _apply_record(conversations: Dict[str, List[Dict]], session_metadata: Dict[str, Dict],
+                  record: Dict, max_length: int):
+    """Apply a single journal record to the given state"""
+    session_id = record.get("s")
+    if not session_id:
+        return
+
+    if record.get("op") == "x":
+        _apply_exchange(conversations, session_metadata, session_id,
+                        record["x"], record.get("m"), max_length)
+    elif record.get("op") == "d":
+        conversations.pop(session_id, None)
+        session_metadata.pop(session_id, None)
+
+
+def _read_segment(path: str) -> List[Dict]:
+    """Read all complete records from a journal segment"""
+    records = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Torn write at the tail of a crashed segment
+                    continue
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def _read_segment_from(path: str, offset: int) -> tuple:
+    """Complete records appended after `offset`, and the offset to continue from"""
+    records = []
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return records, offset
+
+    # A line without its newline is still being written; pick it up next time
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].splitlines():
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return records, offset + end
+
+
+def _read_snapshot(path: str, conversations: Dict[str, List[Dict]], session_metadata: Dict[str, Dict]) -> int:
+    """Load a snapshot file into the given state and return the session count"""
+    loaded = 0
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                session_id = entry.get("s")
+                if not session_id:
+                    continue
+                conversations[session_id] = entry.get("c", [])
+                if entry.get("m"):
+                    session_metadata[session_id] = entry["m"]
+                loaded += 1
+    except FileNotFoundError:
+        pass
+    return loaded
+
+
+class ConversationStore:
+    """Durable, write-behind persistence for conversations and session metadata"""
+
+    def __init__(self, directory: str, fsync_interval: float = 1.0,
+                 snapshot_interval: float = 300.0, max_length: int = 25):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.snapshot_interval = snapshot_interval
+        self.max_length = max_length
+
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._segment = None
+        self._segment_path = ""
+        self._segment_number = 0
+
+        # Bytes of each journal segment already applied to the in-memory state
+        self._offsets: Dict[str, int] = {}
+        self._handover_mtime = 0.0
+        self._handover_checked = 0.0
+        self._snapshot_mtime = 0.0
+
+        self.stats = {
+            "records_written": 0,
+            "fsyncs": 0,
+            "snapshots": 0,
+            "last_snapshot_seconds": 0.0,
+            "restored_sessions": 0,
+            "restore_seconds": 0.0,
+            "write_errors": 0,
+            "handovers_seen": 0,
+            "handover_records": 0
+        }
+
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, max_length: int = 25) -> Optional["ConversationStore"]:
+        """Create a store from PERSISTENCE_* environment variables, or None if disabled"""
+        directory = os.getenv("PERSISTENCE_DIR", "").strip()
+        if not directory:
+            return None
+
+        return cls(
+            directory,
+            fsync_interval=float(os.getenv("PERSISTENCE_FSYNC_INTERVAL", "1.0")),
+            snapshot_interval=float(os.getenv("PERSISTENCE_SNAPSHOT_INTERVAL", "300")),
+            max_length=max_length
+        )
+
+    # ------------------------------------------------------------------
+    # Request path: enqueue only, never touches disk
+    # ------------------------------------------------------------------
+
+    def record_exchange(self, session_id: str, exchange: Dict, metadata: Optional[Dict] = None):
+        """Queue an exchange for the background writer"""
+        self._queue.put(("x", session_id, exchange, dict(metadata) if metadata else None, time.time()))
+
+    def record_removal(self, session_id: str):
+        """Queue a session removal for the background writer"""
+        self._queue.put(("d", session_id, None, None, time.time()))
+
+    # ------------------------------------------------------------------
+    # Startup restore
+    # ------------------------------------------------------------------
+
+    def restore(self, conversations: Dict[str, List[Dict]], session_metadata: Dict[str, Dict]) -> int:
+        """Rebuild state from the snapshot plus every journal segment on disk"""
+        started = time.time()
+
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        self._snapshot_mtime = os.path.getmtime(snapshot_path) if os.path.exists(snapshot_path) else 0.0
+        _read_snapshot(snapshot_path, conversations, session_metadata)
+
+        records = []
+        for path in glob.glob(os.path.join(self.directory, SEGMENT_PATTERN)):
+            segment_records, self._offsets[path] = _read_segment_from(path, 0)
+            records.extend(segment_records)
+        self._handover_mtime = self._marker_mtime()
+
+        # Segments from different workers interleave; wall-clock order is what clients saw
+        records.sort(key=lambda r: r.get("t", 0))
+        for record in records:
+            _apply_record(conversations, session_metadata, record, self.max_length)
+
+        elapsed = time.time() - started
+        self.stats["restored_sessions"] = len(conversations)
+        self.stats["restore_seconds"] = round(elapsed, 3)
+        logger.info("Restored %d sessions (%d journal records) in %.2fs", len(conversations), len(records), elapsed)
+        return len(conversations)
+
+    def refresh(self, conversations: Dict[str, List[Dict]], session_metadata: Dict[str, Dict]) -> int:
+        """Bring state restored in another process (a preloading gunicorn master) up to date
+
+        Journal records written since are a cheap catch-up. If the snapshot was
+        compacted in the meantime, the segments folded into it are gone and
+        only a full restore sees them.
+        """
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        mtime = os.path.getmtime(snapshot_path) if os.path.exists(snapshot_path) else 0.0
+        if mtime == self._snapshot_mtime:
+            return self.catch_up(conversations, session_metadata)
+
+        conversations.clear()
+        session_metadata.clear()
+        self._offsets.clear()
+        return self.restore(conversations, session_metadata)
+
+    # ------------------------------------------------------------------
+    # Handover between workers
+    # ------------------------------------------------------------------
+
+    def _marker_mtime(self) -> float:
+        try:
+            return os.path.getmtime(os.path.join(self.directory, HANDOVER_FILE))
+        except OSError:
+            return 0.0
+
+    def mark_handover(self):
+        """Tell the other workers this process has flushed its journal for good"""
+        marker = os.path.join(self.directory, HANDOVER_FILE)
+        tmp_path = f"{marker}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"pid": os.getpid(), "t": time.time(), "segment": os.path.basename(self._segment_path)}, f)
+        os.replace(tmp_path, marker)
+
+    def catch_up_if_handed_over(self, conversations: Dict[str, List[Dict]],
+                                session_metadata: Dict[str, Dict]) -> int:
+        """Cheap request-path check: catch up once another worker has marked a handover"""
+        now = time.time()
+        if now - self._handover_checked < HANDOVER_CHECK_SECONDS:
+            return 0
+        self._handover_checked = now
+        mtime = self._marker_mtime()
+        if mtime == self._handover_mtime:
+            return 0
+        self._handover_mtime = mtime
+        self.stats["handovers_seen"] += 1
+        return self.catch_up(conversations, session_metadata)
+
+    def catch_up(self, conversations: Dict[str, List[Dict]], session_metadata: Dict[str, Dict]) -> int:
+        """Apply records other processes appended since restore (or the last catch-up)
+
+        Only journal segments are followed: records another process folded
+        into the snapshot between two catch-ups are picked up at the next
+        restart, not here.
+        """
+        own_prefix = f"journal-{os.getpid()}-"
+        paths = set(glob.glob(os.path.join(self.directory, SEGMENT_PATTERN)))
+        records = []
+        for path in paths:
+            if os.path.basename(path).startswith(own_prefix):
+                continue
+            segment_records, self._offsets[path] = _read_segment_from(path, self._offsets.get(path, 0))
+            records.extend(segment_records)
+        for path in set(self._offsets) - paths:
+            del self._offsets[path]
+
+        records.sort(key=lambda r: r.get("t", 0))
+        for record in records:
+            _apply_record(conversations, session_metadata, record, self.max_length)
+
+        self.stats["handover_records"] += len(records)
+        if records:
+            logger.info("Caught up on %d journal records from other workers", len(records))
+        return len(records)
+
+    # ------------------------------------------------------------------
+    # Background writer
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Start the background writer thread"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stopping.clear()
+        self._open_segment()
+        self._thread = threading.Thread(target=self._run, name="conversation-store", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 5.0):
+        """Flush pending records and stop the writer"""
+        if not self._thread:
+            return
+
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _open_segment(self):
+        """Open and lock a fresh journal segment for this process"""
+        self._segment_number += 1
+        self._segment_path = os.path.join(
+            self.directory, f"journal-{os.getpid()}-{int(time.time())}-{self._segment_number}.log"
+        )
+        # Lock before the file becomes visible to compaction under its journal name
+        pending_path = self._segment_path + ".new"
+        self._segment = open(pending_path, "a", encoding="utf-8")
+        fcntl.flock(self._segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.replace(pending_path, self._segment_path)
+
+    def _rotate_segment(self):
+        """Seal the active segment so it becomes eligible for compaction"""
+        old = self._segment
+        self._open_segment()
+        if old:
+            old.flush()
+            os.fsync(old.fileno())
+            fcntl.flock(old.fileno(), fcntl.LOCK_UN)
+            old.close()
+
+    def _drain(self, block: bool) -> List[tuple]:
+        """Pull a batch of queued records"""
+        batch = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=QUEUE_POLL_SECONDS))
+            while len(batch) < MAX_BATCH_RECORDS:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write_batch(self, batch: List[tuple]):
+        """Serialize and append a batch of records with a single write"""
+        lines = []
+        for op, session_id, exchange, metadata, ts in batch:
+            record = {"op": op, "s": session_id, "t": ts}
+            if exchange is not None:
+                record["x"] = exchange
+            if metadata is not None:
+                record["m"] = metadata
+            lines.append(json.dumps(record, separators=(",", ":")))
+
+        self._segment.write("\n".join(lines) + "\n")
+        self.stats["records_written"] += len(batch)
+
+    def _run(self):
+        """Writer loop: batch writes, fsync on an interval, snapshot periodically"""
+        last_fsync = time.time()
+        last_snapshot = time.time()
+        dirty = False
+
+        while True:
+            stopping = self._stopping.is_set()
+            batch = self._drain(block=not stopping)
+
+            try:
+                if batch:
+                    self._write_batch(batch)
+                    dirty = True
+
+                now = time.time()
+                if dirty and (now - last_fsync >= self.fsync_interval or stopping):
+                    self._segment.flush()
+                    os.fsync(self._segment.fileno())
+                    self.stats["fsyncs"] += 1
+                    last_fsync = now
+                    dirty = False
+
+                if now - last_snapshot >= self.snapshot_interval:
+                    self._rotate_segment()
+                    self.compact()
+                    last_snapshot = now
+            except OSError as e:
+                self.stats["write_errors"] += 1
+                logger.error("Conversation store write failed: %s", e)
+
+            if stopping and not batch:
+                break
+
+        if self._segment:
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+            fcntl.flock(self._segment.fileno(), fcntl.LOCK_UN)
+            self._segment.close()
+            self._segment = None
+
+    # ------------------------------------------------------------------
+    # Compaction
+    # ------------------------------------------------------------------
+
+    def compact(self) -> bool:
+        """Fold sealed segments into a new snapshot; returns False if another process is compacting"""
+        lock_path = os.path.join(self.directory, COMPACT_LOCK_FILE)
+        with open(lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+
+            started = time.time()
+            sealed = []
+            records = []
+            for path in glob.glob(os.path.join(self.directory, SEGMENT_PATTERN)):
+                if path == self._segment_path:
+                    continue
+                with open(path, "r", encoding="utf-8") as segment:
+                    try:
+                        # Active segments of live workers stay locked
+                        fcntl.flock(segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    sealed.append(path)
+                records.extend(_read_segment(path))
+
+            if not sealed:
+                return True
+
+            conversations: Dict[str, List[Dict]] = {}
+            session_metadata: Dict[str, Dict] = {}
+            snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+            _read_snapshot(snapshot_path, conversations, session_metadata)
+
+            records.sort(key=lambda r: r.get("t", 0))
+            for record in records:
+                _apply_record(conversations, session_metadata, record, self.max_length)
+
+            tmp_path = snapshot_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for session_id, history in conversations.items():
+                    entry = {"s": session_id, "c": history, "m": session_metadata.get(session_id)}
+                    f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, snapshot_path)
+
+            # A crash before this point only means the segments are replayed idempotently
+            for path in sealed:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+            elapsed = time.time() - started
+            self.stats["snapshots"] += 1
+            self.stats["last_snapshot_seconds"] = round(elapsed, 3)
+            logger.info("Compacted %d journal segments into snapshot (%d sessions) in %.2fs",
+                        len(sealed), len(conversations), elapsed)
+            return True
+
+    def get_stats(self) -> Dict:
+        """Persistence statistics for /stats"""
+        return {
+            **self.stats,
+            "enabled": True,
+            "directory": self.directory,
+            "pending_records": self._queue.qsize()
+        }
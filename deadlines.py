@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Request Deadlines
+Per-request deadlines and throughput-based output budgets
+
+A deadline comes from the caller when it says how long it will wait
+(X-Request-Timeout: seconds, or X-Request-Deadline: unix time), otherwise from
+the route default in runtime_config (chat_deadline, stream_deadline,
+webhook_deadline; 0 disables). Header values that aren't finite positive
+numbers are ignored. Deadlines can only shorten the server's own
+OLLAMA_TIMEOUT (WEBHOOK_TIMEOUT for the webhook), never extend it.
+
+Once a request gets a slot, its num_predict is capped so that, at the measured
+tokens per second for that model, generation should finish before the
+deadline. Requests with too little time left to produce a useful answer are
+dropped instead of started.
+
+While the worker drains (lifecycle.py) every deadline is additionally capped
+at the end of the drain budget via Deadline.cap_all().
+"""
+
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from generation_scheduler import DeadlineExceeded
+
+# Seconds kept back for the response to travel back through nginx
+SAFETY_MARGIN = 1.0
+
+# Below this many output tokens an answer isn't worth starting
+MIN_USEFUL_TOKENS = 32
+
+# Weight of the newest measurement in the moving averages
+EWMA_ALPHA = 0.2
+
+
+def _header_seconds(req, name: str) -> Optional[float]:
+    """A finite, positive number from a request header, else None"""
+    try:
+        value = float(req.headers.get(name, ""))
+    except ValueError:
+        return None
+    return value if math.isfinite(value) and value > 0 else None
+
+
+class Deadline:
+    """Absolute point in time after which nobody is waiting for the answer"""
+
+    __slots__ = ("_expires_at", "source")
+
+    # Process-wide cap on every deadline, set when the worker starts draining
+    ceiling: Optional[float] = None
+
+    def __init__(self, expires_at: Optional[float], source: str = "none"):
+        self._expires_at = expires_at
+        self.source = source
+
+    @classmethod
+    def cap_all(cls, at: Optional[float]):
+        """Cap every deadline, existing and future, at `at` (None lifts the cap)"""
+        cls.ceiling = at
+
+    @property
+    def expires_at(self) -> Optional[float]:
+        if Deadline.ceiling is None:
+            return self._expires_at
+        return Deadline.ceiling if self._expires_at is None else min(self._expires_at, Deadline.ceiling)
+
+    @classmethod
+    def for_request(cls, req, route: str, config) -> "Deadline":
+        """Deadline from the request headers, else the route default, capped by the Ollama timeout"""
+        now = time.time()
+        ceiling = now + (config.webhook_timeout if route == "webhook" else config.ollama_timeout)
+
+        expires_at, source = None, "none"
+        if req.headers.get("X-Request-Deadline"):
+            expires_at = _header_seconds(req, "X-Request-Deadline")
+        elif req.headers.get("X-Request-Timeout"):
+            timeout = _header_seconds(req, "X-Request-Timeout")
+            expires_at = now + timeout if timeout is not None else None
+        if expires_at is not None:
+            source = "header"
+
+        if expires_at is None:
+            default = config.deadline_for(route)
+            if default > 0:
+                expires_at, source = now + default, "route"
+
+        if expires_at is None or expires_at > ceiling:
+            return cls(ceiling, source if expires_at is not None else "timeout")
+        return cls(expires_at, source)
+
+    def remaining(self) -> float:
+        """Seconds left, never negative"""
+        return max(self.expires_at - time.time(), 0.0) if self.expires_at else float("inf")
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    def timeout(self, default: float) -> float:
+        """HTTP timeout for the Ollama call: no point waiting past the deadline"""
+        return max(min(default, self.remaining()), 1.0)
+
+
+class ThroughputTracker:
+    """Moving averages of Ollama's prompt-eval and eval token rates, per model"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rates: Dict[str, Dict[str, float]] = {}
+        self._listeners: List[Callable[[str, Dict], None]] = []
+        self.stats = {
+            "capped": 0,
+            "tokens_trimmed": 0,
+            "dropped_before_start": 0,
+            "by_source": {}
+        }
+
+    def on_record(self, callback: Callable[[str, Dict], None]):
+        """Register callback(model, result) for every final chunk recorded"""
+        self._listeners.append(callback)
+
+    def record(self, model: str, result: Dict):
+        """Update the averages from a final /api/generate chunk or response"""
+        for callback in self._listeners:
+            callback(model, result)
+
+        updates = {}
+        if result.get("eval_count") and result.get("eval_duration"):
+            updates["eval_tps"] = result["eval_count"] / (result["eval_duration"] / 1e9)
+        if result.get("prompt_eval_count") and result.get("prompt_eval_duration"):
+            updates["prompt_tps"] = result["prompt_eval_count"] / (result["prompt_eval_duration"] / 1e9)
+        if not updates:
+            return
+
+        with self._lock:
+            rates = self._rates.setdefault(model, {})
+            for key, value in updates.items():
+                rates[key] = value if key not in rates else (1 - EWMA_ALPHA) * rates[key] + EWMA_ALPHA * value
+
+    def note_source(self, deadline: Deadline):
+        """Count where request deadlines come from"""
+        by_source = self.stats["by_source"]
+        by_source[deadline.source] = by_source.get(deadline.source, 0) + 1
+
+    def cap_num_predict(self, model: str, num_predict: int, prompt_tokens: int, deadline: Deadline) -> int:
+        """Largest output budget expected to finish before the deadline
+
+        Raises DeadlineExceeded when not even MIN_USEFUL_TOKENS would fit.
+        Without a measured rate for the model the budget is left alone.
+        """
+        if deadline.expires_at is None:
+            return num_predict
+
+        available = deadline.remaining() - SAFETY_MARGIN
+        with self._lock:
+            rates = dict(self._rates.get(model, {}))
+
+        if available <= 0:
+            self.stats["dropped_before_start"] += 1
+            raise DeadlineExceeded("Deadline passed before generation started")
+
+        eval_tps = rates.get("eval_tps")
+        if not eval_tps:
+            return num_predict
+
+        if rates.get("prompt_tps"):
+            available -= prompt_tokens / rates["prompt_tps"]
+        affordable = int(available * eval_tps)
+
+        if affordable < MIN_USEFUL_TOKENS:
+            self.stats["dropped_before_start"] += 1
+            raise DeadlineExceeded(f"Only ~{max(affordable, 0)} tokens fit before the deadline")
+        if affordable < num_predict:
+            self.stats["capped"] += 1
+            self.stats["tokens_trimmed"] += num_predict - affordable
+            return affordable
+        return num_predict
+
+    def get_stats(self) -> Dict:
+        """Summary for /stats"""
+        with self._lock:
+            rates = {model: {k: round(v, 2) for k, v in r.items()} for model, r in self._rates.items()}
+        return {**self.stats, "measured_rates": rates}
+
+
+# Shared by the API and the Zoho webhook blueprint
+throughput = ThroughputTracker()
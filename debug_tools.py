@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Debug Tools
+On-demand sampling profiler, tracemalloc snapshots and thread dumps for a running worker
+
+Everything here is inert until called: the profiler samples only for the
+requested window and tracemalloc only traces between /debug/memory/start and
+/debug/memory/stop. The blueprint is registered only when DEBUG_TOKEN is set,
+and every request must carry a matching X-Debug-Token header.
+
+Endpoints (all under /debug):
+    GET  /profile?seconds=10&interval_ms=5   collapsed stacks, ready for flamegraph.pl / speedscope
+    POST /memory/start?frames=10             start tracemalloc
+    GET  /memory/snapshot                    top allocations + tracked structure sizes; becomes the diff baseline
+    GET  /memory/diff                        growth since the baseline snapshot
+    POST /memory/stop                        stop tracemalloc and drop snapshots
+    GET  /threads                            stack of every thread
+"""
+
+import hmac
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+from flask import Blueprint, Response, jsonify, request
+
+debug_bp = Blueprint('debug', __name__, url_prefix='/debug')
+
+MAX_PROFILE_SECONDS = 60
+MIN_INTERVAL_MS = 1
+MAX_TRACE_FRAMES = 50
+MAX_STAT_ROWS = 500
+GROUP_BY = ("filename", "lineno", "traceback")
+
+# Named structures whose size is reported with every memory snapshot
+_tracked_structures: Dict[str, Callable[[], object]] = {}
+_profile_lock = threading.Lock()
+_baseline: Optional[tracemalloc.Snapshot] = None
+_baseline_sizes: Dict[str, Dict] = {}
+
+
+def debug_enabled() -> bool:
+    """The debug surface exists only when DEBUG_TOKEN is configured"""
+    return bool(os.getenv("DEBUG_TOKEN", ""))
+
+
+def track_structure(name: str, getter: Callable[[], object]):
+    """Register a structure (by getter, so reassignment is followed) for memory attribution"""
+    _tracked_structures[name] = getter
+
+
+@debug_bp.before_request
+def check_debug_token():
+    """Reject requests without the configured token"""
+    expected = os.getenv("DEBUG_TOKEN", "")
+    provided = request.headers.get("X-Debug-Token", "")
+    if not expected or not hmac.compare_digest(provided.encode(), expected.encode()):
+        return jsonify({"success": False, "error": "Unauthorized"}), 401
+    return None
+
+
+def _positive_arg(name: str, default, cast=float):
+    """Query parameter as a finite positive number; ValueError (reported as a 400) otherwise"""
+    raw = request.args.get(name)
+    if raw is None:
+        return default
+    try:
+        value = cast(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be a number")
+    if not (math.isfinite(value) and value > 0):
+        raise ValueError(f"{name} must be positive")
+    return value
+
+
+def _stats_args():
+    """limit and group_by for the memory endpoints"""
+    limit = min(_positive_arg("limit", 25, int), MAX_STAT_ROWS)
+    group_by = request.args.get("group_by", "lineno")
+    if group_by not in GROUP_BY:
+        raise ValueError(f"group_by must be one of {', '.join(GROUP_BY)}")
+    return limit, group_by
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample_stacks(seconds: float, interval: float, include_idle: bool = False) -> Counter:
+    """Sample every other thread's stack and count collapsed stack strings"""
+    counts: Counter = Counter()
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    deadline = time.perf_counter() + seconds
+
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if not include_idle and stack and stack[0].startswith(("wait (threading.py", "select (", "accept (")):
+                continue
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+
+    return counts
+
+
+@debug_bp.route('/profile', methods=['GET', 'POST'])
+def profile():
+    """Time-boxed sampling profile of this worker in collapsed-stack format"""
+    try:
+        seconds = min(_positive_arg("seconds", 10.0), MAX_PROFILE_SECONDS)
+        # No longer than the window, so at least one sample is taken and sleep() never overflows
+        interval = min(max(_positive_arg("interval_ms", 5.0), MIN_INTERVAL_MS) / 1000.0, seconds)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    include_idle = request.args.get("idle", "false").lower() == "true"
+
+    if not _profile_lock.acquire(blocking=False):
+        return jsonify({"success": False, "error": "A profile is already running"}), 409
+    try:
+        counts = sample_stacks(seconds, interval, include_idle)
+    finally:
+        _profile_lock.release()
+
+    body = "\n".join(f"{stack} {count}" for stack, count in counts.most_common())
+    return Response(body + "\n", mimetype="text/plain", headers={
+        "X-Profile-Seconds": str(seconds),
+        "X-Profile-Samples": str(sum(counts.values())),
+        "X-Worker-PID": str(os.getpid())
+    })
+
+
+def deep_sizeof(obj, seen: Optional[set] = None) -> int:
+    """Approximate retained size of a container tree"""
+    seen = seen if seen is not None else set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+    return total
+
+
+def structure_sizes() -> Dict[str, Dict]:
+    """Entry count and approximate deep size of each tracked structure"""
+    sizes = {}
+    for name, getter in _tracked_structures.items():
+        try:
+            value = getter()
+            sizes[name] = {
+                "entries": len(value) if hasattr(value, "__len__") else None,
+                "bytes": deep_sizeof(value)
+            }
+        except Exception as e:
+            sizes[name] = {"error": str(e)}
+    return sizes
+
+
+def _format_stats(stats: List, limit: int) -> List[Dict]:
+    rows = []
+    for stat in stats[:limit]:
+        frame = stat.traceback[0]
+        row = {
+            "location": f"{frame.filename}:{frame.lineno}",
+            "size_bytes": stat.size,
+            "count": stat.count
+        }
+        if hasattr(stat, "size_diff"):
+            row["size_diff_bytes"] = stat.size_diff
+            row["count_diff"] = stat.count_diff
+        rows.append(row)
+    return rows
+
+
+@debug_bp.route('/memory/start', methods=['POST'])
+def memory_start():
+    """Start tracing allocations"""
+    try:
+        frames = min(_positive_arg("frames", 10, int), MAX_TRACE_FRAMES)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    if tracemalloc.is_tracing():
+        return jsonify({"success": True, "tracing": True, "message": "Already tracing"})
+    tracemalloc.start(frames)
+    return jsonify({"success": True, "tracing": True, "frames": frames})
+
+
+@debug_bp.route('/memory/snapshot', methods=['GET'])
+def memory_snapshot():
+    """Top allocation sites and tracked structure sizes; stored as the diff baseline"""
+    global _baseline, _baseline_sizes
+    if not tracemalloc.is_tracing():
+        return jsonify({"success": False, "error": "tracemalloc is not running; POST /debug/memory/start"}), 409
+
+    try:
+        limit, group_by = _stats_args()
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+
+    _baseline = snapshot
+    _baseline_sizes = structure_sizes()
+
+    return jsonify({
+        "success": True,
+        "traced_bytes": current,
+        "traced_peak_bytes": peak,
+        "structures": _baseline_sizes,
+        "top": _format_stats(snapshot.statistics(group_by), limit)
+    })
+
+
+@debug_bp.route('/memory/diff', methods=['GET'])
+def memory_diff():
+    """Allocation growth since the baseline snapshot, with per-structure growth"""
+    if not tracemalloc.is_tracing() or _baseline is None:
+        return jsonify({"success": False, "error": "Take a baseline with /debug/memory/snapshot first"}), 409
+
+    try:
+        limit, group_by = _stats_args()
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    snapshot = tracemalloc.take_snapshot()
+    sizes = structure_sizes()
+
+    growth = {}
+    for name, now in sizes.items():
+        before = _baseline_sizes.get(name, {})
+        if "bytes" in now and "bytes" in before:
+            growth[name] = {
+                "bytes_diff": now["bytes"] - before["bytes"],
+                "entries_diff": (now["entries"] or 0) - (before.get("entries") or 0)
+            }
+
+    return jsonify({
+        "success": True,
+        "structures": sizes,
+        "structure_growth": growth,
+        "top": _format_stats(snapshot.compare_to(_baseline, group_by), limit)
+    })
+
+
+@debug_bp.route('/memory/stop', methods=['POST'])
+def memory_stop():
+    """Stop tracing and release snapshots"""
+    global _baseline, _baseline_sizes
+    _baseline, _baseline_sizes = None, {}
+    tracemalloc.stop()
+    return jsonify({"success": True, "tracing": False})
+
+
+@debug_bp.route('/threads', methods=['GET'])
+def threads():
+    """Current stack of every thread in this worker"""
+    names = {t.ident: (t.name, t.daemon) for t in threading.enumerate()}
+    dump = []
+    for thread_id, frame in sys._current_frames().items():
+        name, daemon = names.get(thread_id, (f"thread-{thread_id}", None))
+        dump.append({
+            "thread_id": thread_id,
+            "name": name,
+            "daemon": daemon,
+            "stack": traceback.format_stack(frame)
+        })
+    return jsonify({"success": True, "pid": os.getpid(), "threads": dump})
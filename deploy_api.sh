@@ -36,11 +36,19 @@ After=network.target ollama.service
 Requires=ollama.service
 
 [Service]
-Type=simple
+# Ready as soon as a worker can serve (startup.py), not when the process has merely started
+Type=notify
+NotifyAccess=all
+TimeoutStartSec=60
 User=$USER
 WorkingDirectory=/home/$USER/personal-ai-assistant
 Environment=PATH=/home/$USER/personal-ai-assistant/venv/bin
-ExecStart=/home/$USER/personal-ai-assistant/venv/bin/gunicorn --bind 0.0.0.0:5000 --workers 2 --timeout 650 --keep-alive 2 --max-requests 1000 --max-requests-jitter 50 fast_chatbot_api:app
+ExecStart=/home/$USER/personal-ai-assistant/venv/bin/gunicorn -c gunicorn.conf.py --bind 0.0.0.0:5000 fast_chatbot_api:app
+ExecReload=/bin/kill -s HUP \$MAINPID
+# SIGTERM goes to the gunicorn master only; it gives workers DRAIN_BUDGET
+# (gunicorn.conf.py) to finish in-flight generations before they exit
+KillMode=mixed
+TimeoutStopSec=150
 Restart=always
 RestartSec=3
 
@@ -54,8 +62,7 @@ sudo systemctl daemon-reload
 sudo systemctl enable personal-ai-assistant
 sudo systemctl start personal-ai-assistant
 
-# Wait for service to start
-sleep 5
+# The unit is Type=notify: start returns once a worker is serving
 
 # Check service status
 if sudo systemctl is-active --quiet personal-ai-assistant; then
@@ -77,6 +77,20 @@ server {
         proxy_busy_buffers_size 256k;
     }
 
+    # WebSocket transport: one long-lived connection per browser
+    location /ws {
+        proxy_pass http://127.0.0.1:5000/ws;
+        proxy_http_version 1.1;
+        proxy_set_header Upgrade \$http_upgrade;
+        proxy_set_header Connection "upgrade";
+        proxy_set_header Host \$host;
+        proxy_set_header X-Real-IP \$remote_addr;
+        proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
+        proxy_buffering off;
+        proxy_read_timeout 3600s;
+        proxy_send_timeout 3600s;
+    }
+
     # Health check endpoint
     location /health {
         proxy_pass http://127.0.0.1:5000/health;
@@ -109,11 +123,19 @@ After=network.target ollama.service
 Requires=ollama.service
 
 [Service]
-Type=simple
+# Ready as soon as a worker can serve (startup.py), not when the process has merely started
+Type=notify
+NotifyAccess=all
+TimeoutStartSec=60
 User=$ACTUAL_USER
 WorkingDirectory=/home/$ACTUAL_USER/personal-ai-assistant
 Environment=PATH=/home/$ACTUAL_USER/personal-ai-assistant/venv/bin
-ExecStart=/home/$ACTUAL_USER/personal-ai-assistant/venv/bin/gunicorn --workers 2 --bind 127.0.0.1:5000 --timeout 650 --keep-alive 2 --max-requests 1000 --max-requests-jitter 50 fast_chatbot_api:app
+ExecStart=/home/$ACTUAL_USER/personal-ai-assistant/venv/bin/gunicorn -c gunicorn.conf.py fast_chatbot_api:app
+ExecReload=/bin/kill -s HUP \$MAINPID
+# SIGTERM goes to the gunicorn master only; it gives workers DRAIN_BUDGET
+# (gunicorn.conf.py) to finish in-flight generations before they exit
+KillMode=mixed
+TimeoutStopSec=150
 Restart=always
 RestartSec=3
 StandardOutput=journal
@@ -146,8 +168,7 @@ systemctl enable nginx
 systemctl restart personal-ai-assistant
 systemctl restart nginx
 
-# Wait a moment for services to start
-sleep 3
+# The unit is Type=notify: restart returns once a worker is serving
 
 # Check service status
 echo "📊 Service Status:"
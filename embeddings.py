@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Embeddings
+Sentence vectors from Ollama's local embedding endpoint, with a hashing fallback
+
+Backends:
+    ollama   POST /api/embed (batch) on the configured Ollama, e.g. nomic-embed-text
+    hash     signed feature hashing of word unigrams and bigrams; no model, ~20 us per text
+    auto     probe Ollama once, then stick with whichever backend worked
+
+Vectors from different backends live in different spaces, so a process
+settles on one backend and keeps it; callers that store vectors also keep the
+backend name next to them.
+
+Embeds on the request path (a query vector for retrieval, an answer cache
+lookup) pass a timeout and stay out of the way of generation: they never run
+the auto probe inline (it starts in the background and the caller falls back),
+never load the embedding model (only background indexing does that, through
+the residency manager like any other model), and wait at most `timeout`.
+
+Environment:
+    EMBEDDING_BACKEND   auto | ollama | hash (default auto)
+    EMBEDDING_MODEL     Ollama embedding model (default nomic-embed-text)
+    EMBEDDING_DIM       hash backend dimension (default 256)
+"""
+
+import logging
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+import requests
+
+try:
+    import numpy as np
+except ImportError:  # retrieval and the semantic cache switch off without numpy
+    np = None
+
+from model_residency import residency
+from runtime_config import settings
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"\w+")
+
+# Longest text sent for embedding; the start of an exchange carries its topic
+MAX_EMBED_CHARS = 2000
+
+
+def hash_embed(texts: List[str], dim: int = 256) -> "np.ndarray":
+    """L2-normalized signed feature-hashing vectors of unigrams and bigrams"""
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = WORD_RE.findall(text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        counts: Dict[str, int] = {}
+        for feature in features:
+            counts[feature] = counts.get(feature, 0) + 1
+        for feature, count in counts.items():
+            h = zlib.crc32(feature.encode())
+            sign = 1.0 if h & 0x80000000 else -1.0
+            matrix[row, h % dim] += sign * (1.0 + math.log(count))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-9)
+
+
+class Embedder:
+    """Embeds batches of texts with the configured backend"""
+
+    def __init__(self, backend: str = "auto", model: str = "nomic-embed-text", dim: int = 256,
+                 timeout: float = 10.0):
+        self.requested = backend
+        self.model = model
+        self.dim = dim
+        self.timeout = timeout
+        self._backend: Optional[str] = None if backend == "auto" else backend
+        self._lock = threading.Lock()
+        self._probing = False
+        self.stats = {"texts": 0, "batches": 0, "failures": 0, "skipped": 0, "seconds": 0.0}
+
+    @classmethod
+    def from_env(cls) -> "Embedder":
+        return cls(
+            backend=os.getenv("EMBEDDING_BACKEND", "auto").lower(),
+            model=os.getenv("EMBEDDING_MODEL", "nomic-embed-text"),
+            dim=int(os.getenv("EMBEDDING_DIM", "256"))
+        )
+
+    @staticmethod
+    def available() -> bool:
+        return np is not None
+
+    @property
+    def backend(self) -> str:
+        """Resolved backend; probes Ollama on first use in auto mode"""
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    try:
+                        self._ollama_embed(["probe"])
+                        self._backend = "ollama"
+                    except (requests.RequestException, ValueError, KeyError) as e:
+                        logger.info("Ollama embeddings unavailable (%s); using hash embeddings", e)
+                        self._backend = "hash"
+        return self._backend
+
+    def _probe_in_background(self):
+        with self._lock:
+            if self._probing or self._backend is not None:
+                return
+            self._probing = True
+        threading.Thread(target=lambda: self.backend, name="embedder-probe", daemon=True).start()
+
+    def embed(self, texts: List[str], timeout: Optional[float] = None) -> Optional["np.ndarray"]:
+        """(len(texts), dim) float32 unit vectors, or None if embedding failed
+
+        With a timeout (request path), returns None instead of probing the
+        backend or loading the embedding model, and waits at most that long.
+        """
+        if np is None or not texts:
+            return None
+        if timeout is not None:
+            if timeout <= 0 or self._backend is None:
+                self._probe_in_background()
+                self.stats["skipped"] += 1
+                return None
+            if self._backend == "ollama" and self.model not in residency.hot_models():
+                self.stats["skipped"] += 1
+                return None
+        texts = [t[:MAX_EMBED_CHARS] for t in texts]
+        started = time.perf_counter()
+        try:
+            if self.backend == "ollama":
+                vectors = self._ollama_embed(texts, timeout)
+            else:
+                vectors = hash_embed(texts, self.dim)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            self.stats["failures"] += 1
+            logger.warning("Embedding failed: %s", e)
+            return None
+        self.stats["texts"] += len(texts)
+        self.stats["batches"] += 1
+        self.stats["seconds"] += time.perf_counter() - started
+        return vectors
+
+    def _ollama_embed(self, texts: List[str], timeout: Optional[float] = None) -> "np.ndarray":
+        with residency.use(self.model):
+            response = requests.post(
+                f"{settings().ollama_base_url}/api/embed",
+                json={"model": self.model, "input": texts},
+                timeout=timeout or self.timeout
+            )
+        response.raise_for_status()
+        vectors = np.asarray(response.json()["embeddings"], dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(texts):
+            raise ValueError("unexpected embedding response shape")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+    def get_stats(self) -> Dict:
+        texts = self.stats["texts"]
+        return {
+            "backend": self._backend or self.requested,
+            "model": self.model if self._backend == "ollama" else None,
+            "texts": texts,
+            "failures": self.stats["failures"],
+            "skipped": self.stats["skipped"],
+            "avg_ms_per_text": round(self.stats["seconds"] * 1000 / texts, 3) if texts else 0.0
+        }
+
+
+# Shared by context retrieval and the semantic answer cache
+embedder = Embedder.from_env()
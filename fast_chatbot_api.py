@@ -1,33 +1,121 @@
-from flask import Flask, request, jsonify, render_template_string, Response
+# First, so the import phase is timed from the start (see startup.py)
+from startup import startup
+from flask import Flask, request, jsonify, render_template_string, Response, g
 from flask_cors import CORS
 import requests
 import json
 import time
 import logging
+import math
 from datetime import datetime
 import os
 from typing import Dict, List, Optional
 import threading
 import uuid
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+import atexit
+
+from conversation_store import ConversationStore
+from rate_limiter import TRUSTED_PROXIES, client_ip, limiter, rate_limited
+from generation_scheduler import DeadlineExceeded, GenerationCancelled, dispatcher, estimate_cost
+from deadlines import Deadline, throughput
+from output_guard import degeneration_monitor
+from continuation import continuations
+from context_retrieval import retriever
+from answer_cache import answer_cache
+from admin_auth import admin_required
+from model_router import ModelRouter
+from model_residency import residency
+from runtime_config import config_manager, settings
+from sse_stream import SSE_HEADERS, StreamRelay, sse_event
+from debug_tools import debug_bp, debug_enabled, track_structure
+from zoho_webhook import CONVERSATION_MEMORY as zoho_conversations, visitor_id_of, zoho_bp
+from log_pipeline import bind_request_context, configure_logging
+from traffic_capture import traffic
+from session_routing import router
+from lifecycle import RETRY_AFTER_SECONDS, lifecycle
+from response_compression import compression
+from ndjson_stream import READ_SIZE, NDJSONScanner, ndjson_line
+from ws_transport import ws_transport
+from metrics_history import history as metrics_history
+
+startup.checkpoint("imports")
+
+# Configure logging: queue handler on request threads, JSON written by a background listener
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+app.register_blueprint(zoho_bp)
+
+# Configuration lives in runtime_config: env/.env plus an optional config.json,
+# hot-reloaded on SIGHUP or file change. Read it per request via settings().
+# Signal handlers and threads are per process, so they start with startup.start().
+startup.on_start("config_reload", config_manager.install_sighup_handler)
+startup.on_start("config_watcher", lambda: config_manager.start_watching(float(os.getenv('CONFIG_POLL_INTERVAL', '5'))))
+
+# Complexity-based model tiers (MODEL_TIERS), falling back to MODEL_NAME
+model_router = ModelRouter.from_env(settings().model_name)
 
-# Configuration
-OLLAMA_BASE_URL = "http://localhost:11434"
-MODEL_NAME = "phi3:mini"  # Change to "mistral:7b" if you prefer
-MAX_CONVERSATION_LENGTH = 25  # Maximum number of exchanges to keep in memory
-MAX_CONTEXT_MESSAGES = 50  # Maximum messages to include in context
-OLLAMA_TIMEOUT = int(os.getenv('OLLAMA_TIMEOUT', '600'))  # Default 10 minutes for complex queries
+# Queued requests for already-loaded models go first, so models are swapped in batches
+dispatcher.hot_models = residency.hot_models
 
 # In-memory conversation storage (replace with Redis/DB for production)
 conversations: Dict[str, List[Dict]] = {}
 session_metadata: Dict[str, Dict] = {}  # Track session info
 
+startup.checkpoint("app")
+
+# Optional durable persistence (enabled by PERSISTENCE_DIR). Restored at import, so a
+# preloading gunicorn master does it once and its workers share the result.
+conversation_store = ConversationStore.from_env(max_length=settings().max_conversation_length)
+if conversation_store:
+    conversation_store.restore(conversations, session_metadata)
+    startup.checkpoint("restore")
+
+def start_persistence():
+    """This process's journal writer, after catching up on what was written since the restore"""
+    if startup.forked:
+        conversation_store.refresh(conversations, session_metadata)
+    conversation_store.start()
+    atexit.register(conversation_store.close)
+
+if conversation_store:
+    startup.on_start("persistence", start_persistence)
+
+# Graceful drain (reload, shutdown, max-requests recycling): see lifecycle.py
+def cap_deadlines_for_drain(drain_deadline):
+    """Nothing started or queued during a drain may outlive the drain budget"""
+    Deadline.cap_all(drain_deadline)
+    dispatcher.cap_deadlines(drain_deadline)
+
+def hand_over_state():
+    """Flush this worker's journal and let the replacement worker catch up from it"""
+    traffic.flush()
+    if conversation_store:
+        conversation_store.close()
+        conversation_store.mark_handover()
+
+lifecycle.on_drain_start(cap_deadlines_for_drain)
+lifecycle.on_drained(hand_over_state)
+startup.on_start("drain_signal", lifecycle.install_signal_handler)
+
+def apply_reloaded_settings(new_settings):
+    """Push reloaded settings into components that cache them"""
+    model_router.set_default_model(new_settings.model_name)
+    if conversation_store:
+        conversation_store.max_length = new_settings.max_conversation_length
+
+config_manager.on_reload(apply_reloaded_settings)
+
+# On-demand profiling and memory diagnostics (only when DEBUG_TOKEN is set)
+if debug_enabled():
+    app.register_blueprint(debug_bp)
+    track_structure("conversations", lambda: conversations)
+    track_structure("session_metadata", lambda: session_metadata)
+    track_structure("stats", lambda: stats)
+    track_structure("scheduler_flows", lambda: dispatcher._flows)
+
 # Statistics tracking
 stats = {
     "total_requests": 0,
@@ -38,9 +126,147 @@ stats = {
     "last_cleanup": datetime.now().isoformat()
 }
 
-def get_session_id(request) -> str:
-    """Generate or retrieve session ID"""
-    session_id = request.headers.get('X-Session-ID',
+# Recent rates for /stats/history: request counters and queue depth sampled once a second,
+# tokens and latency from every final Ollama chunk
+throughput.on_record(metrics_history.record_generation)
+startup.on_start("metrics_sampler", lambda: metrics_history.start_sampler(
+    lambda: (dispatcher.queue_depth(), stats["total_requests"], stats["failed_requests"])
+))
+
+@app.before_request
+def ensure_started():
+    """Start this process on its first request when no gunicorn hook or create_app() did (flask run, test clients)
+
+    A process answering requests is serving, so it also reports ready here;
+    otherwise /ready would say "starting" forever on those servers.
+    """
+    if not startup.ready:
+        startup.start()
+        startup.mark_ready()
+
+@app.before_request
+def bind_log_context():
+    """Tag this request's log records with a request ID (propagated from X-Request-ID when present)"""
+    request.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+    bind_request_context(request.request_id, request.headers.get('X-Session-ID'))
+
+# Generations counted in flight by the lifecycle manager and refused while draining
+GENERATION_ENDPOINTS = {'chat', 'chat_stream', 'chat_continue', 'zoho.zoho_webhook'}
+
+@app.before_request
+def admit_generation():
+    """Pick up state handed over by a drained worker; refuse new generations while draining"""
+    if conversation_store:
+        conversation_store.catch_up_if_handed_over(conversations, session_metadata)
+    if request.endpoint not in GENERATION_ENDPOINTS:
+        return None
+    if not lifecycle.admit():
+        response = jsonify({
+            "success": False,
+            "error": "Server is restarting, please retry",
+            "draining": True
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+        response.headers['Connection'] = 'close'
+        return response
+    g.lifecycle_admitted = True
+    return None
+
+@app.after_request
+def release_streamed_generation(response):
+    """Streams stay in flight until the client has the last event"""
+    if g.pop('lifecycle_admitted', False):
+        if response.is_streamed:
+            response.call_on_close(lifecycle.done)
+        else:
+            lifecycle.done()
+    return response
+
+@app.teardown_request
+def release_failed_generation(exc=None):
+    """Requests that raised never reach after_request"""
+    if g.pop('lifecycle_admitted', False):
+        lifecycle.done()
+
+# Session-affine routing across processes (ROUTING_MEMBERS); a no-op for a single process
+router.local_load = lambda: len(session_metadata)
+if router.enabled:
+    TRUSTED_PROXIES.update(router.member_hosts())  # forwarded requests carry the client's IP
+    startup.on_start("session_routing", router.start)
+
+def routing_key(req):
+    """(session key, whether this process already holds the session) for session-bound endpoints"""
+    if req.endpoint == 'zoho.zoho_webhook':
+        visitor_id = visitor_id_of(req)  # None for malformed bodies; the webhook rejects those itself
+        return (f"zoho_{visitor_id}", visitor_id in zoho_conversations) if visitor_id else (None, False)
+    session_id = req.headers.get('X-Session-ID')
+    return session_id, session_id in session_metadata
+
+ROUTED_ENDPOINTS = {'chat', 'chat_stream', 'chat_continue', 'zoho.zoho_webhook'}
+
+@app.before_request
+def route_to_session_owner():
+    """Proxy session-bound requests that landed on a process other than the session's owner"""
+    if not router.enabled or request.endpoint not in ROUTED_ENDPOINTS:
+        return None
+    session_key, known_locally = routing_key(request)
+    if not session_key:
+        return None
+    hops = router.request_hops(request)
+    owner = router.route(session_key, hops, known_locally)
+    if owner == router.self_name:
+        return None
+    forwarded = router.forward(owner, request, hops)
+    if forwarded is None:
+        return None  # owner unreachable; serve here rather than fail
+    status, headers, body = forwarded
+    return Response(body, status=status, headers=headers)
+
+# Requests described in the traffic capture (TRAFFIC_CAPTURE_FILE)
+CAPTURED_ENDPOINTS = {'chat', 'chat_stream', 'chat_continue', 'zoho.zoho_webhook'}
+
+@app.before_request
+def start_traffic_capture():
+    if traffic.enabled and request.endpoint in CAPTURED_ENDPOINTS:
+        g.traffic = traffic.start(request.path, request.headers.get('X-Session-ID'))
+
+@app.after_request
+def add_request_id_header(response):
+    """Echo the request ID so client reports can be matched to log lines"""
+    request_id = getattr(request, 'request_id', None)
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Negotiated gzip/deflate; event streams are flushed per event (COMPRESSION_*)"""
+    return compression.compress(request, response)
+
+@app.after_request
+def finish_traffic_capture(response):
+    """Close the capture record once the response has been sent (streams: when they end)"""
+    entry = g.pop('traffic', None)
+    if entry is not None:
+        if response.is_streamed:
+            response.call_on_close(lambda: traffic.finish(entry, response.status_code))
+        else:
+            traffic.finish(entry, response.status_code)
+    return response
+
+def note_traffic(**fields):
+    """Describe this request in the traffic capture (no-op unless capture is on)"""
+    traffic.note(g.get('traffic'), **fields)
+
+@app.teardown_request
+def clear_log_context(exc=None):
+    """Don't let the next request on this thread inherit the IDs"""
+    bind_request_context(None, None)
+
+def get_session_id(request, session_id: Optional[str] = None) -> str:
+    """Generate or retrieve session ID (WebSocket turns pass theirs explicitly)"""
+    session_id = session_id or request.headers.get('X-Session-ID',
                  request.remote_addr + "_" + str(int(time.time())))
 
     # Track session metadata
@@ -61,44 +287,80 @@ def get_conversation_history(session_id: str) -> List[Dict]:
     if session_id not in conversations:
         conversations[session_id] = []
 
-    # Keep only last MAX_CONTEXT_MESSAGES for memory efficiency
-    if len(conversations[session_id]) > MAX_CONTEXT_MESSAGES:
-        conversations[session_id] = conversations[session_id][-MAX_CONTEXT_MESSAGES:]
+    # Keep only last max_context_messages for memory efficiency
+    max_context_messages = settings().max_context_messages
+    if len(conversations[session_id]) > max_context_messages:
+        conversations[session_id] = conversations[session_id][-max_context_messages:]
 
     return conversations[session_id]
 
-def add_to_conversation(session_id: str, user_message: str, ai_response: str):
-    """Add exchange to conversation history with automatic cleanup"""
+def add_to_conversation(session_id: str, user_message: str, ai_response: str,
+                        truncated: Optional[str] = None) -> Dict:
+    """Add exchange to conversation history with automatic cleanup
+
+    A truncated answer is flagged so /chat/continue can finish it later.
+    """
     if session_id not in conversations:
         conversations[session_id] = []
 
-    conversations[session_id].append({
+    exchange = {
         "user": user_message,
         "assistant": ai_response,
         "timestamp": datetime.now().isoformat()
-    })
+    }
+    if truncated:
+        exchange["truncated"] = True
+        exchange["truncation_reason"] = truncated
+    conversations[session_id].append(exchange)
+
+    # Only the latest answer can be continued
+    continuations.discard(session_id)
+
+    # Embedded in the background for relevance-based context selection
+    retriever.index_exchange(session_id, exchange)
 
     # Update session metadata
     if session_id in session_metadata:
         session_metadata[session_id]["message_count"] += 1
         session_metadata[session_id]["last_activity"] = datetime.now().isoformat()
 
+    # Hand off to the background writer; never waits on disk
+    if conversation_store:
+        conversation_store.record_exchange(session_id, exchange, session_metadata.get(session_id))
+
     # Keep only recent exchanges to prevent memory bloat
-    if len(conversations[session_id]) > MAX_CONVERSATION_LENGTH:
-        conversations[session_id] = conversations[session_id][-MAX_CONVERSATION_LENGTH:]
+    max_conversation_length = settings().max_conversation_length
+    if len(conversations[session_id]) > max_conversation_length:
+        conversations[session_id] = conversations[session_id][-max_conversation_length:]
 
-    logger.info(f"Session {session_id[:8]}... now has {len(conversations[session_id])} exchanges")
+    logger.info("Session %s... now has %d exchanges", session_id[:8], len(conversations[session_id]),
+                extra={"event": "conversation.append", "session_id": session_id})
+    return exchange
 
-def build_context_prompt(session_id: str, current_message: str) -> str:
-    """Build prompt with conversation context"""
-    history = get_conversation_history(session_id)
+def build_context_prompt(session_id: str, current_message: str, history: Optional[List[Dict]] = None,
+                         deadline: Optional[Deadline] = None) -> str:
+    """Build prompt with conversation context
+
+    Picking relevant older exchanges needs a query embedding, which runs
+    before the generation slot; it gets at most embed_timeout (and never past
+    the request deadline), after which the prompt uses the recent turns only.
+    """
+    if history is None:
+        history = get_conversation_history(session_id)
 
     if not history:
         return f"User: {current_message}\nAssistant:"
 
-    # Build context from recent conversation
+    # Build context from the most relevant older exchanges plus the recent conversation
+    config = settings()
     context_parts = []
-    for exchange in history[-3:]:  # Last 3 exchanges for context
+    context_exchanges = config.context_exchanges
+    recent = history[-context_exchanges:] if context_exchanges else []
+    older = history[:len(history) - len(recent)]
+    embed_timeout = config.embed_timeout if deadline is None else min(config.embed_timeout, deadline.remaining())
+    relevant = retriever.select(session_id, current_message, older,
+                                config.retrieval_top_k, config.retrieval_min_similarity, embed_timeout)
+    for exchange in relevant + recent:
         context_parts.append(f"User: {exchange['user']}")
         context_parts.append(f"Assistant: {exchange['assistant']}")
 
@@ -107,58 +369,249 @@ def build_context_prompt(session_id: str, current_message: str) -> str:
 
     return "\n".join(context_parts)
 
-def query_ollama(prompt: str) -> tuple[str, bool]:
-    """Query Ollama API with enhanced timeout handling and error recovery"""
+def stream_generation(payload: Dict, timeout: float, guard, cancelled: Optional[threading.Event] = None,
+                      on_text=None) -> Dict:
+    """Stream one /api/generate call through the output guard
+
+    Returns the final chunk (timings, context, done_reason) and why the text
+    ended early, if it did: "length" (num_predict reached), "timeout" or
+    "interrupted" (the stream broke after some text), or "cancelled". A guard
+    abort is not a truncation; the trimmed answer is complete. Failures before
+    any text arrive are raised as requests exceptions.
+    """
+    config = settings()
+    outcome = {"status_code": None, "truncated": None, "final": {}, "last_chunk": ""}
+
+    response = requests.post(
+        f"{config.ollama_base_url}/api/generate",
+        json={**payload, "stream": True},
+        stream=True,
+        timeout=timeout
+    )
+    outcome["status_code"] = response.status_code
+    if response.status_code != 200:
+        outcome["error"] = response.text
+        response.close()
+        return outcome
+
+    # Closing the response (leaving this block early) aborts the generation in Ollama
+    with response:
+        try:
+            for line in response.iter_lines():
+                if cancelled is not None and cancelled.is_set():
+                    outcome["truncated"] = "cancelled"
+                    break
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if chunk.get("response"):
+                    outcome["last_chunk"] = chunk["response"]
+                    safe_text = guard.feed(chunk["response"])
+                    if safe_text and on_text:
+                        on_text(safe_text)
+                    if guard.stop_reason:
+                        break
+                if chunk.get("done"):
+                    outcome["final"] = chunk
+                    if chunk.get("done_reason") == "length":
+                        outcome["truncated"] = "length"
+                    break
+            else:
+                outcome["truncated"] = "interrupted"
+        except requests.exceptions.RequestException as e:
+            if not guard.text.strip():
+                raise
+            logger.warning("Ollama stream broke after %d tokens: %s", guard.tokens, e)
+            outcome["truncated"] = "timeout" if isinstance(e, requests.exceptions.Timeout) else "interrupted"
+
+    tail = guard.flush()
+    if tail and on_text:
+        on_text(tail)
+    if outcome["final"]:
+        throughput.record(payload["model"], outcome["final"])
+    degeneration_monitor.record(guard, (payload.get("options") or {}).get("num_predict"))
+    return outcome
+
+def relay_generation(payload: Dict, timeout: float, scanner: NDJSONScanner, outcome: Dict):
+    """Stream one /api/generate call's NDJSON through as raw bytes (format "ndjson")
+
+    Yields Ollama's lines in the reads they arrive in; the scanner keeps the
+    answer text and the final chunk, which is held back for the caller. No
+    per-token decoding, so the output guard doesn't run on this path.
+    outcome gets status_code, final and truncated like stream_generation's.
+    """
+    config = settings()
+    response = requests.post(
+        f"{config.ollama_base_url}/api/generate",
+        json={**payload, "stream": True},
+        stream=True,
+        timeout=timeout
+    )
+    outcome["status_code"] = response.status_code
+    if response.status_code != 200:
+        outcome["error"] = response.text
+        response.close()
+        return
+
+    # Closing the response (client gone: GeneratorExit here) aborts the generation in Ollama
+    with response:
+        try:
+            for data in response.raw.stream(READ_SIZE, decode_content=True):
+                forward = scanner.feed(data)
+                if forward:
+                    yield forward
+                if scanner.final:
+                    break
+        except requests.exceptions.RequestException as e:
+            if not scanner.lines:
+                raise
+            logger.warning("Ollama stream broke after %d lines: %s", scanner.lines, e)
+            outcome["truncated"] = "timeout" if isinstance(e, requests.exceptions.Timeout) else "interrupted"
+
+    outcome["final"] = scanner.final
+    if scanner.final:
+        if scanner.final.get("done_reason") == "length":
+            outcome["truncated"] = "length"
+        throughput.record(payload["model"], scanner.final)
+    elif not outcome.get("truncated"):
+        outcome["truncated"] = "interrupted"
+
+def stream_ndjson(session_id: str, user_message: str, history_depth: int, traffic_class: str,
+                  tier: str, model: str, deadline: Deadline, capture: Optional[Dict]):
+    """/chat/stream with format "ndjson": Ollama's lines as-is, then one summary line"""
+    config = settings()
+    try:
+        prompt = build_context_prompt(session_id, user_message, deadline=deadline)
+        with dispatcher.slot(session_id, estimate_cost(prompt, config.num_predict("stream")), traffic_class,
+                             deadline=deadline.expires_at, model=model), residency.use(model):
+            options = config.generation_options("stream")
+            options["num_predict"] = throughput.cap_num_predict(
+                model, config.num_predict("stream"), len(prompt) // 4, deadline)
+            started = time.time()
+            scanner = NDJSONScanner()
+            outcome = {"status_code": None, "truncated": None, "final": {}}
+            yield from relay_generation({
+                "model": model,
+                "prompt": prompt,
+                "options": options,
+                **config.request_params("stream")
+            }, deadline.timeout(config.ollama_timeout), scanner, outcome)
+
+        final = outcome["final"]
+        traffic.note(capture, p=len(prompt), tier=tier, model=model, n=final.get("eval_count"),
+                     truncated=outcome["truncated"])
+        if outcome["status_code"] != 200:
+            model_router.record(tier, time.time() - started, False)
+            stats["failed_requests"] += 1
+            traffic.note(capture, st=outcome["status_code"])
+            yield ndjson_line({"error": f"API error: {outcome['status_code']}", "done": True})
+            return
+
+        full_response = scanner.text().strip()
+        generation_seconds = time.time() - started
+        model_router.record(tier, generation_seconds, bool(full_response))
+        traffic.note(capture, o=len(full_response), st="complete" if full_response else "empty")
+        if not full_response:
+            stats["failed_requests"] += 1
+            yield ndjson_line({"error": "Empty response from AI", "done": True})
+            return
+
+        add_to_conversation(session_id, user_message, full_response, outcome["truncated"])
+        if outcome["truncated"]:
+            continuations.save(session_id, outcome["truncated"], model, "stream", prompt, final,
+                               scanner.last_chunk(), final.get("eval_count") or scanner.lines)
+        elif not history_depth:
+            answer_cache.store(user_message, full_response, model, generation_seconds)
+        stats["successful_requests"] += 1
+
+        summary = {k: v for k, v in final.items() if k != "context"}
+        yield ndjson_line({**summary, "done": True, "session_id": session_id, "model": model,
+                           "truncated": bool(outcome["truncated"]), "truncation_reason": outcome["truncated"]})
+
+    except DeadlineExceeded as e:
+        stats["failed_requests"] += 1
+        traffic.note(capture, st="deadline")
+        logger.info("Stream for session %s... dropped: %s", session_id[:8], e)
+        yield ndjson_line({"error": "Request deadline passed before an answer could be generated", "done": True})
+    except requests.exceptions.Timeout:
+        stats["failed_requests"] += 1
+        traffic.note(capture, st="timeout")
+        yield ndjson_line({"error": "Request timed out - AI model is taking too long", "done": True})
+    except Exception as e:
+        stats["failed_requests"] += 1
+        traffic.note(capture, st="error")
+        logger.error("Streaming error: %s", e)
+        yield ndjson_line({"error": str(e), "done": True})
+
+def remember_truncation(session_id: str, outcome: Dict, guard, model: str, route: str, prompt: str):
+    """Keep what /chat/continue needs to resume a truncated answer"""
+    if outcome["truncated"]:
+        continuations.save(session_id, outcome["truncated"], model, route, prompt,
+                           outcome["final"], outcome["last_chunk"], guard.tokens)
+
+def query_ollama(prompt: str, model: Optional[str] = None, route: str = "chat",
+                 num_predict: Optional[int] = None, timeout: Optional[float] = None,
+                 payload: Optional[Dict] = None) -> tuple[str, bool, Dict]:
+    """Query Ollama API with enhanced timeout handling and error recovery
+
+    Returns (text, success, outcome); outcome["truncated"] says whether the
+    answer stopped early and can be continued. `payload` overrides the prompt
+    fields (used to resume from a context).
+    """
+    config = settings()
+    model = model or config.model_for(route)
+    outcome = {"truncated": None, "final": {}, "last_chunk": ""}
     try:
-        # Use configurable timeout for AI responses
+        # Use configurable timeout for AI responses, shortened to the request's deadline
         # AI models can take time to think, especially for complex queries
-        timeout_duration = OLLAMA_TIMEOUT
+        timeout_duration = timeout or config.ollama_timeout
 
-        logger.info(f"Sending request to Ollama (timeout: {timeout_duration}s)")
+        options = config.generation_options(route)
+        if num_predict:
+            options["num_predict"] = num_predict
 
-        response = requests.post(
-            f"{OLLAMA_BASE_URL}/api/generate",
-            json={
-                "model": MODEL_NAME,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                    "max_tokens": 500,
-                    "num_predict": 500,  # Limit response length for faster processing
-                    "stop": ["\n\nUser:", "\n\nHuman:"]  # Stop tokens to prevent runaway generation
-                }
-            },
-            timeout=timeout_duration
-        )
+        logger.info("Sending request to Ollama (timeout: %ss)", timeout_duration, extra={"event": "ollama.request"})
+
+        # Streamed internally so the output guard can abort a looping generation mid-way
+        guard = degeneration_monitor.guard()
+        outcome = stream_generation({
+            "model": model,
+            "prompt": prompt,
+            "options": options,
+            **config.request_params(route),
+            **(payload or {})
+        }, timeout_duration, guard)
+        outcome["guard"] = guard
 
-        if response.status_code == 200:
-            result = response.json()
-            ai_response = result.get("response", "").strip()
+        if outcome["status_code"] == 200:
+            ai_response = guard.text.strip()
 
             if ai_response:
-                logger.info(f"Ollama response received successfully ({len(ai_response)} chars)")
-                return ai_response, True
+                logger.info("Ollama response received successfully (%d chars)", len(ai_response),
+                            extra={"event": "ollama.request"})
+                return ai_response, True, outcome
             else:
                 logger.warning("Ollama returned empty response")
-                return "I apologize, but I couldn't generate a proper response. Please try rephrasing your question.", False
+                return "I apologize, but I couldn't generate a proper response. Please try rephrasing your question.", False, outcome
         else:
-            logger.error(f"Ollama API error: {response.status_code} - {response.text}")
-            return "Sorry, I'm experiencing technical difficulties. Please try again in a moment.", False
+            logger.error("Ollama API error: %s - %s", outcome["status_code"], outcome.get("error"))
+            return "Sorry, I'm experiencing technical difficulties. Please try again in a moment.", False, outcome
 
     except requests.exceptions.Timeout as e:
-        logger.error(f"Ollama request timed out after {timeout_duration}s: {e}")
-        return "I'm taking longer than usual to process your request. The AI model is working hard on your question - please try again or simplify your request.", False
+        logger.error("Ollama request timed out after %ss: %s", timeout_duration, e)
+        return "I'm taking longer than usual to process your request. The AI model is working hard on your question - please try again or simplify your request.", False, outcome
     except requests.exceptions.ConnectionError as e:
-        logger.error(f"Connection error to Ollama: {e}")
-        return "I'm having trouble connecting to the AI service. Please check that the AI model is running and try again.", False
+        logger.error("Connection error to Ollama: %s", e)
+        return "I'm having trouble connecting to the AI service. Please check that the AI model is running and try again.", False, outcome
     except requests.RequestException as e:
-        logger.error(f"Request to Ollama failed: {e}")
-        return "Sorry, I'm currently unavailable. Please try again later.", False
+        logger.error("Request to Ollama failed: %s", e)
+        return "Sorry, I'm currently unavailable. Please try again later.", False, outcome
     except Exception as e:
-        logger.error(f"Unexpected error in query_ollama: {e}")
-        return "An unexpected error occurred. Please try again.", False
+        logger.error("Unexpected error in query_ollama: %s", e)
+        return "An unexpected error occurred. Please try again.", False, outcome
 
 @app.route('/')
 def landing():
@@ -219,6 +672,7 @@ def chat_interface():
             <h3>API Endpoints:</h3>
             <ul>
                 <li><strong>POST /chat</strong> - Send message to AI</li>
+                <li><strong>POST /chat/continue</strong> - Finish an answer that was cut off</li>
                 <li><strong>GET /health</strong> - Check system health</li>
                 <li><strong>GET /stats</strong> - View usage statistics</li>
             </ul>
@@ -292,9 +746,10 @@ def chat_interface():
         </script>
     </body>
     </html>
-    ''', model_name=MODEL_NAME)
+    ''', model_name=settings().model_name)
 
 @app.route('/chat', methods=['POST'])
+@rate_limited('/chat')
 def chat():
     """Main chat endpoint"""
     stats["total_requests"] += 1
@@ -316,23 +771,80 @@ def chat():
                 "error": "Empty message"
             }), 400
 
+        # An explicitly requested model (or tier) overrides the router
+        requested = model_router.resolve(str(data['model']).strip()) if data.get('model') else None
+        if data.get('model') and requested is None:
+            stats["failed_requests"] += 1
+            return jsonify({
+                "success": False,
+                "error": f"Model not available: {data['model']}",
+                "allowed_models": model_router.allowed_models()
+            }), 400
+
         session_id = get_session_id(request)
+        history_depth = len(conversations.get(session_id, []))
+        traffic_class = "default" if history_depth else "new_session"
+        note_traffic(m=len(user_message), h=history_depth)
+
+        # First-turn questions can be answered from the cross-session cache without generating
+        # (unless the client asked for a particular model)
+        cached = answer_cache.lookup(user_message) if not history_depth and not requested else None
+        if cached:
+            add_to_conversation(session_id, user_message, cached["answer"])
+            note_traffic(cached=True, tier="cache", o=len(cached["answer"]))
+            stats["successful_requests"] += 1
+            return jsonify({
+                "success": True,
+                "response": cached["answer"],
+                "session_id": session_id,
+                "model": cached["model"],
+                "model_tier": "cache",
+                "cached": True,
+                "truncated": False,
+                "truncation_reason": None,
+                "timestamp": datetime.now().isoformat()
+            })
 
-        # Build context-aware prompt
-        prompt = build_context_prompt(session_id, user_message)
+        config = settings()
+        deadline = Deadline.for_request(request, "chat", config)
+        throughput.note_source(deadline)
 
-        # Query Ollama with extended timeout
-        ai_response, success = query_ollama(prompt)
+        # Build context-aware prompt
+        prompt = build_context_prompt(session_id, user_message, deadline=deadline)
+
+        # Pick a model tier; degrades to the cheapest tier when the queue is deep
+        tier, model = requested or model_router.select(user_message, history_depth, dispatcher.queue_depth())
+
+        # Wait for this session's fair share of a generation slot, then query Ollama
+        # and make room for its model if it is not loaded
+        with dispatcher.slot(session_id, estimate_cost(prompt, config.num_predict("chat")), traffic_class,
+                             deadline=deadline.expires_at, model=model), residency.use(model):
+            # Only ask for as many tokens as can be generated before the caller gives up
+            num_predict = throughput.cap_num_predict(model, config.num_predict("chat"), len(prompt) // 4, deadline)
+            started = time.time()
+            ai_response, success, outcome = query_ollama(prompt, model, num_predict=num_predict,
+                                                         timeout=deadline.timeout(config.ollama_timeout))
+            generation_seconds = time.time() - started
+            model_router.record(tier, generation_seconds, success)
+            note_traffic(p=len(prompt), o=len(ai_response) if success else None, tier=tier, model=model,
+                         n=outcome.get("final", {}).get("eval_count"), truncated=outcome.get("truncated"))
 
         if success:
-            # Add to conversation history
-            add_to_conversation(session_id, user_message, ai_response)
+            # Add to conversation history; a truncated answer stays resumable via /chat/continue
+            add_to_conversation(session_id, user_message, ai_response, outcome["truncated"])
+            remember_truncation(session_id, outcome, outcome["guard"], model, "chat", prompt)
+            if not history_depth and not outcome["truncated"] and not outcome["guard"].stop_reason:
+                answer_cache.store(user_message, ai_response, model, generation_seconds)
             stats["successful_requests"] += 1
 
             return jsonify({
                 "success": True,
                 "response": ai_response,
                 "session_id": session_id,
+                "model": model,
+                "model_tier": tier,
+                "truncated": bool(outcome["truncated"]),
+                "truncation_reason": outcome["truncated"],
                 "timestamp": datetime.now().isoformat()
             })
         else:
@@ -340,20 +852,132 @@ def chat():
             return jsonify({
                 "success": False,
                 "error": "Failed to get response from AI model",
-                "response": ai_response  # Fallback message
+                "response": ai_response,  # Fallback message
+                "model": model
             }), 500
 
+    except DeadlineExceeded as e:
+        stats["failed_requests"] += 1
+        logger.info("Chat request dropped: %s", e)
+        return jsonify({
+            "success": False,
+            "error": "Request deadline passed before an answer could be generated",
+            "deadline_exceeded": True
+        }), 504
     except Exception as e:
         stats["failed_requests"] += 1
-        logger.error(f"Chat endpoint error: {e}")
+        logger.error("Chat endpoint error: %s", e)
         return jsonify({
             "success": False,
             "error": "Internal server error"
         }), 500
 
+def chat_stream_producer(session_id: str, user_message: str, history_depth: int, traffic_class: str,
+                         tier: str, model: str, deadline: Deadline, capture: Optional[Dict]):
+    """One /chat/stream generation as a StreamRelay producer (shared by SSE and the WebSocket transport)"""
+    config = settings()
+
+    def produce_stream(emit, cancelled):
+        """Runs on the relay's worker thread; the relay handles heartbeats and flushing"""
+        try:
+            # Build context-aware prompt
+            prompt = build_context_prompt(session_id, user_message, deadline=deadline)
+
+            def report_queue_position(position):
+                emit("event", {'status': 'queued', 'position': position,
+                               'message': f'Waiting for the AI ({position} ahead of you)...'})
+
+            # Wait for this session's fair share of a generation slot
+            with dispatcher.slot(session_id, estimate_cost(prompt, config.num_predict("stream")), traffic_class,
+                                 cancelled=cancelled, on_wait=report_queue_position,
+                                 deadline=deadline.expires_at, model=model), residency.use(model):
+                options = config.generation_options("stream")
+                options["num_predict"] = throughput.cap_num_predict(
+                    model, config.num_predict("stream"), len(prompt) // 4, deadline)
+                started = time.time()
+                emit("event", {'status': 'prompt_eval', 'message': 'AI is reading your message...'})
+
+                # Query Ollama with streaming; tokens pass through the output guard to the relay
+                guard = degeneration_monitor.guard()
+                outcome = stream_generation({
+                    "model": model,
+                    "prompt": prompt,
+                    "options": options,
+                    **config.request_params("stream")
+                }, deadline.timeout(config.ollama_timeout), guard, cancelled,
+                    on_text=lambda text: emit("token", text))
+
+                traffic.note(capture, p=len(prompt), tier=tier, model=model,
+                             n=outcome["final"].get("eval_count"), truncated=outcome["truncated"])
+                if outcome["status_code"] == 200:
+                    full_response = guard.text.strip()
+                    generation_seconds = time.time() - started
+                    model_router.record(tier, generation_seconds, bool(full_response))
+                    traffic.note(capture, o=len(full_response), st="complete" if full_response else "empty")
+
+                    # Save to conversation history; partial answers are kept and flagged for /chat/continue
+                    if full_response:
+                        add_to_conversation(session_id, user_message, full_response, outcome["truncated"])
+                        remember_truncation(session_id, outcome, guard, model, "stream", prompt)
+                        if outcome["truncated"] == "cancelled":
+                            # Client went away; nobody to send the completion to
+                            return
+                        if not history_depth and not outcome["truncated"] and not guard.stop_reason:
+                            answer_cache.store(user_message, full_response, model, generation_seconds)
+                        stats["successful_requests"] += 1
+
+                        # Send completion signal
+                        emit("event", {'status': 'complete', 'full_response': full_response,
+                                       'session_id': session_id, 'model': model,
+                                       'truncated': bool(outcome["truncated"]),
+                                       'truncation_reason': outcome["truncated"]})
+                    elif outcome["truncated"] != "cancelled":
+                        stats["failed_requests"] += 1
+                        emit("event", {'status': 'error', 'error': 'Empty response from AI'})
+                else:
+                    model_router.record(tier, time.time() - started, False)
+                    stats["failed_requests"] += 1
+                    traffic.note(capture, st=outcome["status_code"])
+                    emit("event", {'status': 'error', 'error': f'API error: {outcome["status_code"]}'})
+
+        except DeadlineExceeded as e:
+            stats["failed_requests"] += 1
+            traffic.note(capture, st="deadline")
+            logger.info("Stream for session %s... dropped: %s", session_id[:8], e)
+            emit("event", {'status': 'error', 'error': 'Request deadline passed before an answer could be generated'})
+        except GenerationCancelled:
+            stats["failed_requests"] += 1
+            traffic.note(capture, st="cancelled")
+            logger.info("Stream for session %s... cancelled while queued", session_id[:8])
+        except requests.exceptions.Timeout:
+            stats["failed_requests"] += 1
+            traffic.note(capture, st="timeout")
+            emit("event", {'status': 'error', 'error': 'Request timed out - AI model is taking too long'})
+        except Exception as e:
+            stats["failed_requests"] += 1
+            traffic.note(capture, st="error")
+            logger.error("Streaming error: %s", e)
+            emit("event", {'status': 'error', 'error': str(e)})
+
+    return produce_stream
+
+def cached_stream_events(cached: Dict, session_id: str) -> List[Dict]:
+    """The stream events that replay an answer-cache hit"""
+    return [
+        {'status': 'streaming', 'chunk': cached["answer"], 'full_response': cached["answer"]},
+        {'status': 'complete', 'full_response': cached["answer"], 'session_id': session_id,
+         'model': cached["model"], 'cached': True, 'truncated': False, 'truncation_reason': None}
+    ]
+
 @app.route('/chat/stream', methods=['POST'])
+@rate_limited('/chat/stream')
 def chat_stream():
-    """Streaming chat endpoint for long responses"""
+    """Streaming chat endpoint for long responses
+
+    SSE by default. Programmatic clients can send {"format": "ndjson"} (or
+    Accept: application/x-ndjson) to get Ollama's NDJSON lines relayed as-is,
+    ending with a summary line that carries session_id and truncation info.
+    """
     stats["total_requests"] += 1
 
     try:
@@ -373,144 +997,498 @@ def chat_stream():
                 "error": "Empty message"
             }), 400
 
+        # An explicitly requested model (or tier) overrides the router
+        requested = model_router.resolve(str(data['model']).strip()) if data.get('model') else None
+        if data.get('model') and requested is None:
+            stats["failed_requests"] += 1
+            return jsonify({
+                "success": False,
+                "error": f"Model not available: {data['model']}",
+                "allowed_models": model_router.allowed_models()
+            }), 400
+
+        ndjson = data.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+
         session_id = get_session_id(request)
+        history_depth = len(conversations.get(session_id, []))
+        traffic_class = "default" if history_depth else "new_session"
+        note_traffic(m=len(user_message), h=history_depth)
+
+        cached = answer_cache.lookup(user_message) if not history_depth and not requested else None
+        if cached:
+            add_to_conversation(session_id, user_message, cached["answer"])
+            note_traffic(cached=True, tier="cache", o=len(cached["answer"]))
+            stats["successful_requests"] += 1
 
-        def generate_stream():
-            try:
-                # Build context-aware prompt
-                prompt = build_context_prompt(session_id, user_message)
-
-                # Send immediate acknowledgment
-                yield f"data: {json.dumps({'status': 'processing', 'message': 'AI is thinking...'})}\n\n"
-
-                # Query Ollama with streaming
-                response = requests.post(
-                    f"{OLLAMA_BASE_URL}/api/generate",
-                    json={
-                        "model": MODEL_NAME,
-                        "prompt": prompt,
-                        "stream": True,  # Enable streaming
-                        "options": {
-                            "temperature": 0.7,
-                            "top_p": 0.9,
-                            "num_predict": 1000,  # Allow longer responses
-                            "stop": ["\n\nUser:", "\n\nHuman:"]
-                        }
-                    },
-                    stream=True,
-                    timeout=OLLAMA_TIMEOUT
-                )
-
-                if response.status_code == 200:
-                    full_response = ""
-                    for line in response.iter_lines():
-                        if line:
-                            try:
-                                chunk_data = json.loads(line.decode('utf-8'))
-                                if 'response' in chunk_data:
-                                    chunk_text = chunk_data['response']
-                                    full_response += chunk_text
-
-                                    # Send chunk to client
-                                    yield f"data: {json.dumps({'status': 'streaming', 'chunk': chunk_text, 'full_response': full_response})}\n\n"
-
-                                if chunk_data.get('done', False):
-                                    break
-                            except json.JSONDecodeError:
-                                continue
-
-                    # Save to conversation history
-                    if full_response.strip():
-                        add_to_conversation(session_id, user_message, full_response.strip())
-                        stats["successful_requests"] += 1
+            if ndjson:
+                lines = ndjson_line({'model': cached["model"], 'response': cached["answer"], 'done': False}) + \
+                    ndjson_line({'model': cached["model"], 'done': True, 'session_id': session_id, 'cached': True,
+                                 'truncated': False, 'truncation_reason': None})
+                return Response(lines, mimetype='application/x-ndjson')
 
-                        # Send completion signal
-                        yield f"data: {json.dumps({'status': 'complete', 'full_response': full_response.strip(), 'session_id': session_id})}\n\n"
-                    else:
-                        stats["failed_requests"] += 1
-                        yield f"data: {json.dumps({'status': 'error', 'error': 'Empty response from AI'})}\n\n"
-                else:
-                    stats["failed_requests"] += 1
-                    yield f"data: {json.dumps({'status': 'error', 'error': f'API error: {response.status_code}'})}\n\n"
+            replay = (sse_event(event) for event in cached_stream_events(cached, session_id))
+            return Response(replay, mimetype='text/event-stream', headers=SSE_HEADERS)
 
-            except requests.exceptions.Timeout:
-                stats["failed_requests"] += 1
-                yield f"data: {json.dumps({'status': 'error', 'error': 'Request timed out - AI model is taking too long'})}\n\n"
-            except Exception as e:
-                stats["failed_requests"] += 1
-                logger.error(f"Streaming error: {e}")
-                yield f"data: {json.dumps({'status': 'error', 'error': str(e)})}\n\n"
+        tier, model = requested or model_router.select(user_message, history_depth, dispatcher.queue_depth())
+
+        config = settings()
+        deadline = Deadline.for_request(request, "stream", config)
+        throughput.note_source(deadline)
+
+        if ndjson:
+            return Response(
+                stream_ndjson(session_id, user_message, history_depth, traffic_class, tier, model, deadline,
+                              g.get('traffic')),
+                mimetype='application/x-ndjson',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
+        relay = StreamRelay(config.sse_heartbeat_interval, config.sse_flush_interval, config.sse_flush_chars)
+        produce_stream = chat_stream_producer(session_id, user_message, history_depth, traffic_class,
+                                              tier, model, deadline, g.get('traffic'))
+
+        def generate_stream():
+            # Send immediate acknowledgment, then relay the producer's output
+            yield sse_event({'status': 'processing', 'message': 'AI is thinking...'})
+            yield from relay.run(produce_stream)
 
         return Response(
             generate_stream(),
             mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Session-ID'
-            }
+            headers=SSE_HEADERS
         )
 
     except Exception as e:
         stats["failed_requests"] += 1
-        logger.error(f"Chat stream endpoint error: {e}")
+        logger.error("Chat stream endpoint error: %s", e)
         return jsonify({
             "success": False,
             "error": "Internal server error"
         }), 500
 
-@app.route('/health', methods=['GET'])
-def health():
-    """Health check endpoint"""
+def run_ws_turn(data: Dict, send, cancelled: threading.Event):
+    """One chat turn over the WebSocket transport; sends the same events as /chat/stream
+
+    The turn gets /chat/stream's checks: session routing, rate limits,
+    draining and the traffic capture, where it is recorded as a /chat/stream
+    request so replays exercise it. A WebSocket can't be proxied to another
+    process, so a turn for a session owned elsewhere is refused as retryable
+    and index.html resends it over HTTP, where it is forwarded to the owner.
+    """
+    stats["total_requests"] += 1
+    session_key = str(data['session_id'])
+    if router.enabled:
+        owner = router.route(session_key, 0, session_key in session_metadata)
+        if owner != router.self_name:
+            send({'status': 'error', 'error': 'Session is served by another process, retry over HTTP',
+                  'owner': owner, 'retryable': True})
+            return
+
+    capture = traffic.start('/chat/stream', session_key)
+    status = 200
+    try:
+        user_message = str(data.get('message') or '').strip()
+        if not user_message:
+            stats["failed_requests"] += 1
+            status = 400
+            send({'status': 'error', 'error': 'Empty message'})
+            return
+
+        session_id = get_session_id(request, session_key)
+        allowed, retry_after, rule = limiter.check(client_ip(request), session_id, '/chat/stream', 'generation')
+        if not allowed:
+            stats["failed_requests"] += 1
+            status = 429
+            send({'status': 'error', 'error': 'Rate limit exceeded, please slow down', 'limit': rule,
+                  'retry_after': max(1, int(retry_after + 0.999))})
+            return
+
+        requested = model_router.resolve(str(data['model']).strip()) if data.get('model') else None
+        if data.get('model') and requested is None:
+            stats["failed_requests"] += 1
+            status = 400
+            send({'status': 'error', 'error': f"Model not available: {data['model']}",
+                  'allowed_models': model_router.allowed_models()})
+            return
+
+        if not lifecycle.admit():
+            status = 503
+            send({'status': 'error', 'error': 'Server is restarting, please retry', 'draining': True,
+                  'retryable': True})
+            return
+        try:
+            history_depth = len(conversations.get(session_id, []))
+            traffic.note(capture, m=len(user_message), h=history_depth)
+            cached = answer_cache.lookup(user_message) if not history_depth and not requested else None
+            if cached:
+                add_to_conversation(session_id, user_message, cached["answer"])
+                traffic.note(capture, cached=True, tier="cache", o=len(cached["answer"]))
+                stats["successful_requests"] += 1
+                for event in cached_stream_events(cached, session_id):
+                    send(event)
+                return
+
+            tier, model = requested or model_router.select(user_message, history_depth, dispatcher.queue_depth())
+            config = settings()
+            deadline = Deadline.for_request(request, "stream", config)
+            throughput.note_source(deadline)
+            producer = chat_stream_producer(session_id, user_message, history_depth,
+                                            "default" if history_depth else "new_session", tier, model, deadline,
+                                            capture)
+
+            send({'status': 'processing', 'message': 'AI is thinking...'})
+            relay = StreamRelay(config.sse_heartbeat_interval, config.sse_flush_interval, config.sse_flush_chars)
+            for event in relay.run(producer, frame=lambda payload: payload, heartbeat=None, cancelled=cancelled):
+                send(event)
+        finally:
+            lifecycle.done()
+    finally:
+        traffic.finish(capture, status)
+
+# One long-lived connection per browser for turns and pushed updates (needs flask-sock)
+ws_transport.register(app, run_ws_turn, {
+    "health": lambda: health_status()[0],
+    "stats": lambda: stats_snapshot(cleanup=False)  # pushed from a background thread: read-only
+})
+lifecycle.on_drain_start(ws_transport.drain)
+
+def apply_continuation(session_id: str, exchange: Dict, state: Optional[Dict], prompt: str,
+                       model: str, route: str, outcome: Dict, guard) -> str:
+    """Append continued text to the truncated exchange and re-record it; returns the full answer"""
+    # The stored answer was stripped; restore whitespace the model produced before the cut
+    last_chunk = (state or {}).get("last_chunk", "")
+    gap = last_chunk[len(last_chunk.rstrip()):]
+    full_response = (exchange["assistant"] + gap + guard.text).strip()
+
+    exchange["assistant"] = full_response
+    retriever.index_exchange(session_id, exchange)
+    if outcome["truncated"]:
+        exchange["truncation_reason"] = outcome["truncated"]
+    else:
+        exchange.pop("truncated", None)
+        exchange.pop("truncation_reason", None)
+    if conversation_store:
+        conversation_store.record_exchange(session_id, exchange, session_metadata.get(session_id))
+
+    continuations.discard(session_id)
+    if outcome["truncated"]:
+        continuations.save(session_id, outcome["truncated"], model, route, prompt, outcome["final"],
+                           outcome["last_chunk"], (state or {}).get("tokens", 0) + guard.tokens)
+    return full_response
+
+@app.route('/chat/continue', methods=['POST'])
+@rate_limited('/chat/continue')
+def chat_continue():
+    """Finish the session's last answer from where it stopped, without regenerating what exists
+
+    Body (optional): {"stream": true} to receive the continuation as SSE like /chat/stream.
+    """
+    stats["total_requests"] += 1
+
+    try:
+        data = request.get_json(silent=True) or {}
+        session_id = request.headers.get('X-Session-ID', '')
+        history = conversations.get(session_id) if session_id else None
+        if not history or not history[-1].get("truncated"):
+            stats["failed_requests"] += 1
+            return jsonify({
+                "success": False,
+                "error": "Nothing to continue: the last answer in this session is complete"
+            }), 409
+
+        exchange = history[-1]
+        note_traffic(h=len(history), m=0)
+        state = continuations.get(session_id)
+        route = "stream" if data.get("stream") else "chat"
+        config = settings()
+        model = (state or {}).get("model") or config.model_for(route)
+        deadline = Deadline.for_request(request, route, config)
+        throughput.note_source(deadline)
+
+        prompt = (state or {}).get("prompt") or build_context_prompt(session_id, exchange["user"], history[:-1],
+                                                                     deadline=deadline)
+        payload = continuations.build_payload(state, exchange["assistant"], prompt)
+        continuations.record_continuation(state, payload)
+        cost = estimate_cost(payload["prompt"], config.num_predict(route))
+        get_session_id(request)  # refresh last_activity
+
+        if route == "chat":
+            with dispatcher.slot(session_id, cost, "default", deadline=deadline.expires_at, model=model), \
+                    residency.use(model):
+                num_predict = throughput.cap_num_predict(model, config.num_predict(route),
+                                                         len(payload["prompt"]) // 4, deadline)
+                _, success, outcome = query_ollama(payload["prompt"], model, route, num_predict,
+                                                   deadline.timeout(config.ollama_timeout), payload=payload)
+
+            if outcome.get("status_code") != 200:
+                stats["failed_requests"] += 1
+                return jsonify({"success": False, "error": "Failed to get response from AI model"}), 500
+
+            full_response = apply_continuation(session_id, exchange, state, prompt, model, route,
+                                               outcome, outcome["guard"])
+            stats["successful_requests"] += 1
+            note_traffic(p=len(payload["prompt"]), o=len(outcome["guard"].text), model=model,
+                         n=outcome["final"].get("eval_count"), truncated=outcome["truncated"])
+            return jsonify({
+                "success": True,
+                "response": full_response,
+                "continuation": outcome["guard"].text.strip(),
+                "session_id": session_id,
+                "model": model,
+                "truncated": bool(outcome["truncated"]),
+                "truncation_reason": outcome["truncated"],
+                "timestamp": datetime.now().isoformat()
+            })
+
+        partial = exchange["assistant"]
+        relay = StreamRelay(config.sse_heartbeat_interval, config.sse_flush_interval, config.sse_flush_chars,
+                            token_frame=lambda chunk, full: {'status': 'streaming', 'chunk': chunk,
+                                                             'full_response': partial + full})
+        capture = g.get('traffic')
+
+        def produce_continuation(emit, cancelled):
+            try:
+                with dispatcher.slot(session_id, cost, "default", cancelled=cancelled, deadline=deadline.expires_at,
+                                     model=model), residency.use(model):
+                    options = config.generation_options(route)
+                    options["num_predict"] = throughput.cap_num_predict(
+                        model, config.num_predict(route), len(payload["prompt"]) // 4, deadline)
+                    guard = degeneration_monitor.guard()
+                    outcome = stream_generation({"model": model, "options": options,
+                                                 **config.request_params(route), **payload},
+                                                deadline.timeout(config.ollama_timeout), guard, cancelled,
+                                                on_text=lambda text: emit("token", text))
+
+                if outcome["status_code"] != 200:
+                    stats["failed_requests"] += 1
+                    emit("event", {'status': 'error', 'error': f'API error: {outcome["status_code"]}'})
+                    return
+
+                full_response = apply_continuation(session_id, exchange, state, prompt, model, route, outcome, guard)
+                stats["successful_requests"] += 1
+                traffic.note(capture, p=len(payload["prompt"]), o=len(guard.text), model=model, st="complete",
+                             n=outcome["final"].get("eval_count"), truncated=outcome["truncated"])
+                emit("event", {'status': 'complete', 'full_response': full_response, 'session_id': session_id,
+                               'model': model, 'truncated': bool(outcome["truncated"]),
+                               'truncation_reason': outcome["truncated"]})
+            except GenerationCancelled as e:
+                stats["failed_requests"] += 1
+                logger.info("Continuation for session %s... dropped: %s", session_id[:8], e)
+                emit("event", {'status': 'error', 'error': 'Request deadline passed before an answer could be generated'})
+            except Exception as e:
+                stats["failed_requests"] += 1
+                logger.error("Continuation streaming error: %s", e)
+                emit("event", {'status': 'error', 'error': str(e)})
+
+        def generate_stream():
+            yield sse_event({'status': 'processing', 'message': 'Continuing the answer...'})
+            yield from relay.run(produce_continuation)
+
+        return Response(generate_stream(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+    except DeadlineExceeded as e:
+        stats["failed_requests"] += 1
+        logger.info("Continue request dropped: %s", e)
+        return jsonify({
+            "success": False,
+            "error": "Request deadline passed before an answer could be generated",
+            "deadline_exceeded": True
+        }), 504
+    except Exception as e:
+        stats["failed_requests"] += 1
+        logger.error("Chat continue endpoint error: %s", e)
+        return jsonify({
+            "success": False,
+            "error": "Internal server error"
+        }), 500
+
+def health_status() -> tuple[Dict, int]:
+    """Health report and HTTP status (shared by /health and the WebSocket push)"""
+    if lifecycle.draining:
+        # Health checks take this worker out of rotation while it finishes in-flight requests
+        return {
+            "status": "draining",
+            "lifecycle": lifecycle.get_stats(),
+            "timestamp": datetime.now().isoformat()
+        }, 503
+
     try:
         # Test Ollama connection
-        response = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5)
+        response = requests.get(f"{settings().ollama_base_url}/api/tags", timeout=5)
         ollama_healthy = response.status_code == 200
 
-        return jsonify({
+        return {
             "status": "healthy" if ollama_healthy else "unhealthy",
             "ollama_status": "connected" if ollama_healthy else "disconnected",
-            "model": MODEL_NAME,
+            "model": settings().model_name,
             "timestamp": datetime.now().isoformat(),
             "uptime_seconds": (datetime.now() - datetime.fromisoformat(stats["start_time"])).total_seconds()
-        })
+        }, 200
     except Exception as e:
-        return jsonify({
+        return {
             "status": "unhealthy",
             "error": str(e),
             "timestamp": datetime.now().isoformat()
-        }), 500
+        }, 500
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Health check endpoint"""
+    body, status = health_status()
+    return jsonify(body), status
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness without touching Ollama: this process has started and isn't draining"""
+    if lifecycle.draining or not startup.ready:
+        return jsonify({"status": "draining" if lifecycle.draining else "starting"}), 503
+    return jsonify({"status": "ready", "pid": os.getpid(), "ready_at": startup.ready_at})
+
+@app.route('/routing/status', methods=['GET'])
+def routing_status():
+    """Load and identity polled by the other routing members"""
+    return jsonify({"member": router.self_name, "load": len(session_metadata)})
 
 @app.route('/stats', methods=['GET'])
+@rate_limited('/stats', 'cheap')
 def get_stats():
     """Get usage statistics with enhanced memory info"""
-    # Perform cleanup and update active sessions
-    cleanup_old_sessions()
+    return jsonify(stats_snapshot())
 
-    total_messages = sum(len(conv) for conv in conversations.values())
+@app.route('/stats/history', methods=['GET'])
+@rate_limited('/stats/history', 'cheap')
+def get_stats_history():
+    """Recent request rate, tokens/s, latency percentiles and queue depth
+
+    Query parameters: minutes (default the whole window) and step (seconds per point).
+    """
+    try:
+        minutes = float(request.args['minutes']) if 'minutes' in request.args else None
+        step = int(request.args['step']) if 'step' in request.args else None
+    except ValueError:
+        return jsonify({"error": "minutes and step must be numbers"}), 400
+    if (minutes is not None and not (math.isfinite(minutes) and minutes > 0)) or (step is not None and step <= 0):
+        return jsonify({"error": "minutes and step must be positive"}), 400
 
     return jsonify({
+        **metrics_history.history(minutes, step),
+        "timestamp": datetime.now().isoformat()
+    })
+
+def stats_snapshot(cleanup: bool = True) -> Dict:
+    """Everything /stats reports (also pushed over the WebSocket transport, without the cleanup)"""
+    # Perform cleanup and update active sessions
+    if cleanup:
+        cleanup_old_sessions()
+
+    total_messages = sum(len(conv) for conv in list(conversations.values()))
+    config = settings()
+
+    return {
         **stats,
         "active_sessions": len(session_metadata),
         "total_conversations": len(conversations),
         "total_messages_in_memory": total_messages,
-        "model": MODEL_NAME,
-        "ollama_timeout": OLLAMA_TIMEOUT,
+        "model": config.model_name,
+        "ollama_timeout": config.ollama_timeout,
         "memory_conservation": {
-            "max_conversation_length": MAX_CONVERSATION_LENGTH,
-            "max_context_messages": MAX_CONTEXT_MESSAGES,
+            "max_conversation_length": config.max_conversation_length,
+            "max_context_messages": config.max_context_messages,
             "cleanup_enabled": True
         },
+        "rate_limiting": limiter.get_stats(),
+        "scheduler": dispatcher.get_stats(),
+        "deadlines": throughput.get_stats(),
+        "output_guard": degeneration_monitor.get_stats(),
+        "continuations": continuations.get_stats(),
+        "retrieval": retriever.get_stats(),
+        "answer_cache": answer_cache.get_stats(),
+        "traffic_capture": traffic.get_stats(),
+        "compression": compression.get_stats(),
+        "websocket": ws_transport.get_stats(),
+        "routing": router.get_stats(),
+        "lifecycle": lifecycle.get_stats(),
+        "startup": startup.get_stats(),
+        "model_routing": model_router.get_stats(),
+        "residency": residency.get_stats(),
+        "persistence": conversation_store.get_stats() if conversation_store else {"enabled": False},
         "api_configuration": {
-            "timeout_seconds": OLLAMA_TIMEOUT,
-            "max_response_tokens": 500,
-            "model_name": MODEL_NAME,
-            "ollama_url": OLLAMA_BASE_URL
+            "timeout_seconds": config.ollama_timeout,
+            "max_response_tokens": config.num_predict("chat"),
+            "model_name": config.model_name,
+            "ollama_url": config.ollama_base_url
         },
+        "configuration": config_manager.describe(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.route('/admin/queues', methods=['GET'])
+@admin_required
+def admin_queues():
+    """Per-session generation queue state"""
+    sessions = dispatcher.get_queue_snapshot()
+    sessions.sort(key=lambda s: (s["queued"], s["in_flight"]), reverse=True)
+
+    return jsonify({
+        "scheduler": dispatcher.get_stats(),
+        "sessions": sessions,
         "timestamp": datetime.now().isoformat()
     })
 
+@app.route('/admin/drain', methods=['POST'])
+@admin_required
+def admin_drain():
+    """Stop taking new generations and finish in-flight ones (the process keeps running)"""
+    started = lifecycle.begin_drain("admin")
+    return jsonify({"success": True, "started": started, "lifecycle": lifecycle.get_stats()})
+
+@app.route('/admin/answer-cache', methods=['GET', 'POST'])
+@admin_required
+def admin_answer_cache():
+    """List cached answers, or add a curated one: {"question", "answer", "pinned": true}"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        question = (data.get('question') or '').strip()
+        answer = (data.get('answer') or '').strip()
+        if not question or not answer:
+            return jsonify({"success": False, "error": "Both 'question' and 'answer' are required"}), 400
+        entry_id = answer_cache.store(question, answer, "curated", 0.0, pinned=bool(data.get('pinned', True)))
+        if entry_id is None:
+            return jsonify({"success": False, "error": "Answer cache is disabled or full of pinned entries"}), 409
+        return jsonify({"success": True, "id": entry_id})
+
+    return jsonify({
+        "stats": answer_cache.get_stats(),
+        "entries": answer_cache.entries(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.route('/admin/answer-cache/<entry_id>/<action>', methods=['POST'])
+@admin_required
+def admin_answer_cache_pin(entry_id, action):
+    """Pin (never evicted or expired) or unpin an entry"""
+    if action not in ('pin', 'unpin'):
+        return jsonify({"success": False, "error": "Action must be 'pin' or 'unpin'"}), 404
+    if not answer_cache.set_pinned(entry_id, action == 'pin'):
+        return jsonify({"success": False, "error": "No such entry"}), 404
+    return jsonify({"success": True, "id": entry_id, "pinned": action == 'pin'})
+
+@app.route('/admin/answer-cache/<entry_id>', methods=['DELETE'])
+@admin_required
+def admin_answer_cache_delete(entry_id):
+    """Remove one entry"""
+    if not answer_cache.purge(entry_id):
+        return jsonify({"success": False, "error": "No such entry"}), 404
+    return jsonify({"success": True, "removed": 1})
+
+@app.route('/admin/answer-cache/purge', methods=['POST'])
+@admin_required
+def admin_answer_cache_purge():
+    """Remove every entry; pinned entries too with {"include_pinned": true}"""
+    data = request.get_json(silent=True) or {}
+    removed = answer_cache.purge(include_pinned=bool(data.get('include_pinned')))
+    return jsonify({"success": True, "removed": removed})
+
 def cleanup_old_sessions():
     """Clean up sessions older than 24 hours"""
     cutoff_time = datetime.now().timestamp() - (24 * 60 * 60)  # 24 hours ago
@@ -524,22 +1502,80 @@ def cleanup_old_sessions():
     for session_id in sessions_to_remove:
         conversations.pop(session_id, None)
         session_metadata.pop(session_id, None)
-        logger.info(f"Cleaned up old session: {session_id[:8]}...")
+        continuations.discard(session_id)
+        retriever.discard(session_id)
+        router.forget(session_id)
+        if conversation_store:
+            conversation_store.record_removal(session_id)
+        # Throttled: a mass expiry logs a handful of these plus one summary line
+        logger.info("Cleaned up old session: %s...", session_id[:8],
+                    extra={"event": "session.cleanup", "session_id": session_id})
 
     if sessions_to_remove:
-        logger.info(f"Cleaned up {len(sessions_to_remove)} old sessions")
+        logger.info("Cleaned up %d old sessions", len(sessions_to_remove))
+
+    limiter.prune()
 
     stats["last_cleanup"] = datetime.now().isoformat()
     stats["active_sessions"] = len(session_metadata)
 
+def warm_up_model():
+    """Load the default model in the background, so the first chat after a restart doesn't pay for it"""
+    if os.getenv('STARTUP_WARM_MODEL', 'true').lower() != 'true':
+        return
+
+    def warm():
+        config = settings()
+        model = config.model_for("chat")
+        started = time.time()
+        try:
+            with residency.use(model):
+                # No prompt: Ollama just loads the model and keeps it for keep_alive
+                response = requests.post(f"{config.ollama_base_url}/api/generate",
+                                         json={"model": model, **config.request_params("chat")},
+                                         timeout=config.ollama_timeout)
+                response.raise_for_status()
+            logger.info("Model %s warmed up in %.2fs", model, time.time() - started)
+        except requests.RequestException as e:
+            logger.warning("Model warm-up for %s failed: %s", model, e)
+
+    threading.Thread(target=warm, name="model-warmup", daemon=True).start()
+
+startup.on_start("model_warmup", warm_up_model)
+startup.checkpoint("routes")
+
+def create_app() -> Flask:
+    """Start this process's background work, report it ready and return the app (for servers without gunicorn's hooks)
+
+    Call it once the server can accept connections, since readiness goes out
+    to systemd / READY_FILE straight away. gunicorn should load
+    fast_chatbot_api:app instead: with preload_app the import happens in the
+    master, and gunicorn.conf.py starts each worker.
+    """
+    startup.start()
+    startup.mark_ready()
+    return app
+
 if __name__ == '__main__':
+    from werkzeug.serving import make_server
+
     print("🚀 Starting Personal AI Assistant API...")
-    print(f"📊 Model: {MODEL_NAME}")
-    print(f"🔗 Ollama URL: {OLLAMA_BASE_URL}")
-    print(f"⏱️  Timeout: {OLLAMA_TIMEOUT} seconds")
-    print(f"🧠 Memory: {MAX_CONVERSATION_LENGTH} conversations × {MAX_CONTEXT_MESSAGES} messages")
+    config = settings()
+    print(f"📊 Model: {config.model_name}")
+    print(f"🔗 Ollama URL: {config.ollama_base_url}")
+    print(f"⏱️  Timeout: {config.ollama_timeout} seconds")
+    print(f"🧠 Memory: {config.max_conversation_length} conversations × {config.max_context_messages} messages")
     print("🌐 Access the test interface at: http://localhost:5000/")
     print("📡 API endpoints available at: /chat, /health, /stats")
-    print("💡 Tip: Set OLLAMA_TIMEOUT environment variable to adjust timeout")
-
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    print("💡 Tip: Edit config.json (or send SIGHUP) to retune without restarting")
+
+    port = int(os.getenv('PORT', '5000'))
+    if os.getenv('FLASK_DEBUG') == '1':
+        # The reloader imports everything twice; only for development
+        if os.getenv('WERKZEUG_RUN_MAIN') == 'true':
+            create_app()  # the reloader's serving process; its socket is already bound
+        app.run(host='0.0.0.0', port=port, debug=True)
+    else:
+        server = make_server('0.0.0.0', port, app, threaded=True)
+        create_app()  # the socket is bound and listening
+        server.serve_forever()
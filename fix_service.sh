@@ -62,11 +62,19 @@ After=network.target ollama.service
 Requires=ollama.service
 
 [Service]
-Type=simple
+# Ready as soon as a worker can serve (startup.py), not when the process has merely started
+Type=notify
+NotifyAccess=all
+TimeoutStartSec=60
 User=$USER
 WorkingDirectory=$PROJECT_DIR
 Environment=PATH=$PROJECT_DIR/venv/bin:/usr/local/bin:/usr/bin:/bin
-ExecStart=$PROJECT_DIR/venv/bin/gunicorn --workers 2 --bind 127.0.0.1:5000 --timeout 650 --keep-alive 2 --max-requests 1000 --max-requests-jitter 50 fast_chatbot_api:app
+ExecStart=$PROJECT_DIR/venv/bin/gunicorn -c gunicorn.conf.py fast_chatbot_api:app
+ExecReload=/bin/kill -s HUP \$MAINPID
+# SIGTERM goes to the gunicorn master only; it gives workers DRAIN_BUDGET
+# (gunicorn.conf.py) to finish in-flight generations before they exit
+KillMode=mixed
+TimeoutStopSec=150
 Restart=always
 RestartSec=3
 StandardOutput=journal
@@ -96,8 +104,7 @@ sudo systemctl enable personal-ai-assistant
 echo "🚀 Starting service..."
 sudo systemctl start personal-ai-assistant
 
-# Wait a moment
-sleep 5
+# The unit is Type=notify: start returns once a worker is serving
 
 # Check if it's running
 if sudo systemctl is-active --quiet personal-ai-assistant; then
@@ -98,7 +98,7 @@ cat > "$PROJECT_DIR/start_service.sh" << 'EOF'
 set -e
 cd /home/btldtdm1005/personal-ai-assistant
 source venv/bin/activate
-exec gunicorn --workers 2 --bind 127.0.0.1:5000 --timeout 650 --keep-alive 2 --max-requests 1000 --max-requests-jitter 50 fast_chatbot_api:app
+exec gunicorn -c gunicorn.conf.py fast_chatbot_api:app
 EOF
 
 chmod +x "$PROJECT_DIR/start_service.sh"
@@ -133,11 +133,19 @@ After=network.target ollama.service
 Requires=ollama.service
 
 [Service]
-Type=simple
+# Ready as soon as a worker can serve (startup.py), not when the process has merely started
+Type=notify
+NotifyAccess=all
+TimeoutStartSec=60
 User=btldtdm1005
 Group=btldtdm1005
 WorkingDirectory=/home/btldtdm1005/personal-ai-assistant
 ExecStart=/bin/bash /home/btldtdm1005/personal-ai-assistant/start_service.sh
+ExecReload=/bin/kill -s HUP $MAINPID
+# SIGTERM goes to the gunicorn master only; it gives workers DRAIN_BUDGET
+# (gunicorn.conf.py) to finish in-flight generations before they exit
+KillMode=mixed
+TimeoutStopSec=150
 Restart=always
 RestartSec=3
 StandardOutput=journal
@@ -162,15 +170,13 @@ sudo systemctl enable personal-ai-assistant
 echo "🚀 Starting service..."
 sudo systemctl start personal-ai-assistant
 
-# Wait for startup
-sleep 5
+# The unit is Type=notify: start returns once a worker is serving
 
 # Step 11: Verify service status
 if sudo systemctl is-active --quiet personal-ai-assistant; then
     echo "✅ Service is running!"
     
     # Test the API
-    sleep 2
     if curl -s http://localhost:5000/health >/dev/null; then
         echo "✅ API is responding!"
         echo ""
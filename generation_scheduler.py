@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Generation Scheduler
+Deficit round-robin dispatch of Ollama generations across sessions
+
+Each session gets its own FIFO queue. When a generation slot frees up, the
+dispatcher walks the sessions round-robin, topping each one up with a quantum
+scaled by its traffic class weight and granting its next request once the
+accumulated deficit covers that request's estimated cost. A session firing
+twenty long prompts therefore only gets its share of slots, and a first
+message from a new visitor is served within one round.
+
+Requests may carry an absolute deadline. A request still queued when its
+deadline passes is withdrawn (and skipped by the dispatcher if it reaches the
+head first), so no slot is spent on an answer nobody is waiting for.
+
+Requests also carry the model they will run on. When the model residency
+manager reports which models are loaded, a flow whose next request needs a
+cold model is passed over in favour of one whose model is already hot, so
+queued requests are batched per model instead of forcing a swap each time.
+A request is never passed over for longer than SCHEDULER_SWAP_DELAY seconds.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Quantum added per round, in estimated tokens, before the class weight is applied
+BASE_QUANTUM = 1000
+
+DEFAULT_WEIGHTS = {
+    "default": 1.0,
+    "new_session": 2.0,
+    "zoho": 2.0
+}
+
+
+class GenerationCancelled(Exception):
+    """Raised when a queued request is withdrawn before it gets a slot"""
+
+
+class DeadlineExceeded(GenerationCancelled):
+    """Raised when a request's deadline passes before it can usefully run"""
+
+
+def estimate_cost(prompt: str, num_predict: int) -> int:
+    """Rough generation cost in tokens: prompt tokens (~4 chars each) plus the output budget"""
+    return len(prompt) // 4 + num_predict
+
+
+def _parse_weights(value: str) -> Dict[str, float]:
+    """Parse "class:weight,class:weight" overrides on top of the defaults"""
+    weights = dict(DEFAULT_WEIGHTS)
+    for item in value.split(","):
+        if ":" not in item:
+            continue
+        name, weight = item.split(":", 1)
+        try:
+            weights[name.strip()] = max(0.1, float(weight))
+        except ValueError:
+            logger.warning("Ignoring malformed scheduler weight: %r", item)
+    return weights
+
+
+class _Ticket:
+    """A single queued generation request"""
+
+    __slots__ = ("session_id", "cost", "traffic_class", "deadline", "model", "enqueued_at", "granted_at",
+                 "event", "cancelled", "expired")
+
+    def __init__(self, session_id: str, cost: int, traffic_class: str, deadline: Optional[float] = None,
+                 model: Optional[str] = None):
+        self.session_id = session_id
+        self.cost = cost
+        self.traffic_class = traffic_class
+        self.deadline = deadline
+        self.model = model
+        self.enqueued_at = time.time()
+        self.granted_at = 0.0
+        self.event = threading.Event()
+        self.cancelled = False
+        self.expired = False
+
+
+class _Flow:
+    """Per-session queue and DRR state"""
+
+    __slots__ = ("session_id", "tickets", "deficit", "topped_up", "in_flight",
+                 "granted", "cost_granted", "wait_seconds", "last_class")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.tickets: Deque[_Ticket] = deque()
+        self.deficit = 0.0
+        self.topped_up = False
+        self.in_flight = 0
+        self.granted = 0
+        self.cost_granted = 0
+        self.wait_seconds = 0.0
+        self.last_class = "default"
+
+
+class GenerationDispatcher:
+    """Caps concurrent generations and shares slots fairly between sessions"""
+
+    def __init__(self, max_concurrent: int = 1, weights: Optional[Dict[str, float]] = None,
+                 quantum: int = BASE_QUANTUM, swap_delay: float = 10.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.weights = weights or dict(DEFAULT_WEIGHTS)
+        self.quantum = quantum
+        self.swap_delay = swap_delay
+        # Set by the residency manager; returns the models that can run without a swap
+        self.hot_models: Optional[Callable[[], Set[str]]] = None
+
+        self._lock = threading.Lock()
+        self._flows: Dict[str, _Flow] = {}
+        self._active: Deque[_Flow] = deque()  # flows with queued tickets, in round-robin order
+        self._in_flight = 0
+
+        self.stats = {
+            "dispatched": 0,
+            "cancelled": 0,
+            "expired": 0,
+            "affinity_reorders": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "by_class": {}
+        }
+
+    @classmethod
+    def from_env(cls) -> "GenerationDispatcher":
+        """Create a dispatcher from GENERATION_CONCURRENCY and SCHEDULER_WEIGHTS"""
+        return cls(
+            max_concurrent=int(os.getenv("GENERATION_CONCURRENCY", "1")),
+            weights=_parse_weights(os.getenv("SCHEDULER_WEIGHTS", "")),
+            quantum=int(os.getenv("SCHEDULER_QUANTUM", str(BASE_QUANTUM))),
+            swap_delay=float(os.getenv("SCHEDULER_SWAP_DELAY", "10"))
+        )
+
+    @contextmanager
+    def slot(self, session_id: str, cost: int, traffic_class: str = "default",
+             cancelled: Optional[threading.Event] = None,
+             on_wait: Optional[Callable[[int], None]] = None, poll_interval: float = 1.0,
+             deadline: Optional[float] = None, model: Optional[str] = None):
+        """Block until this session's request is scheduled, then hold a generation slot
+
+        While queued, on_wait(position) is called every poll_interval seconds, and
+        setting `cancelled` withdraws the request with GenerationCancelled. A
+        request still queued at `deadline` (epoch seconds) raises DeadlineExceeded.
+        `model` lets the dispatcher prefer requests for models already loaded.
+        """
+        ticket = self._enqueue(session_id, cost, traffic_class, deadline, model)
+        try:
+            # Never block indefinitely: cap_deadlines() can shorten a queued ticket's deadline
+            while not ticket.event.wait(self._wait_interval(ticket, poll_interval)):
+                if cancelled is not None and cancelled.is_set():
+                    raise GenerationCancelled("Request withdrawn while queued")
+                if ticket.deadline is not None and time.time() >= ticket.deadline:
+                    raise DeadlineExceeded("Deadline passed while queued")
+                if on_wait:
+                    on_wait(self.position(ticket))
+            if ticket.expired:
+                raise DeadlineExceeded("Deadline passed while queued")
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    @staticmethod
+    def _wait_interval(ticket: _Ticket, poll_interval: float) -> float:
+        """How long to block before re-checking cancellation, the deadline or the queue position"""
+        if ticket.deadline is None:
+            return poll_interval
+        return min(poll_interval, max(ticket.deadline - time.time(), 0.0) + 0.01)
+
+    def cap_deadlines(self, at: float) -> int:
+        """Shorten the deadline of every queued request to `at` (used while draining)"""
+        capped = 0
+        with self._lock:
+            for flow in self._active:
+                for ticket in flow.tickets:
+                    if ticket.deadline is None or ticket.deadline > at:
+                        ticket.deadline = at
+                        capped += 1
+        return capped
+
+    def position(self, ticket: _Ticket) -> int:
+        """Approximate queue position: queued requests that arrived before this one, plus one"""
+        with self._lock:
+            if ticket.event.is_set():
+                return 0
+            return 1 + sum(
+                1 for flow in self._active for t in flow.tickets if t.enqueued_at < ticket.enqueued_at
+            )
+
+    def _enqueue(self, session_id: str, cost: int, traffic_class: str,
+                 deadline: Optional[float] = None, model: Optional[str] = None) -> _Ticket:
+        """Add a ticket to its session's queue and dispatch if a slot is free"""
+        ticket = _Ticket(session_id, max(1, cost), traffic_class, deadline, model)
+        with self._lock:
+            flow = self._flows.get(session_id)
+            if flow is None:
+                flow = self._flows[session_id] = _Flow(session_id)
+            if not flow.tickets:
+                self._active.append(flow)
+            flow.tickets.append(ticket)
+            flow.last_class = traffic_class
+            self._dispatch_locked()
+        return ticket
+
+    def _release(self, ticket: _Ticket):
+        """Return a slot (or withdraw an ungranted ticket) and dispatch the next request"""
+        with self._lock:
+            flow = self._flows.get(ticket.session_id)
+            if ticket.granted_at:
+                self._in_flight -= 1
+                if flow:
+                    flow.in_flight -= 1
+            elif flow and ticket in flow.tickets:
+                flow.tickets.remove(ticket)
+                if ticket.deadline is not None and time.time() >= ticket.deadline:
+                    ticket.expired = True
+                    self.stats["expired"] += 1
+                else:
+                    ticket.cancelled = True
+                    self.stats["cancelled"] += 1
+                if not flow.tickets and flow in self._active:
+                    self._active.remove(flow)
+                    flow.deficit = 0.0
+                    flow.topped_up = False
+
+            if flow and not flow.tickets and flow.in_flight == 0:
+                self._flows.pop(ticket.session_id, None)
+
+            self._dispatch_locked()
+
+    def _dispatch_locked(self):
+        """Grant free slots using deficit round-robin; caller holds the lock"""
+        hot = self.hot_models() if self.hot_models and len(self._active) > 1 else None
+        while self._in_flight < self.max_concurrent and self._active:
+            if hot:
+                self._prefer_hot_locked(hot)
+            flow = self._active[0]
+            head = flow.tickets[0]
+
+            if head.deadline is not None and time.time() >= head.deadline:
+                # Caller has given up; skip it without charging the session's deficit
+                self._expire_head_locked(flow)
+                continue
+
+            if not flow.topped_up:
+                flow.deficit += self.quantum * self.weights.get(head.traffic_class, 1.0)
+                flow.topped_up = True
+
+            if head.cost > flow.deficit:
+                # Not enough credit this round; move on and top up again next time around
+                flow.topped_up = False
+                self._active.rotate(-1)
+                continue
+
+            flow.deficit -= head.cost
+            flow.tickets.popleft()
+            if not flow.tickets:
+                self._active.popleft()
+                flow.deficit = 0.0
+                flow.topped_up = False
+
+            self._grant_locked(flow, head)
+
+    def _prefer_hot_locked(self, hot: Set[str]):
+        """Rotate a flow whose next request runs on a loaded model to the front
+
+        Leaves the order alone when the front flow's model is hot (or unknown),
+        or when it has already waited swap_delay for its model.
+        """
+        head = self._active[0].tickets[0]
+        if head.model is None or head.model in hot or time.time() - head.enqueued_at >= self.swap_delay:
+            return
+        for i, flow in enumerate(self._active):
+            model = flow.tickets[0].model
+            if i and (model is None or model in hot):
+                self._active.rotate(-i)
+                self.stats["affinity_reorders"] += 1
+                return
+
+    def _expire_head_locked(self, flow: _Flow):
+        """Drop a flow's expired head ticket and wake its (probably departed) caller"""
+        ticket = flow.tickets.popleft()
+        ticket.expired = True
+        self.stats["expired"] += 1
+        if not flow.tickets:
+            self._active.popleft()
+            flow.deficit = 0.0
+            flow.topped_up = False
+        ticket.event.set()
+
+    def _grant_locked(self, flow: _Flow, ticket: _Ticket):
+        """Mark a ticket as running and wake its request thread"""
+        ticket.granted_at = time.time()
+        wait = ticket.granted_at - ticket.enqueued_at
+
+        self._in_flight += 1
+        flow.in_flight += 1
+        flow.granted += 1
+        flow.cost_granted += ticket.cost
+        flow.wait_seconds += wait
+
+        self.stats["dispatched"] += 1
+        self.stats["total_wait_seconds"] += wait
+        self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], wait)
+        by_class = self.stats["by_class"].setdefault(ticket.traffic_class, {"dispatched": 0, "cost": 0})
+        by_class["dispatched"] += 1
+        by_class["cost"] += ticket.cost
+
+        ticket.event.set()
+
+    def queue_depth(self) -> int:
+        """Number of requests waiting for a slot"""
+        with self._lock:
+            return sum(len(flow.tickets) for flow in self._active)
+
+    def get_stats(self) -> Dict:
+        """Summary for /stats"""
+        with self._lock:
+            queued = sum(len(flow.tickets) for flow in self._active)
+            in_flight = self._in_flight
+        dispatched = self.stats["dispatched"]
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": in_flight,
+            "queued": queued,
+            "weights": self.weights,
+            "dispatched": dispatched,
+            "cancelled": self.stats["cancelled"],
+            "expired": self.stats["expired"],
+            "affinity_reorders": self.stats["affinity_reorders"],
+            "avg_wait_seconds": round(self.stats["total_wait_seconds"] / dispatched, 3) if dispatched else 0.0,
+            "max_wait_seconds": round(self.stats["max_wait_seconds"], 3),
+            "by_class": self.stats["by_class"]
+        }
+
+    def get_queue_snapshot(self) -> List[Dict]:
+        """Per-session queue state for the admin view"""
+        now = time.time()
+        with self._lock:
+            flows = list(self._flows.values())
+            return [
+                {
+                    "session_id": flow.session_id,
+                    "traffic_class": flow.last_class,
+                    "queued": len(flow.tickets),
+                    "queued_cost": sum(t.cost for t in flow.tickets),
+                    "oldest_wait_seconds": round(now - flow.tickets[0].enqueued_at, 3) if flow.tickets else 0.0,
+                    "in_flight": flow.in_flight,
+                    "deficit": round(flow.deficit, 1),
+                    "granted": flow.granted,
+                    "cost_granted": flow.cost_granted,
+                    "avg_wait_seconds": round(flow.wait_seconds / flow.granted, 3) if flow.granted else 0.0
+                }
+                for flow in flows
+            ]
+
+
+# Shared by the API and the Zoho webhook blueprint
+dispatcher = GenerationDispatcher.from_env()
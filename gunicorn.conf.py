@@ -0,0 +1,68 @@
+"""
+Gunicorn settings for the Personal AI Assistant API
+
+    gunicorn -c gunicorn.conf.py fast_chatbot_api:app
+
+Workers drain instead of dropping requests (see lifecycle.py):
+
+    - `systemctl reload` (SIGHUP) starts fresh workers, then sends SIGTERM to
+      the old ones; they finish in-flight generations and hand their
+      conversations to the new workers through the persistence journal
+    - `systemctl stop` (SIGTERM) drains every worker within graceful_timeout
+    - max_requests recycling drains the recycled worker the same way
+
+DRAIN_BUDGET (seconds, default 120) sets how long in-flight requests get;
+graceful_timeout leaves a little on top for the handover itself. The
+systemd unit's TimeoutStopSec has to be longer still.
+
+Startup (see startup.py): with preload_app (GUNICORN_PRELOAD, default true)
+the master imports the app and restores conversations once; workers fork
+from it, sharing that memory copy-on-write, start their own threads and
+signal handlers in post_worker_init and report ready (systemd Type=notify,
+READY_FILE). A new worker is serving milliseconds after the fork instead of
+re-importing everything. Preloaded code is not reloaded by SIGHUP: deploy
+code changes with a restart, or set GUNICORN_PRELOAD=false.
+"""
+
+import gc
+import os
+
+bind = os.getenv("GUNICORN_BIND", "127.0.0.1:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = 650
+keepalive = 2
+max_requests = 1000
+max_requests_jitter = 50
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+drain_budget = float(os.getenv("DRAIN_BUDGET", "120"))
+graceful_timeout = int(drain_budget) + 10
+
+
+def when_ready(server):
+    """Master is up; with a preloaded app, keep the imported objects out of the workers' garbage collections"""
+    if preload_app:
+        # Otherwise the first collection in each worker touches, and so copies, every shared page
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    """Start this worker (threads, signal handlers, the drain chained before gunicorn's SIGTERM) and report it ready"""
+    from startup import startup
+    startup.start()
+    startup.mark_ready()
+
+
+def post_request(worker, req, environ, resp):
+    """A worker that just reached max_requests stops accepting; drain it like a reload"""
+    if not worker.alive:
+        from lifecycle import lifecycle
+        lifecycle.begin_drain("max_requests")
+
+
+def worker_exit(server, worker):
+    """Make sure the handover ran before the process goes away"""
+    from lifecycle import lifecycle
+    lifecycle.begin_drain("exit")
+    lifecycle.wait_drained(timeout=10)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Worker Lifecycle
+Graceful drain on reload, shutdown and max-requests recycling
+
+A worker is "serving" until something asks it to stop: SIGTERM (gunicorn
+sends it to old workers on HUP reload and on shutdown), gunicorn's
+max_requests recycling (gunicorn.conf.py), or POST /admin/drain. It then
+switches to "draining":
+
+    - new generations (/chat, /chat/stream, /chat/continue, Zoho webhook)
+      get 503 with Retry-After, so clients and nginx retry on another worker
+    - /health answers 503 "draining", so health checks take the worker out
+    - requests already in flight, streams included, run to completion
+    - deadlines are capped at the end of the drain budget, so queued and
+      newly started generations size their answers to finish in time
+
+When the last in-flight request ends, or DRAIN_BUDGET seconds pass, the
+on_drained callbacks run (flush the conversation journal and leave a
+handover marker for the replacement worker) and the state becomes "stopped".
+
+Environment:
+    DRAIN_BUDGET    seconds in-flight requests get to finish (default 120)
+"""
+
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SERVING = "serving"
+DRAINING = "draining"
+STOPPED = "stopped"
+
+# Retry-After for generations rejected while draining
+RETRY_AFTER_SECONDS = 2
+
+
+class LifecycleManager:
+    """Tracks in-flight generations and drains them before the worker exits"""
+
+    def __init__(self, drain_budget: float = 120.0):
+        self.drain_budget = drain_budget
+        self.state = SERVING
+        self.drain_reason = ""
+        self.drain_started_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._on_drain_start: List[Callable[[float], None]] = []
+        self._on_drained: List[Callable[[], None]] = []
+        self._drained = threading.Event()
+        self._previous_sigterm = None
+        self.stats = {
+            "admitted": 0,
+            "rejected_draining": 0,
+            "drain_seconds": None,
+            "abandoned": 0
+        }
+
+    @classmethod
+    def from_env(cls) -> "LifecycleManager":
+        return cls(drain_budget=float(os.getenv("DRAIN_BUDGET", "120")))
+
+    # ------------------------------------------------------------------
+    # Request path
+    # ------------------------------------------------------------------
+
+    @property
+    def draining(self) -> bool:
+        return self.state != SERVING
+
+    def admit(self) -> bool:
+        """Count a new generation in flight; False once draining has begun"""
+        with self._lock:
+            if self.state != SERVING:
+                self.stats["rejected_draining"] += 1
+                return False
+            self._in_flight += 1
+            self.stats["admitted"] += 1
+            return True
+
+    def done(self):
+        """A generation admitted earlier has finished (streams: the response closed)"""
+        with self._lock:
+            self._in_flight = max(self._in_flight - 1, 0)
+            if self._in_flight == 0:
+                self._idle.notify_all()
+
+    # ------------------------------------------------------------------
+    # Draining
+    # ------------------------------------------------------------------
+
+    def on_drain_start(self, callback: Callable[[float], None]):
+        """Register callback(drain_deadline) run when draining begins"""
+        self._on_drain_start.append(callback)
+
+    def on_drained(self, callback: Callable[[], None]):
+        """Register a callback run once in-flight requests have finished (or the budget ran out)"""
+        self._on_drained.append(callback)
+
+    def begin_drain(self, reason: str) -> bool:
+        """Stop admitting generations and finish in the background; False if already draining"""
+        with self._lock:
+            if self.state != SERVING:
+                return False
+            self.state = DRAINING
+            self.drain_reason = reason
+            self.drain_started_at = time.time()
+            in_flight = self._in_flight
+
+        deadline = self.drain_started_at + self.drain_budget
+        logger.info("Draining (%s): %d generation(s) in flight, budget %.0fs", reason, in_flight, self.drain_budget,
+                    extra={"event": "lifecycle.drain", "reason": reason, "in_flight": in_flight})
+        for callback in self._on_drain_start:
+            try:
+                callback(deadline)
+            except Exception as e:
+                logger.error("Drain start callback failed: %s", e)
+
+        threading.Thread(target=self._finish, args=(deadline,), name="lifecycle-drain", daemon=True).start()
+        return True
+
+    def _finish(self, deadline: float):
+        with self._lock:
+            while self._in_flight and time.time() < deadline:
+                self._idle.wait(deadline - time.time())
+            abandoned = self._in_flight
+
+        self.stats["abandoned"] = abandoned
+        self.stats["drain_seconds"] = round(time.time() - self.drain_started_at, 3)
+        if abandoned:
+            logger.warning("Drain budget exhausted with %d generation(s) still running", abandoned)
+        else:
+            logger.info("Drained in %.1fs", self.stats["drain_seconds"])
+
+        for callback in self._on_drained:
+            try:
+                callback()
+            except Exception as e:
+                logger.error("Drained callback failed: %s", e)
+        self.state = STOPPED
+        self._drained.set()
+
+    def wait_drained(self, timeout: Optional[float] = None) -> bool:
+        """Block until the drain has finished"""
+        return self._drained.wait(timeout)
+
+    def install_signal_handler(self):
+        """Drain on SIGTERM, then hand the signal to the previous handler (gunicorn's)
+
+        gunicorn's own handler stops the accept loop and waits graceful_timeout
+        for in-flight requests, which is what lets the drain run to the end.
+        Only possible from the main thread.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+
+        previous = signal.getsignal(signal.SIGTERM)
+        if getattr(previous, "__self__", None) is self:
+            return  # already installed in this process
+
+        self._previous_sigterm = previous
+        signal.signal(signal.SIGTERM, self._handle_sigterm)
+
+    def _handle_sigterm(self, signum, frame):
+        self.begin_drain("SIGTERM")
+        previous = self._previous_sigterm
+        if callable(previous):
+            previous(signum, frame)
+        elif previous == signal.SIG_DFL:
+            # Nothing downstream will wait for us; exit once drained
+            threading.Thread(target=self._exit_when_drained, name="lifecycle-exit", daemon=True).start()
+
+    def _exit_when_drained(self):
+        self.wait_drained(self.drain_budget + 5)
+        os._exit(0)
+
+    def get_stats(self) -> Dict:
+        """Summary for /stats and /health"""
+        with self._lock:
+            in_flight = self._in_flight
+        summary = {
+            "state": self.state,
+            "in_flight": in_flight,
+            "drain_budget_seconds": self.drain_budget,
+            **self.stats
+        }
+        if self.drain_started_at:
+            summary["drain_reason"] = self.drain_reason
+            summary["draining_for_seconds"] = round(time.time() - self.drain_started_at, 1)
+        return summary
+
+
+# Shared by the API and gunicorn.conf.py hooks
+lifecycle = LifecycleManager.from_env()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Log Pipeline
+Non-blocking structured logging: queue handler on the request path, background listener for I/O
+
+Request threads only run the cheap filters (level, sampling, burst throttling)
+and enqueue the record; message formatting, JSON encoding and the write to
+stderr/journald all happen on the listener thread. Records carry the request
+and session IDs bound for the current request.
+
+Call sites pass an "event" name to opt into sampling and throttling:
+    logger.info("Session %s... now has %d exchanges", sid[:8], n, extra={"event": "conversation.append"})
+
+Environment:
+    LOG_LEVEL            INFO
+    LOG_FORMAT           json | text
+    LOG_SAMPLE_RATES     event:rate pairs, e.g. "conversation.append:0.1,ollama.request:0.5"
+    LOG_BURST_LIMIT      max records per event per window before throttling (default 20)
+    LOG_BURST_WINDOW     throttle window in seconds (default 10)
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+request_id_var: contextvars.ContextVar = contextvars.ContextVar("request_id", default=None)
+session_id_var: contextvars.ContextVar = contextvars.ContextVar("session_id", default=None)
+
+# Events sampled by default because they fire on every request
+DEFAULT_SAMPLE_RATES = {
+    "conversation.append": 0.1,
+    "ollama.request": 0.25
+}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def bind_request_context(request_id: Optional[str], session_id: Optional[str] = None):
+    """Attach IDs to every record logged from the current context"""
+    request_id_var.set(request_id)
+    session_id_var.set(session_id)
+
+
+def _parse_rates(value: str) -> Dict[str, float]:
+    rates = dict(DEFAULT_SAMPLE_RATES)
+    for item in value.split(","):
+        if ":" in item:
+            name, rate = item.rsplit(":", 1)
+            try:
+                rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+            except ValueError:
+                continue
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """Stamp request/session IDs onto the record on the caller's thread"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        if getattr(record, "session_id", None) is None:
+            record.session_id = session_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of records for high-volume events; warnings and errors always pass"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, "event", None)
+        if event is None or record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(event, 1.0)
+        if rate >= 1.0:
+            return True
+        if random.random() < rate:
+            record.sample_rate = rate
+            return True
+        return False
+
+
+class BurstThrottleFilter(logging.Filter):
+    """Cap records per event per window and report how many were suppressed"""
+
+    def __init__(self, limit: int = 20, window: float = 10.0):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        self._windows: Dict[str, list] = {}  # event -> [window_start, emitted, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, "event", None)
+        if event is None:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(event)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                self._windows[event] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed_before = suppressed
+                return True
+            if state[1] < self.limit:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records without formatting them on the caller's thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # In-process queue: no pickling, so args can stay unformatted until the listener runs
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with request context and any extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+            "thread": record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable format that still shows the request context"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s %(session_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        if getattr(record, "suppressed_before", None):
+            text += f" (+{record.suppressed_before} similar suppressed)"
+        return text
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None) -> logging.handlers.QueueListener:
+    """Replace root handlers with the queue pipeline; idempotent"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower()
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(_parse_rates(os.getenv("LOG_SAMPLE_RATES", ""))))
+    queue_handler.addFilter(BurstThrottleFilter(
+        limit=int(os.getenv("LOG_BURST_LIMIT", "20")),
+        window=float(os.getenv("LOG_BURST_WINDOW", "10"))
+    ))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
+
+
+def _restart_listener_after_fork():
+    """A forked child (a gunicorn worker of a preloaded app) inherits the queue handler but no listener thread"""
+    global _listener
+    if _listener is None:
+        return
+
+    log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, LazyQueueHandler):
+            handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
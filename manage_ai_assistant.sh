@@ -20,6 +20,7 @@ API_PORT=5000
 OLLAMA_PORT=11434
 LOG_FILE="ai_assistant.log"
 PID_FILE="ai_assistant.pid"
+DRAIN_WAIT=$(( ${DRAIN_BUDGET:-120} + 10 ))
 
 print_banner() {
     echo -e "${PURPLE}"
@@ -153,8 +154,19 @@ stop_services() {
     # Stop API
     if [ -f "$PID_FILE" ]; then
         if kill -0 $(cat $PID_FILE) 2>/dev/null; then
+            # SIGTERM drains: in-flight answers finish (up to DRAIN_BUDGET) before exit
             kill $(cat $PID_FILE)
-            print_status "✅ API server stopped" $GREEN
+            print_status "⏳ Waiting for in-flight requests to finish..." $YELLOW
+            for i in $(seq 1 $DRAIN_WAIT); do
+                kill -0 $(cat $PID_FILE) 2>/dev/null || break
+                sleep 1
+            done
+            if kill -0 $(cat $PID_FILE) 2>/dev/null; then
+                kill -9 $(cat $PID_FILE)
+                print_status "⚠️ API server did not drain in ${DRAIN_WAIT}s, killed" $YELLOW
+            else
+                print_status "✅ API server stopped" $GREEN
+            fi
         fi
         rm -f $PID_FILE
     fi
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Metrics History
+Fixed-size ring buffer of recent throughput, latency and queue depth
+
+/stats reports lifetime counters. This keeps the last METRICS_WINDOW seconds
+(default one hour) in METRICS_RESOLUTION-second buckets (default 10), so
+current rates can be read straight from /stats/history:
+
+    requests, failures      deltas of the API's lifetime counters, sampled per second
+    tokens, eval_seconds    Ollama eval_count / eval_duration (tokens per second)
+    latency histogram       Ollama total_duration, log-spaced bins, for percentiles
+    queue depth             sampled once per second: max and mean
+
+Every series is a flat array.array indexed by slot, so memory is fixed at
+startup and a record is one index computation plus a few increments. A slot
+is cleared lazily when time wraps round to it.
+"""
+
+import math
+import os
+import threading
+import time
+from array import array
+from typing import Callable, Dict, List, Optional
+
+# Latency histogram: LATENCY_BINS log-spaced upper bounds from 50ms to ~13min
+LATENCY_MIN_SECONDS = 0.05
+LATENCY_GROWTH = 1.5
+LATENCY_BINS = 25
+LATENCY_BOUNDS = [LATENCY_MIN_SECONDS * LATENCY_GROWTH ** i for i in range(LATENCY_BINS)]
+_LOG_GROWTH = math.log(LATENCY_GROWTH)
+
+
+def _latency_bin(seconds: float) -> int:
+    if seconds <= LATENCY_MIN_SECONDS:
+        return 0
+    return min(int(math.ceil(math.log(seconds / LATENCY_MIN_SECONDS) / _LOG_GROWTH)), LATENCY_BINS - 1)
+
+
+def _percentile(histogram: List[int], total: int, fraction: float) -> Optional[float]:
+    """Upper bound of the bin holding the given fraction of samples"""
+    if not total:
+        return None
+    rank = fraction * total
+    seen = 0
+    for i, count in enumerate(histogram):
+        seen += count
+        if seen >= rank:
+            return round(LATENCY_BOUNDS[i], 3)
+    return round(LATENCY_BOUNDS[-1], 3)
+
+
+class MetricsHistory:
+    """Ring buffer of per-bucket counters covering a fixed window"""
+
+    def __init__(self, resolution: int = 10, window: int = 3600):
+        self.resolution = max(int(resolution), 1)
+        self.slots = max(window // self.resolution, 1)
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+
+        n = self.slots
+        self._epoch = array("q", [-1] * n)       # bucket number each slot currently holds
+        self._requests = array("L", [0] * n)
+        self._failures = array("L", [0] * n)
+        self._tokens = array("L", [0] * n)
+        self._eval_seconds = array("d", [0.0] * n)
+        self._queue_max = array("L", [0] * n)
+        self._queue_sum = array("L", [0] * n)
+        self._queue_samples = array("L", [0] * n)
+        self._latency = array("L", [0] * (n * LATENCY_BINS))
+
+    @classmethod
+    def from_env(cls) -> "MetricsHistory":
+        return cls(
+            resolution=int(os.getenv("METRICS_RESOLUTION", "10")),
+            window=int(os.getenv("METRICS_WINDOW", "3600"))
+        )
+
+    # ------------------------------------------------------------------
+    # Recording (request path)
+    # ------------------------------------------------------------------
+
+    def _slot(self, now: float) -> int:
+        """Slot for the current bucket, cleared if it still holds an old one; caller holds the lock"""
+        bucket = int(now // self.resolution)
+        slot = bucket % self.slots
+        if self._epoch[slot] != bucket:
+            self._epoch[slot] = bucket
+            self._requests[slot] = 0
+            self._failures[slot] = 0
+            self._tokens[slot] = 0
+            self._eval_seconds[slot] = 0.0
+            self._queue_max[slot] = 0
+            self._queue_sum[slot] = 0
+            self._queue_samples[slot] = 0
+            base = slot * LATENCY_BINS
+            self._latency[base:base + LATENCY_BINS] = array("L", [0] * LATENCY_BINS)
+        return slot
+
+    def record_generation(self, model: str, result: Dict):
+        """Tokens and latency from a final /api/generate chunk (ThroughputTracker listener)"""
+        total = result.get("total_duration")
+        with self._lock:
+            slot = self._slot(time.time())
+            if result.get("eval_count") and result.get("eval_duration"):
+                self._tokens[slot] += int(result["eval_count"])
+                self._eval_seconds[slot] += result["eval_duration"] / 1e9
+            if total:
+                self._latency[slot * LATENCY_BINS + _latency_bin(total / 1e9)] += 1
+
+    def record_sample(self, queue_depth: int, requests: int, failures: int):
+        """One sampler tick: current queue depth plus requests and failures since the last tick"""
+        with self._lock:
+            slot = self._slot(time.time())
+            self._requests[slot] += requests
+            self._failures[slot] += failures
+            self._queue_sum[slot] += queue_depth
+            self._queue_samples[slot] += 1
+            if queue_depth > self._queue_max[slot]:
+                self._queue_max[slot] = queue_depth
+
+    def start_sampler(self, sample: Callable[[], tuple], interval: float = 1.0):
+        """Poll (queue depth, lifetime requests, lifetime failures) in the background
+
+        Request counts come from the API's own lifetime counters, so every
+        route that counts a request or a failure shows up here without
+        touching the request path.
+        """
+        if self._sampler:
+            return
+
+        def run():
+            _, last_requests, last_failures = sample()
+            while True:
+                time.sleep(interval)
+                try:
+                    depth, requests, failures = sample()
+                except Exception:
+                    continue
+                self.record_sample(depth, max(requests - last_requests, 0), max(failures - last_failures, 0))
+                last_requests, last_failures = requests, failures
+
+        self._sampler = threading.Thread(target=run, name="metrics-sampler", daemon=True)
+        self._sampler.start()
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+
+    def history(self, minutes: Optional[float] = None, step: Optional[int] = None) -> Dict:
+        """Points covering the last `minutes`, each aggregating `step` seconds (a multiple of the resolution)
+
+        Both are clamped to the window, so a read never touches more than
+        `slots` buckets while holding the lock the request path records under.
+        """
+        window = self.slots * self.resolution
+        span = int(min((minutes or window / 60) * 60, window))
+        step = min(max(int(step or self.resolution), self.resolution), window)
+        per_point = max(step // self.resolution, 1)
+        step = per_point * self.resolution
+
+        now_bucket = int(time.time() // self.resolution)
+        oldest_bucket = now_bucket - self.slots + 1
+        first_bucket = now_bucket - span // self.resolution + 1
+        # Align points to multiples of the step so repeated polls line up
+        first_bucket -= first_bucket % per_point
+
+        points = []
+        with self._lock:
+            for start in range(first_bucket, now_bucket + 1, per_point):
+                # The first point may reach back before the window; it only covers what's kept
+                points.append(self._aggregate(max(start, oldest_bucket), min(start + per_point, now_bucket + 1)))
+        return {
+            "resolution_seconds": self.resolution,
+            "window_seconds": window,
+            "step_seconds": step,
+            "points": points
+        }
+
+    def _aggregate(self, first_bucket: int, end_bucket: int) -> Dict:
+        """Combine buckets [first_bucket, end_bucket) into one point; caller holds the lock"""
+        requests = failures = tokens = queue_max = queue_sum = queue_samples = 0
+        eval_seconds = 0.0
+        histogram = [0] * LATENCY_BINS
+        for bucket in range(first_bucket, end_bucket):
+            slot = bucket % self.slots
+            if self._epoch[slot] != bucket:
+                continue
+            requests += self._requests[slot]
+            failures += self._failures[slot]
+            tokens += self._tokens[slot]
+            eval_seconds += self._eval_seconds[slot]
+            queue_max = max(queue_max, self._queue_max[slot])
+            queue_sum += self._queue_sum[slot]
+            queue_samples += self._queue_samples[slot]
+            base = slot * LATENCY_BINS
+            for i in range(LATENCY_BINS):
+                histogram[i] += self._latency[base + i]
+
+        seconds = (end_bucket - first_bucket) * self.resolution
+        generations = sum(histogram)
+        return {
+            "t": first_bucket * self.resolution,
+            "requests": requests,
+            "failures": failures,
+            "requests_per_second": round(requests / seconds, 3),
+            "tokens": tokens,
+            "tokens_per_second": round(tokens / eval_seconds, 2) if eval_seconds else None,
+            "latency_seconds": {
+                "count": generations,
+                "p50": _percentile(histogram, generations, 0.50),
+                "p95": _percentile(histogram, generations, 0.95),
+                "p99": _percentile(histogram, generations, 0.99)
+            },
+            "queue_depth": {
+                "max": queue_max,
+                "mean": round(queue_sum / queue_samples, 2) if queue_samples else None
+            }
+        }
+
+
+# Fed by the API's sampler and the throughput tracker
+history = MetricsHistory.from_env()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Model Residency
+Keeps the set of models loaded in Ollama within a memory budget, evicting least recently used
+
+Ollama loads a model on the first request that names it and keeps it for
+keep_alive. With several models on one small VM that means either thrashing
+(every switch reloads) or running out of memory. The residency manager:
+
+    - tracks loaded models and their footprint from /api/ps (falling back to
+      MODEL_MEMORY overrides, the /api/tags size, or a default)
+    - before a generation, unloads idle models (keep_alive 0), least recently
+      used first, until the requested model fits in MODEL_MEMORY_BUDGET
+    - tells the dispatcher which models are "hot" so queued requests for a
+      loaded model are served before ones that would force a swap
+
+Environment:
+    MODEL_MEMORY_BUDGET     e.g. "6G" (default 6 GiB, sized for an 8 GB VM)
+    MODEL_MEMORY            per-model overrides, e.g. "phi3:mini=2.6G,mistral:7b=4.9G"
+    MODEL_PS_INTERVAL       seconds between /api/ps refreshes (default 5)
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set
+
+import requests
+
+from runtime_config import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FOOTPRINT = 4 * 1024 ** 3
+
+# Resident size is a bit above the on-disk size (KV cache, compute buffers)
+TAGS_OVERHEAD = 1.2
+
+SIZE_RE = re.compile(r"^\s*([\d.]+)\s*([KMGT]?)i?B?\s*$", re.IGNORECASE)
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(value: str) -> int:
+    """Parse "6G", "4800M", "2.5GiB" or plain bytes"""
+    match = SIZE_RE.match(value)
+    if not match:
+        raise ValueError(f"Invalid size: {value!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def _parse_overrides(value: str) -> Dict[str, int]:
+    overrides = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        model, size = item.rsplit("=", 1)
+        try:
+            overrides[model.strip()] = parse_size(size)
+        except ValueError:
+            logger.warning("Ignoring malformed model memory override: %r", item)
+    return overrides
+
+
+class _ModelState:
+    __slots__ = ("name", "loaded", "size", "in_use", "last_used", "requests", "loads", "unloads")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.loaded = False
+        self.size = 0
+        self.in_use = 0
+        self.last_used = 0.0
+        self.requests = 0
+        self.loads = 0
+        self.unloads = 0
+
+
+class ModelResidencyManager:
+    """LRU residency of Ollama models under a memory budget"""
+
+    def __init__(self, memory_budget: int = 6 * 1024 ** 3, overrides: Optional[Dict[str, int]] = None,
+                 ps_interval: float = 5.0):
+        self.memory_budget = memory_budget
+        self.overrides = overrides or {}
+        self.ps_interval = ps_interval
+        self._lock = threading.Lock()
+        self._models: Dict[str, _ModelState] = {}
+        self._tag_sizes: Optional[Dict[str, int]] = None
+        self._last_ps = 0.0
+        self.stats = {"swaps": 0, "cold_loads": 0, "evictions": 0, "over_budget": 0, "ps_failures": 0}
+
+    @classmethod
+    def from_env(cls) -> "ModelResidencyManager":
+        return cls(
+            memory_budget=parse_size(os.getenv("MODEL_MEMORY_BUDGET", "6G")),
+            overrides=_parse_overrides(os.getenv("MODEL_MEMORY", "")),
+            ps_interval=float(os.getenv("MODEL_PS_INTERVAL", "5"))
+        )
+
+    # ------------------------------------------------------------------
+    # Ollama state
+    # ------------------------------------------------------------------
+
+    def refresh(self, force: bool = False):
+        """Reconcile with Ollama's /api/ps (at most every ps_interval unless forced)"""
+        if not force and time.time() - self._last_ps < self.ps_interval:
+            return
+        self._last_ps = time.time()
+        try:
+            response = requests.get(f"{settings().ollama_base_url}/api/ps", timeout=3)
+            response.raise_for_status()
+            running = {m.get("name") or m.get("model"): m for m in response.json().get("models", [])}
+        except (requests.RequestException, ValueError) as e:
+            self.stats["ps_failures"] += 1
+            logger.debug("Could not refresh loaded models: %s", e)
+            return
+
+        with self._lock:
+            for name, info in running.items():
+                state = self._models.setdefault(name, _ModelState(name))
+                state.loaded = True
+                if info.get("size"):
+                    state.size = int(info["size"])
+            for name, state in self._models.items():
+                if name not in running and state.in_use == 0:
+                    # Unloaded by Ollama itself (keep_alive expiry, OLLAMA_MAX_LOADED_MODELS)
+                    state.loaded = False
+
+        if self._tag_sizes is None:
+            self._load_tag_sizes()
+
+    def _load_tag_sizes(self):
+        """On-disk model sizes, the estimate for models never seen in /api/ps"""
+        try:
+            response = requests.get(f"{settings().ollama_base_url}/api/tags", timeout=3)
+            response.raise_for_status()
+            self._tag_sizes = {m.get("name"): int(m.get("size") or 0) for m in response.json().get("models", [])}
+        except (requests.RequestException, ValueError) as e:
+            logger.debug("Could not read model sizes: %s", e)
+
+    def _footprint(self, state: _ModelState) -> int:
+        if state.name in self.overrides:
+            return self.overrides[state.name]
+        if state.size:
+            return state.size
+        tag_size = (self._tag_sizes or {}).get(state.name)
+        return int(tag_size * TAGS_OVERHEAD) if tag_size else DEFAULT_FOOTPRINT
+
+    def _unload(self, model: str):
+        """Ask Ollama to drop a model now"""
+        try:
+            requests.post(
+                f"{settings().ollama_base_url}/api/generate",
+                json={"model": model, "keep_alive": 0},
+                timeout=30
+            )
+        except requests.RequestException as e:
+            logger.warning("Unloading %s failed: %s", model, e)
+
+    # ------------------------------------------------------------------
+    # Request path
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def use(self, model: str):
+        """Make room for `model` before a generation and mark it busy while it runs"""
+        self.prepare(model)
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    def prepare(self, model: str):
+        self.refresh()
+        victims: List[str] = []
+
+        with self._lock:
+            state = self._models.setdefault(model, _ModelState(model))
+            state.in_use += 1
+            state.requests += 1
+            state.last_used = time.time()
+
+            if not state.loaded:
+                others_loaded = [s for s in self._models.values() if s.loaded and s is not state]
+                if others_loaded:
+                    self.stats["swaps"] += 1
+                else:
+                    self.stats["cold_loads"] += 1
+                state.loads += 1
+
+                needed = self._footprint(state)
+                used = sum(self._footprint(s) for s in others_loaded)
+                idle = sorted((s for s in others_loaded if s.in_use == 0), key=lambda s: s.last_used)
+                for victim in idle:
+                    if used + needed <= self.memory_budget:
+                        break
+                    victim.loaded = False
+                    victim.unloads += 1
+                    used -= self._footprint(victim)
+                    victims.append(victim.name)
+                    self.stats["evictions"] += 1
+                if used + needed > self.memory_budget:
+                    # Everything left is busy; Ollama will have to cope
+                    self.stats["over_budget"] += 1
+                state.loaded = True
+
+        for victim in victims:
+            logger.info("Unloading %s to make room for %s", victim, model)
+            self._unload(victim)
+
+    def release(self, model: str):
+        with self._lock:
+            state = self._models.get(model)
+            if state:
+                state.in_use = max(state.in_use - 1, 0)
+                state.last_used = time.time()
+
+    def hot_models(self) -> Set[str]:
+        """Models that can run without a swap (no I/O; called under the dispatcher lock)"""
+        with self._lock:
+            return {name for name, state in self._models.items() if state.loaded or state.in_use}
+
+    def get_stats(self) -> Dict:
+        """Residency, footprints and swap counts for /stats"""
+        with self._lock:
+            models = {
+                name: {
+                    "loaded": state.loaded,
+                    "footprint_bytes": self._footprint(state) if state.loaded else None,
+                    "in_use": state.in_use,
+                    "requests": state.requests,
+                    "loads": state.loads,
+                    "unloads": state.unloads,
+                    "last_used": state.last_used
+                }
+                for name, state in self._models.items()
+            }
+        resident = sum(m["footprint_bytes"] or 0 for m in models.values() if m["loaded"])
+        return {
+            "memory_budget_bytes": self.memory_budget,
+            "resident_bytes": resident,
+            "models": models,
+            **self.stats
+        }
+
+
+# Shared by the API and the Zoho webhook blueprint
+residency = ModelResidencyManager.from_env()
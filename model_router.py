@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Model Router
+Cheap complexity classification that picks a model from a tier list, cheapest first
+
+MODEL_TIERS lists tiers as "name=model" pairs ordered from cheapest to most
+capable, e.g. "fast=phi3:mini,full=mistral:7b". Without it every request uses
+the single configured MODEL_NAME. When the generation queue backs up past
+MODEL_DEGRADE_QUEUE_DEPTH, requests are routed to the cheapest tier instead.
+
+Clients may also ask for a model by name (or tier name). Tier models are
+always allowed; MODEL_ALLOWED adds further models, e.g. "llama3.2:3b".
+"""
+
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Phrases that usually mean a long, reasoning-heavy answer
+COMPLEX_PATTERNS = re.compile(
+    r"\b(explain|why|how does|compare|analy[sz]e|step[- ]by[- ]step|design|implement|"
+    r"write (a|an|the)|code|debug|proof|derive|summari[sz]e|translate|pros and cons)\b",
+    re.IGNORECASE
+)
+CODE_MARKERS = ("```", "def ", "class ", "function ", "{", "};", "SELECT ", "import ")
+
+
+def _parse_tiers(value: str, default_model: str) -> List[Tuple[str, str]]:
+    """Parse "name=model,name=model" into an ordered tier list"""
+    tiers = []
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        name, model = item.split("=", 1)
+        if name.strip() and model.strip():
+            tiers.append((name.strip(), model.strip()))
+    return tiers or [("standard", default_model)]
+
+
+def score_complexity(message: str, history_depth: int) -> float:
+    """Heuristic complexity in [0, 1] from prompt length, history depth and content"""
+    score = min(len(message) / 800.0, 1.0) * 0.45
+    score += min(history_depth / 10.0, 1.0) * 0.15
+
+    if COMPLEX_PATTERNS.search(message):
+        score += 0.25
+    if any(marker in message for marker in CODE_MARKERS):
+        score += 0.25
+    if message.count("?") > 1 or message.count("\n") > 3:
+        score += 0.1
+
+    return min(score, 1.0)
+
+
+class ModelRouter:
+    """Chooses a model tier per request and tracks per-tier usage and latency"""
+
+    def __init__(self, tiers: List[Tuple[str, str]], degrade_queue_depth: int = 3,
+                 extra_models: Optional[List[str]] = None):
+        self.tiers = tiers
+        self.degrade_queue_depth = degrade_queue_depth
+        self.extra_models = extra_models or []
+        self._lock = threading.Lock()
+        self.tier_stats: Dict[str, Dict] = {
+            name: {
+                "model": model,
+                "requests": 0,
+                "degraded": 0,
+                "failures": 0,
+                "total_latency_seconds": 0.0,
+                "max_latency_seconds": 0.0
+            }
+            for name, model in tiers
+        }
+
+    @classmethod
+    def from_env(cls, default_model: str) -> "ModelRouter":
+        """Create a router from MODEL_TIERS and MODEL_DEGRADE_QUEUE_DEPTH"""
+        return cls(
+            _parse_tiers(os.getenv("MODEL_TIERS", ""), default_model),
+            degrade_queue_depth=int(os.getenv("MODEL_DEGRADE_QUEUE_DEPTH", "3")),
+            extra_models=[m.strip() for m in os.getenv("MODEL_ALLOWED", "").split(",") if m.strip()]
+        )
+
+    def set_default_model(self, model: str):
+        """Follow MODEL_NAME changes when no explicit tiers are configured"""
+        if len(self.tiers) == 1 and self.tiers[0][0] == "standard":
+            self.tiers = [("standard", model)]
+            with self._lock:
+                self.tier_stats["standard"]["model"] = model
+
+    def select(self, message: str, history_depth: int, queue_depth: int = 0) -> Tuple[str, str]:
+        """Return (tier_name, model) for a request"""
+        if len(self.tiers) == 1:
+            return self.tiers[0]
+
+        score = score_complexity(message, history_depth)
+        index = min(int(score * len(self.tiers)), len(self.tiers) - 1)
+
+        if index > 0 and queue_depth >= self.degrade_queue_depth:
+            with self._lock:
+                self.tier_stats[self.tiers[0][0]]["degraded"] += 1
+            logger.info("Queue depth %d: degrading request to tier %s", queue_depth, self.tiers[0][0])
+            index = 0
+
+        return self.tiers[index]
+
+    def resolve(self, requested: str) -> Optional[Tuple[str, str]]:
+        """(tier_name, model) for a client-requested model or tier, or None if not allowed"""
+        for name, model in self.tiers:
+            if requested in (name, model):
+                return name, model
+        if requested in self.extra_models:
+            return "requested", requested
+        return None
+
+    def allowed_models(self) -> List[str]:
+        return [model for _, model in self.tiers] + [m for m in self.extra_models if m not in dict(self.tiers).values()]
+
+    def record(self, tier: str, latency_seconds: float, success: bool):
+        """Record the outcome of a generation on the given tier"""
+        with self._lock:
+            tier_stats = self.tier_stats.get(tier)
+            if tier_stats is None:
+                return
+            tier_stats["requests"] += 1
+            tier_stats["total_latency_seconds"] += latency_seconds
+            tier_stats["max_latency_seconds"] = max(tier_stats["max_latency_seconds"], latency_seconds)
+            if not success:
+                tier_stats["failures"] += 1
+
+    def get_stats(self) -> Dict:
+        """Per-tier usage and latency for /stats"""
+        with self._lock:
+            tiers = {}
+            for name, tier_stats in self.tier_stats.items():
+                requests = tier_stats["requests"]
+                tiers[name] = {
+                    **tier_stats,
+                    "total_latency_seconds": round(tier_stats["total_latency_seconds"], 3),
+                    "max_latency_seconds": round(tier_stats["max_latency_seconds"], 3),
+                    "avg_latency_seconds": round(tier_stats["total_latency_seconds"] / requests, 3) if requests else 0.0
+                }
+        return {
+            "tiers": tiers,
+            "tier_order": [name for name, _ in self.tiers],
+            "allowed_models": self.allowed_models(),
+            "degrade_queue_depth": self.degrade_queue_depth
+        }
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+NDJSON Passthrough
+Byte-level scanner for relaying Ollama's /api/generate stream without re-encoding it
+
+/chat/stream normally decodes every Ollama line, runs it through the output
+guard and re-encodes it as an SSE frame. Programmatic clients that ask for
+format "ndjson" instead get Ollama's own lines, forwarded in the reads they
+arrive in. The scanner only looks for two things in the bytes:
+
+    - the "response" string of each line, kept still JSON-escaped and decoded
+      once at the end, so the answer can go into the conversation history
+    - the final line ("done": true), which is parsed, held back and replaced
+      by the API with a summary line (no "context" array, plus session_id and
+      truncation info)
+
+Lines that don't match the usual key order fall back to json.loads, so a
+differently shaped Ollama build costs speed, not correctness.
+"""
+
+import json
+from typing import Dict, List
+
+# Reads from Ollama: whatever has arrived, up to this many bytes
+READ_SIZE = 64 * 1024
+
+RESPONSE_KEY = b'"response":"'
+RESPONSE_END = b'","done":'
+DONE_MARKER = b'"done":true'
+
+
+def ndjson_line(payload: Dict) -> bytes:
+    """One NDJSON line"""
+    return json.dumps(payload, separators=(",", ":")).encode() + b"\n"
+
+
+class NDJSONScanner:
+    """Incremental scan of an /api/generate NDJSON stream"""
+
+    def __init__(self):
+        self._partial = b""
+        self._fragments: List[bytes] = []
+        self.final: Dict = {}
+        self.lines = 0
+        self.slow_lines = 0
+
+    def feed(self, data: bytes) -> bytes:
+        """Scan a read; returns the complete lines to forward (never the final one)"""
+        if self._partial:
+            data = self._partial + data
+        end = data.rfind(b"\n") + 1
+        self._partial = data[end:]
+
+        start = 0
+        while start < end:
+            newline = data.index(b"\n", start, end)
+            if newline > start and self._scan_line(data, start, newline):
+                # Final line: hold it back, nothing after it matters
+                self._partial = b""
+                return data[:start]
+            start = newline + 1
+        return data[:end]
+
+    def _scan_line(self, data: bytes, start: int, stop: int) -> bool:
+        """Collect one line's text; True for the final line"""
+        self.lines += 1
+        if data.find(DONE_MARKER, start, stop) >= 0:
+            self._parse_slow(data[start:stop], final=True)
+            return True
+
+        key = data.find(RESPONSE_KEY, start, stop)
+        if key >= 0:
+            # The answer text can't contain an unescaped '","done":', so the last one ends it
+            value_end = data.rfind(RESPONSE_END, key, stop)
+            if value_end >= 0 and data.startswith(b"false", value_end + len(RESPONSE_END)):
+                if value_end > key + len(RESPONSE_KEY):
+                    self._fragments.append(data[key + len(RESPONSE_KEY):value_end])
+                return False
+        self._parse_slow(data[start:stop], final=False)
+        return bool(self.final)
+
+    def _parse_slow(self, line: bytes, final: bool):
+        try:
+            chunk = json.loads(line)
+        except json.JSONDecodeError:
+            return
+        if not final:
+            self.slow_lines += 1
+        if chunk.get("response"):
+            self._fragments.append(json.dumps(chunk["response"])[1:-1].encode())
+        if final or chunk.get("done"):
+            self.final = chunk
+
+    def text(self) -> str:
+        """The whole answer, decoded once"""
+        return json.loads(b'"' + b"".join(self._fragments) + b'"')
+
+    def last_chunk(self) -> str:
+        """Text of the last token (what /chat/continue resumes after)"""
+        return json.loads(b'"' + self._fragments[-1] + b'"') if self._fragments else ""
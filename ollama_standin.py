@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Ollama Stand-in Server
+A dependency-free fake of the Ollama HTTP API for CI, benchmarks and load replay
+
+Implements the endpoints the assistant uses (/api/generate, /api/tags,
+/api/version) with realistic streaming and timing metadata. Throughput is
+simulated from the runtime options in the request so tuning sweeps produce a
+meaningful curve, and --speed scales every delay for time-compressed runs.
+
+A prompt containing "[[tokens=N]]" gets exactly N output tokens (capped by
+num_predict); the last marker wins, so replayed traffic reproduces the
+captured answer lengths even with earlier turns in the context.
+
+Usage:
+    python ollama_standin.py --port 11435 --speed 10
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+# Simulated CPU characteristics
+DEFAULT_EVAL_TPS = 12.0          # output tokens/s at the best thread count
+DEFAULT_PROMPT_EVAL_TPS = 90.0   # prompt tokens/s at the best batch size
+DEFAULT_LOAD_SECONDS = 2.0
+
+TOKENS_MARKER_RE = re.compile(r"\[\[tokens=(\d+)\]\]")
+
+FILLER_WORDS = (
+    "the assistant can help with that question by breaking it into smaller steps and "
+    "explaining each one clearly so that the answer is easy to follow and apply"
+).split()
+
+
+def _thread_factor(num_thread: int, cores: int) -> float:
+    """Throughput rises to the physical core count, then falls off from contention"""
+    if num_thread <= cores:
+        return max(num_thread, 1) / cores
+    return max(0.3, 1.0 - 0.15 * (num_thread - cores))
+
+
+def _batch_factor(num_batch: int) -> float:
+    """Prompt evaluation improves with batch size up to 512"""
+    return min(max(num_batch, 32), 512) / 512 * 0.6 + 0.4
+
+
+class StandinState:
+    """Shared simulation state across request threads"""
+
+    def __init__(self, speed: float, cores: int, eval_tps: float, prompt_eval_tps: float,
+                 load_seconds: float, models: List[str]):
+        self.speed = max(speed, 0.001)
+        self.cores = cores
+        self.eval_tps = eval_tps
+        self.prompt_eval_tps = prompt_eval_tps
+        self.load_seconds = load_seconds
+        self.models = models
+        self.loaded: Dict[str, float] = {}  # model -> expiry time
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            time.sleep(seconds / self.speed)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """HTTP handler implementing the subset of the Ollama API we depend on"""
+
+    protocol_version = "HTTP/1.1"
+    state: StandinState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload: Dict, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b"{}"
+        try:
+            return json.loads(raw or b"{}")
+        except json.JSONDecodeError:
+            return {}
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": m, "model": m, "size": 2_300_000_000} for m in self.state.models]})
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-standin"})
+        elif self.path == "/api/ps":
+            now = time.time()
+            with self.state.lock:
+                loaded = [m for m, expiry in self.state.loaded.items() if expiry > now]
+            self._send_json({"models": [{"name": m, "model": m, "size": 2_300_000_000} for m in loaded]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if self.path == "/api/generate":
+            self._generate(self._read_json())
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _generate(self, body: Dict):
+        state = self.state
+        model = body.get("model") or (state.models[0] if state.models else "standin")
+        options = body.get("options") or {}
+        prompt = body.get("prompt") or ""
+        stream = body.get("stream", True)
+        keep_alive = body.get("keep_alive", "5m")
+
+        # Unload request: empty prompt with keep_alive 0
+        if not prompt and keep_alive in (0, "0", "0s") and not body.get("context"):
+            with state.lock:
+                state.loaded.pop(model, None)
+            self._send_json({"model": model, "response": "", "done": True, "done_reason": "unload"})
+            return
+
+        num_predict = int(options.get("num_predict", 128))
+        if num_predict < 0:
+            num_predict = 256
+        num_thread = int(options.get("num_thread", state.cores))
+        num_batch = int(options.get("num_batch", 512))
+        num_ctx = int(options.get("num_ctx", 2048))
+
+        with state.lock:
+            state.active += 1
+            concurrency = state.active
+            now = time.time()
+            needs_load = state.loaded.get(model, 0) <= now
+            state.loaded[model] = now + 300
+
+        try:
+            load_seconds = state.load_seconds if needs_load else 0.0
+            # Larger contexts cost a little extra to allocate
+            load_seconds *= 1.0 + num_ctx / 16384
+            state.sleep(load_seconds)
+
+            prompt_tokens = min(max(len(prompt) // 4, 1), num_ctx)
+            pe_tps = state.prompt_eval_tps * _batch_factor(num_batch) * _thread_factor(num_thread, state.cores)
+            eval_tps = state.eval_tps * _thread_factor(num_thread, state.cores) / concurrency
+            prompt_eval_seconds = prompt_tokens / pe_tps
+            state.sleep(prompt_eval_seconds)
+
+            # Deterministic-ish output length so replays are comparable
+            rng = random.Random(zlib.crc32(prompt.encode()))
+            markers = TOKENS_MARKER_RE.findall(prompt)
+            if markers:
+                out_tokens = min(num_predict, max(int(markers[-1]), 1))
+            else:
+                out_tokens = min(num_predict, rng.randint(max(num_predict // 3, 1), num_predict))
+            started = time.time()
+
+            if stream:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+            text_parts = []
+            for i in range(out_tokens):
+                token = FILLER_WORDS[(i + rng.randint(0, 3)) % len(FILLER_WORDS)] + " "
+                text_parts.append(token)
+                state.sleep(1.0 / eval_tps)
+                if stream:
+                    self._write_chunk({"model": model, "response": token, "done": False})
+
+            eval_seconds = out_tokens / eval_tps
+            final = {
+                "model": model,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "done": True,
+                "done_reason": "length" if out_tokens >= num_predict else "stop",
+                "context": list(range(prompt_tokens + out_tokens))[-64:],
+                "total_duration": int((load_seconds + prompt_eval_seconds + eval_seconds) * 1e9),
+                "load_duration": int(load_seconds * 1e9),
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(prompt_eval_seconds * 1e9),
+                "eval_count": out_tokens,
+                "eval_duration": int(eval_seconds * 1e9),
+                "standin_wall_seconds": round(time.time() - started, 4)
+            }
+
+            if stream:
+                final["response"] = ""
+                self._write_chunk(final)
+                self.wfile.write(b"0\r\n\r\n")
+            else:
+                final["response"] = "".join(text_parts).strip()
+                self._send_json(final)
+        except (BrokenPipeError, ConnectionResetError):
+            # Client aborted the generation
+            pass
+        finally:
+            with state.lock:
+                state.active -= 1
+            if keep_alive in (0, "0", "0s"):
+                with state.lock:
+                    state.loaded.pop(model, None)
+
+    def _write_chunk(self, payload: Dict):
+        data = json.dumps(payload).encode() + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def make_server(host: str = "127.0.0.1", port: int = 11435, speed: float = 1.0,
+                cores: int = 0, eval_tps: float = DEFAULT_EVAL_TPS,
+                prompt_eval_tps: float = DEFAULT_PROMPT_EVAL_TPS,
+                load_seconds: float = DEFAULT_LOAD_SECONDS, models: List[str] = None) -> ThreadingHTTPServer:
+    """Build a stand-in server; call serve_forever() on the result"""
+    state = StandinState(speed, cores or (os.cpu_count() or 4), eval_tps, prompt_eval_tps,
+                         load_seconds, models or ["phi3:mini", "phi3:latest", "mistral:7b"])
+    handler = type("BoundStandinHandler", (StandinHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_background(**kwargs) -> ThreadingHTTPServer:
+    """Start a stand-in server on a daemon thread (port 0 picks a free port)"""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, name="ollama-standin", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in Ollama server for tests and benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--speed", type=float, default=1.0, help="Time compression factor (10 = ten times faster)")
+    parser.add_argument("--cores", type=int, default=0, help="Simulated physical cores (default: os.cpu_count())")
+    parser.add_argument("--eval-tps", type=float, default=DEFAULT_EVAL_TPS)
+    parser.add_argument("--prompt-eval-tps", type=float, default=DEFAULT_PROMPT_EVAL_TPS)
+    parser.add_argument("--load-seconds", type=float, default=DEFAULT_LOAD_SECONDS)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.speed, args.cores, args.eval_tps,
+                         args.prompt_eval_tps, args.load_seconds)
+    print(f"🧪 Ollama stand-in listening on http://{args.host}:{server.server_address[1]} (speed x{args.speed})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Stand-in stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Output Guard
+Watches generated text as it streams in and stops degenerate output early
+
+Small models sometimes loop on a phrase or start writing the next turn
+("\\nUser: ..."), and the static stop list only catches the exact
+"\\n\\nUser:" form. The guard checks every incoming token for:
+
+    repetition     the last k words repeated back to back (k = 1..MAX_PERIOD);
+                   words without a letter (numbers, punctuation, markdown such
+                   as "|" or "---") don't count, and short units (k <= 3) must
+                   also repeat over at least MIN_SHORT_LOOP_CHARS characters
+    sentence_loop  the same sentence produced three times anywhere in the answer
+    role_marker    a turn marker or chat-template token leaking into the text
+
+When one fires, the caller closes the Ollama response (which aborts the
+generation and frees the slot) and uses guard.text, trimmed to just before the
+degenerate part. Text that could be the start of a role marker is held back
+until it's clear, so markers never reach the client.
+
+Environment:
+    OUTPUT_GUARD_ENABLED    true | false (default true)
+"""
+
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+# Turn markers and template tokens that never belong in an answer
+ROLE_MARKERS = (
+    "\nUser:", "\nHuman:", "\nAssistant:", "\nSystem:",
+    "<|user|>", "<|assistant|>", "<|system|>", "<|end|>", "<|endoftext|>",
+    "<|im_start|>", "<|im_end|>", "</s>", "[INST]"
+)
+LONGEST_MARKER = max(len(m) for m in ROLE_MARKERS)
+
+# Longest repeating unit (in words) the loop detector looks for
+MAX_PERIOD = 48
+
+# Units of 1-3 words must loop over at least this many characters, so a phrase
+# repeated a few times on purpose ("go left, go left, ...") is left alone
+MIN_SHORT_LOOP_CHARS = 120
+
+# Sentences shorter than this are allowed to recur ("Yes.", "Thank you!")
+MIN_SENTENCE_WORDS = 5
+
+WORD_RE = re.compile(r"\S+")
+SENTENCE_END_RE = re.compile(r"[.!?]\s|\n")
+
+
+def _required_repeats(period: int) -> int:
+    """Back-to-back copies of a k-word unit that count as a loop"""
+    if period == 1:
+        return 8
+    if period <= 3:
+        return 5
+    return 3
+
+
+def _normalize(word: str) -> str:
+    """Comparable form of a word; empty for tokens without a letter (digits, punctuation, markdown)"""
+    word = word.strip(".,;:!?\"'()*_").lower()
+    return word if any(c.isalpha() for c in word) else ""
+
+
+def _is_multiple(unit: List[str]) -> bool:
+    """Whether the unit is itself a shorter unit repeated"""
+    period = len(unit)
+    return any(period % d == 0 and unit == unit[:d] * (period // d) for d in range(1, period // 2 + 1))
+
+
+class OutputGuard:
+    """Incremental degenerate-output detector for one generation"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stop_reason: Optional[str] = None
+        self.tokens = 0
+
+        self._text = ""
+        self._cut: Optional[int] = None  # end of the clean text once stopped
+        self._emitted = 0
+        self._words: List[str] = []
+        self._word_starts: List[int] = []
+        self._word_ends: List[int] = []
+        self._scanned = 0  # characters already split into words
+        self._sentences: Dict[str, int] = {}
+        self._sentence_start = 0
+
+    @property
+    def text(self) -> str:
+        """Everything worth keeping so far"""
+        return self._text if self._cut is None else self._text[:self._cut]
+
+    def feed(self, chunk: str) -> str:
+        """Add one streamed token; returns the text that is now safe to send on"""
+        if self.stop_reason:
+            return ""
+        self.tokens += 1
+        previous = len(self._text)
+        self._text += chunk
+
+        if self.enabled:
+            self._check_markers(previous)
+            if not self.stop_reason:
+                self._check_words()
+
+        if self.stop_reason:
+            return self._release(self._cut)
+        return self._release(len(self._text) - self._held_back() if self.enabled else len(self._text))
+
+    def flush(self) -> str:
+        """Release any held-back text once the generation has finished"""
+        return self._release(len(self.text))
+
+    def _release(self, upto: int) -> str:
+        if upto <= self._emitted:
+            return ""
+        out = self._text[self._emitted:upto]
+        self._emitted = upto
+        return out
+
+    def _stop(self, reason: str, cut: int):
+        self.stop_reason = reason
+        self._cut = len(self._text[:cut].rstrip())
+
+    def _held_back(self) -> int:
+        """Length of the tail that might still turn into a role marker"""
+        tail = self._text[-LONGEST_MARKER:]
+        for i in range(len(tail)):
+            suffix = tail[i:]
+            if any(marker.startswith(suffix) for marker in ROLE_MARKERS):
+                return len(suffix)
+        return 0
+
+    def _check_markers(self, previous: int):
+        start = max(0, previous - LONGEST_MARKER)
+        hits = [i for i in (self._text.find(m, start) for m in ROLE_MARKERS) if i >= 0]
+        if hits:
+            self._stop("role_marker", min(hits))
+
+    def _check_words(self):
+        """Split newly completed words and look for loops"""
+        boundary = max(self._text.rfind(" "), self._text.rfind("\n"))
+        if boundary <= self._scanned:
+            return
+        for match in WORD_RE.finditer(self._text, self._scanned, boundary):
+            word = _normalize(match.group())
+            if word:
+                self._words.append(word)
+                self._word_starts.append(match.start())
+                self._word_ends.append(match.end())
+        self._scanned = boundary
+
+        if self._check_repetition():
+            return
+        self._check_sentences(boundary)
+
+    def _check_repetition(self) -> bool:
+        words = self._words
+        n = len(words)
+        for period in range(1, min(MAX_PERIOD, n // 3) + 1):
+            repeats = _required_repeats(period)
+            if period * repeats > n:
+                continue
+            unit = words[n - period:]
+            if _is_multiple(unit):
+                continue  # e.g. "go left go left": left to the shorter period
+            if all(words[n - (r + 1) * period:n - r * period] == unit for r in range(1, repeats)):
+                start = self._run_start(period)
+                if period <= 3 and self._word_ends[n - 1] - self._word_starts[start] < MIN_SHORT_LOOP_CHARS:
+                    continue
+                # Keep the first copy of the repeated unit, drop the rest
+                self._stop("repetition", self._word_ends[start + period - 1])
+                return True
+        return False
+
+    def _run_start(self, period: int) -> int:
+        """Index of the first word in the run of back-to-back copies of the last `period` words"""
+        words = self._words
+        n = len(words)
+        unit = words[n - period:]
+        copies = 1
+        while (copies + 1) * period <= n and words[n - (copies + 1) * period:n - copies * period] == unit:
+            copies += 1
+        return n - copies * period
+
+    def _check_sentences(self, boundary: int):
+        for match in SENTENCE_END_RE.finditer(self._text, self._sentence_start, boundary + 1):
+            start, end = self._sentence_start, match.end()
+            self._sentence_start = end
+            words = [w for w in (_normalize(w) for w in self._text[start:end].split()) if w]
+            if len(words) < MIN_SENTENCE_WORDS:
+                continue
+            key = " ".join(words)
+            seen = self._sentences.get(key, 0) + 1
+            self._sentences[key] = seen
+            if seen >= 3:
+                self._stop("sentence_loop", start)
+                return
+
+
+class DegenerationMonitor:
+    """Creates guards and keeps the abort metrics"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.stats = {
+            "generations": 0,
+            "aborted": 0,
+            "by_reason": {},
+            "tokens_generated": 0,
+            "tokens_saved": 0
+        }
+
+    @classmethod
+    def from_env(cls) -> "DegenerationMonitor":
+        return cls(enabled=os.getenv("OUTPUT_GUARD_ENABLED", "true").lower() == "true")
+
+    def guard(self) -> OutputGuard:
+        return OutputGuard(enabled=self.enabled)
+
+    def record(self, guard: OutputGuard, budget: Optional[int]):
+        """Account for a finished generation; tokens_saved is the unused num_predict budget of aborted ones"""
+        with self._lock:
+            self.stats["generations"] += 1
+            self.stats["tokens_generated"] += guard.tokens
+            if guard.stop_reason:
+                self.stats["aborted"] += 1
+                by_reason = self.stats["by_reason"]
+                by_reason[guard.stop_reason] = by_reason.get(guard.stop_reason, 0) + 1
+                if budget:
+                    self.stats["tokens_saved"] += max(budget - guard.tokens, 0)
+
+    def get_stats(self) -> Dict:
+        """Summary for /stats"""
+        with self._lock:
+            return {"enabled": self.enabled, **self.stats, "by_reason": dict(self.stats["by_reason"])}
+
+
+# Shared by /chat and /chat/stream
+degeneration_monitor = DegenerationMonitor.from_env()
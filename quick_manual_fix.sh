@@ -13,7 +13,7 @@ cat > /home/btldtdm1005/personal-ai-assistant/start_service.sh << 'EOF'
 set -e
 cd /home/btldtdm1005/personal-ai-assistant
 source venv/bin/activate
-exec gunicorn --workers 2 --bind 127.0.0.1:5000 --timeout 650 --keep-alive 2 --max-requests 1000 --max-requests-jitter 50 fast_chatbot_api:app
+exec gunicorn -c gunicorn.conf.py fast_chatbot_api:app
 EOF
 
 # Set proper permissions
@@ -34,7 +34,10 @@ After=network.target ollama.service
 Requires=ollama.service
 
 [Service]
-Type=simple
+# Ready as soon as a worker can serve (startup.py), not when the process has merely started
+Type=notify
+NotifyAccess=all
+TimeoutStartSec=60
 User=btldtdm1005
 Group=btldtdm1005
 WorkingDirectory=/home/btldtdm1005/personal-ai-assistant
@@ -54,8 +57,7 @@ sudo systemctl daemon-reload
 
 echo "🚀 Starting service..."
 sudo systemctl start personal-ai-assistant
-
-sleep 3
+# Type=notify: returns once a worker is serving
 
 # Check status
 echo "📊 Service status:"
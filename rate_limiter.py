@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Rate Limiter
+Token-bucket limits by client IP, session and route, shared by all gunicorn workers on the node
+
+Bucket state lives in a small SQLite database (on /dev/shm when available) so
+that every worker process draws from the same buckets. Each check is a single
+short IMMEDIATE transaction; if the store is unavailable the limiter fails open.
+"""
+
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import jsonify, request
+
+logger = logging.getLogger(__name__)
+
+# Bucket rules: (capacity in tokens, refill tokens per second)
+DEFAULT_RULES = {
+    "ip": (100.0, 1.0),        # 10 generations burst, one every 10s sustained
+    "session": (50.0, 0.5),    # 5 generations burst, one every 20s sustained
+    "route": (300.0, 5.0)      # node-wide ceiling per route
+}
+
+# Token cost per request class
+DEFAULT_COSTS = {
+    "generation": 10.0,
+    "cheap": 1.0
+}
+
+TRUSTED_PROXIES = {"127.0.0.1", "::1"}
+
+
+def _default_db_path() -> str:
+    """Prefer shared memory so bucket updates never touch a real disk"""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "personal_ai_assistant_ratelimit.db")
+
+
+def _parse_rule(value: str, default: Tuple[float, float]) -> Tuple[float, float]:
+    """Parse a "capacity:refill_per_second" rule"""
+    if not value:
+        return default
+    try:
+        capacity, rate = value.split(":", 1)
+        return float(capacity), float(rate)
+    except ValueError:
+        logger.warning("Ignoring malformed rate limit rule: %r", value)
+        return default
+
+
+def client_ip(req) -> str:
+    """Real client address, trusting forwarded headers only from the local proxy"""
+    remote = req.remote_addr or "unknown"
+    if remote in TRUSTED_PROXIES:
+        forwarded = req.headers.get("X-Real-IP") or req.headers.get("X-Forwarded-For", "").split(",")[0].strip()
+        if forwarded:
+            return forwarded
+    return remote
+
+
+class RateLimiter:
+    """Token-bucket limiter backed by a node-local SQLite store"""
+
+    def __init__(self, db_path: str, rules: Optional[Dict[str, Tuple[float, float]]] = None,
+                 costs: Optional[Dict[str, float]] = None, enabled: bool = True):
+        self.db_path = db_path
+        self.rules = rules or dict(DEFAULT_RULES)
+        self.costs = costs or dict(DEFAULT_COSTS)
+        self.enabled = enabled
+        self._local = threading.local()
+
+        # Per-process counters; node-wide totals are kept in the store
+        self.stats = {
+            "allowed": 0,
+            "rejected": 0,
+            "store_errors": 0
+        }
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        """Create a limiter from RATE_LIMIT_* environment variables"""
+        rules = {
+            name: _parse_rule(os.getenv(f"RATE_LIMIT_{name.upper()}", ""), default)
+            for name, default in DEFAULT_RULES.items()
+        }
+        costs = {
+            "generation": float(os.getenv("RATE_LIMIT_GENERATION_COST", DEFAULT_COSTS["generation"])),
+            "cheap": float(os.getenv("RATE_LIMIT_CHEAP_COST", DEFAULT_COSTS["cheap"]))
+        }
+        return cls(
+            os.getenv("RATE_LIMIT_DB", _default_db_path()),
+            rules=rules,
+            costs=costs,
+            enabled=os.getenv("RATE_LIMIT_ENABLED", "true").lower() not in ("0", "false", "no")
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; schema is created on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+            self._local.conn = conn
+        return conn
+
+    def check(self, ip: Optional[str], session_id: Optional[str], route: str,
+              cost_class: str = "generation") -> Tuple[bool, float, str]:
+        """Consume tokens from every applicable bucket; returns (allowed, retry_after, limiting_rule)"""
+        if not self.enabled:
+            return True, 0.0, ""
+
+        cost = self.costs.get(cost_class, self.costs["generation"])
+        keys = [("route", f"route:{route}")]
+        if ip:
+            keys.append(("ip", f"ip:{ip}"))
+        if session_id:
+            keys.append(("session", f"session:{session_id}"))
+
+        try:
+            allowed, retry_after, rule = self._consume(keys, cost, route)
+        except sqlite3.Error as e:
+            # Never take the API down because the limiter store is unavailable
+            self.stats["store_errors"] += 1
+            logger.error("Rate limiter store error, allowing request: %s", e)
+            return True, 0.0, ""
+
+        self.stats["allowed" if allowed else "rejected"] += 1
+        return allowed, retry_after, rule
+
+    def _consume(self, keys, cost: float, route: str) -> Tuple[bool, float, str]:
+        """Atomically refill and debit all buckets, or none of them"""
+        conn = self._connection()
+        now = time.time()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            retry_after = 0.0
+            limiting_rule = ""
+
+            for rule, key in keys:
+                capacity, rate = self.rules[rule]
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    tokens = capacity
+                else:
+                    tokens = min(capacity, row[0] + (now - row[1]) * rate)
+
+                if tokens < cost:
+                    wait = (cost - tokens) / rate if rate > 0 else 3600.0
+                    if wait > retry_after:
+                        retry_after = wait
+                        limiting_rule = rule
+                levels.append((key, tokens))
+
+            allowed = retry_after == 0.0
+            for key, tokens in levels:
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                    (key, tokens - cost if allowed else tokens, now)
+                )
+
+            counter = f"allowed:{route}" if allowed else f"rejected:{route}:{limiting_rule}"
+            conn.execute(
+                "INSERT INTO counters (name, value) VALUES (?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+                (counter,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        return allowed, retry_after, limiting_rule
+
+    def prune(self, max_idle_seconds: float = 3600.0):
+        """Drop buckets that have been idle long enough to be full again"""
+        try:
+            self._connection().execute("DELETE FROM buckets WHERE updated < ?", (time.time() - max_idle_seconds,))
+        except sqlite3.Error as e:
+            logger.error("Rate limiter prune failed: %s", e)
+
+    def get_stats(self) -> Dict:
+        """Limiter hit counts for /stats"""
+        node_counters = {}
+        if self.enabled:
+            try:
+                node_counters = dict(self._connection().execute("SELECT name, value FROM counters").fetchall())
+            except sqlite3.Error as e:
+                logger.error("Rate limiter stats failed: %s", e)
+
+        return {
+            "enabled": self.enabled,
+            "rules": {name: {"capacity": c, "refill_per_second": r} for name, (c, r) in self.rules.items()},
+            "costs": self.costs,
+            "worker": self.stats,
+            "node": node_counters
+        }
+
+
+# Shared by the API and the Zoho webhook blueprint
+limiter = RateLimiter.from_env()
+
+
+def rate_limited(route: str, cost_class: str = "generation", per_ip: bool = True,
+                 session_key: Optional[Callable] = None):
+    """Reject requests over their token budget with 429 and Retry-After
+
+    session_key extracts the session from the request when it is not carried in
+    X-Session-ID; per_ip=False skips the IP bucket for callers such as Zoho whose
+    requests all arrive from a handful of relay addresses.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            session_id = session_key(request) if session_key else request.headers.get("X-Session-ID")
+            allowed, retry_after, rule = limiter.check(
+                client_ip(request) if per_ip else None, session_id, route, cost_class
+            )
+            if not allowed:
+                retry_seconds = max(1, int(retry_after + 0.999))
+                response = jsonify({
+                    "success": False,
+                    "error": "Rate limit exceeded, please slow down",
+                    "limit": rule,
+                    "retry_after": retry_seconds
+                })
+                response.status_code = 429
+                response.headers["Retry-After"] = str(retry_seconds)
+                return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Traffic Replay
+Replays a traffic capture against a local API and stand-in Ollama at 1x, 10x or 100x speed
+
+Reads the log written by traffic_capture.py (TRAFFIC_CAPTURE_FILE) and sends
+each request at its captured arrival offset divided by --speed, keeping the
+captured route, session grouping, message length and answer length:
+
+    - messages are synthetic text of the captured length, unique per request
+      (requests that were answer-cache hits share one text, so they hit again)
+    - answer lengths are reproduced with the stand-in's [[tokens=N]] marker
+    - sessions keep their captured grouping, so history depth builds up the same way
+
+By default the API runs in-process on a free port against a stand-in Ollama
+whose delays are compressed by the same factor, so a 10x replay of an hour of
+traffic takes six minutes and sees the same relative load. Latencies are
+reported as measured and scaled back to real time (× speed), next to the
+latencies in the capture. With --url the requests go to an already running
+instance instead (point its OLLAMA_BASE_URL at a stand-in started with
+python ollama_standin.py --speed N).
+
+Rate limits are switched off in-process (compressed arrivals would trip them);
+pass --keep-rate-limits to replay them as configured.
+
+Usage:
+    python replay_traffic.py capture.log --speed 10
+    python replay_traffic.py capture.log --speed 100 --concurrency 2 --output replay.json
+    python replay_traffic.py capture.log --url http://127.0.0.1:5000 --speed 1
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import requests
+
+WORDS = ("order shipping refund account password invoice delivery product warranty support "
+         "price discount return payment subscription upgrade cancel address tracking size").split()
+CACHED_QUESTION_SEED = "replayed frequently asked question"
+
+
+def load_capture(path: str, limit: Optional[int] = None) -> List[Dict]:
+    """Capture records in arrival order (malformed lines skipped)"""
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "t" in record and "r" in record:
+                records.append(record)
+    records.sort(key=lambda r: r["t"])
+    return records[:limit] if limit else records
+
+
+def synthesize_message(record: Dict, index: int) -> str:
+    """Text of the captured length that asks the stand-in for the captured answer length"""
+    length = max(int(record.get("m") or 40), 1)
+    rng = random.Random(CACHED_QUESTION_SEED if record.get("cached") else index)
+    words = []
+    while sum(len(w) + 1 for w in words) < length:
+        words.append(rng.choice(WORDS))
+    text = " ".join(words)[:length]
+    tokens = record.get("n")
+    if tokens is None and record.get("o"):
+        tokens = max(int(record["o"]) // 4, 1)  # ~4 chars per token
+    return f"{text} [[tokens={int(tokens)}]]" if tokens else text
+
+
+def percentiles(samples: List[float]) -> Dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return round(ordered[min(int(p * len(ordered)), len(ordered) - 1)], 1)
+
+    return {
+        "count": len(ordered),
+        "mean": round(statistics.fmean(ordered), 1),
+        "p50": pct(0.50),
+        "p90": pct(0.90),
+        "p95": pct(0.95),
+        "p99": pct(0.99),
+        "max": round(ordered[-1], 1)
+    }
+
+
+class Replayer:
+    """Sends capture records on schedule and collects per-request results"""
+
+    def __init__(self, base_url: str, speed: float, concurrency: int, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.speed = speed
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="replay")
+        self.lock = threading.Lock()
+        self.results: List[Dict] = []
+
+    def send(self, record: Dict, index: int, planned: float, started_at: float):
+        session = f"replay-{record.get('s') or index}"
+        message = synthesize_message(record, index)
+        route = record["r"]
+        result = {"route": route, "lag_ms": (time.perf_counter() - started_at - planned) * 1000,
+                  "captured_ms": record.get("ms"), "ttft_ms": None}
+        sent = time.perf_counter()
+        try:
+            if route == "/webhook/zoho":
+                response = requests.post(f"{self.base_url}{route}", timeout=self.timeout,
+                                         json={"message": {"text": message}, "visitor": {"id": session}})
+                result["status"] = response.status_code
+            elif route == "/chat/stream":
+                result["status"] = self._stream(route, {"message": message}, session, result, sent)
+            else:
+                body = {} if route == "/chat/continue" else {"message": message}
+                response = requests.post(f"{self.base_url}{route}", json=body, timeout=self.timeout,
+                                         headers={"X-Session-ID": session})
+                result["status"] = response.status_code
+        except requests.RequestException as e:
+            result["status"] = type(e).__name__
+        result["ms"] = (time.perf_counter() - sent) * 1000
+        with self.lock:
+            self.results.append(result)
+
+    def _stream(self, route: str, body: Dict, session: str, result: Dict, sent: float):
+        status = None
+        with requests.post(f"{self.base_url}{route}", json=body, stream=True, timeout=self.timeout,
+                           headers={"X-Session-ID": session}) as response:
+            if response.status_code != 200:
+                return response.status_code
+            for line in response.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                event = json.loads(line[6:])
+                if event.get("status") == "streaming" and result["ttft_ms"] is None:
+                    result["ttft_ms"] = (time.perf_counter() - sent) * 1000
+                if event.get("status") in ("complete", "error"):
+                    status = event["status"]
+        return status or "incomplete"
+
+    def run(self, records: List[Dict]):
+        t0 = records[0]["t"]
+        started_at = time.perf_counter()
+        for index, record in enumerate(records):
+            planned = (record["t"] - t0) / self.speed
+            delay = planned - (time.perf_counter() - started_at)
+            if delay > 0:
+                time.sleep(delay)
+            self.executor.submit(self.send, record, index, planned, started_at)
+        self.executor.shutdown(wait=True)
+        return time.perf_counter() - started_at
+
+    def report(self) -> Dict:
+        by_route = defaultdict(list)
+        for result in self.results:
+            by_route[result["route"]].append(result)
+        routes = {}
+        for route, results in sorted(by_route.items()):
+            statuses = defaultdict(int)
+            for r in results:
+                statuses[str(r["status"])] += 1
+            routes[route] = {
+                "statuses": dict(statuses),
+                "latency_ms": percentiles([r["ms"] for r in results]),
+                "latency_real_time_ms": percentiles([r["ms"] * self.speed for r in results]),
+                "ttft_real_time_ms": percentiles([r["ttft_ms"] * self.speed for r in results if r["ttft_ms"]]),
+                "captured_latency_ms": percentiles([r["captured_ms"] for r in results if r["captured_ms"]])
+            }
+        return {
+            "routes": routes,
+            "send_lag_ms": percentiles([max(r["lag_ms"], 0.0) for r in self.results])
+        }
+
+
+def start_local_instance(speed: float, load_seconds: float, keep_rate_limits: bool) -> str:
+    """Stand-in Ollama plus the API on free ports; returns the API's base URL"""
+    from ollama_standin import start_in_background
+    from werkzeug.serving import make_server
+
+    standin = start_in_background(port=0, speed=speed, load_seconds=load_seconds)
+    os.environ["OLLAMA_BASE_URL"] = f"http://127.0.0.1:{standin.server_address[1]}"
+    os.environ.pop("TRAFFIC_CAPTURE_FILE", None)  # don't capture the replay
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if not keep_rate_limits:
+        os.environ["RATE_LIMIT_ENABLED"] = "false"
+
+    import fast_chatbot_api
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no access log per replayed request
+    server = make_server("127.0.0.1", 0, fast_chatbot_api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="replay-api", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured traffic against a local instance")
+    parser.add_argument("capture", help="File written via TRAFFIC_CAPTURE_FILE")
+    parser.add_argument("--speed", type=float, default=10.0, help="Time compression, e.g. 1, 10 or 100")
+    parser.add_argument("--url", default=None, help="Replay against this running instance instead")
+    parser.add_argument("--concurrency", type=int, default=256, help="Max requests in flight from the replayer")
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N captured requests")
+    parser.add_argument("--load-seconds", type=float, default=2.0, help="Stand-in model load time (real time)")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--keep-rate-limits", action="store_true")
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    records = load_capture(args.capture, args.limit)
+    if not records:
+        print(f"❌ No capture records in {args.capture}")
+        sys.exit(1)
+
+    base_url = args.url or start_local_instance(args.speed, args.load_seconds, args.keep_rate_limits)
+    span = records[-1]["t"] - records[0]["t"]
+
+    print("🔁 TRAFFIC REPLAY")
+    print("=" * 50)
+    print(f"📼 {len(records)} requests over {span:.0f}s, replayed at {args.speed:g}x "
+          f"(~{span / args.speed:.0f}s) against {base_url}{'' if args.url else ' (in-process, stand-in Ollama)'}")
+
+    replayer = Replayer(base_url, args.speed, args.concurrency, args.timeout)
+    elapsed = replayer.run(records)
+    report = replayer.report()
+
+    print(f"\n✅ Replayed in {elapsed:.1f}s (send lag p99 {report['send_lag_ms'].get('p99', 0)}ms)")
+    for route, summary in report["routes"].items():
+        real = summary["latency_real_time_ms"]
+        captured = summary["captured_latency_ms"]
+        print(f"\n📊 {route}: {real['count']} requests, statuses {summary['statuses']}")
+        print(f"   replay (real time)  p50 {real['p50']:>9}ms  p95 {real['p95']:>9}ms  p99 {real['p99']:>9}ms")
+        if captured.get("count"):
+            print(f"   captured            p50 {captured['p50']:>9}ms  p95 {captured['p95']:>9}ms  "
+                  f"p99 {captured['p99']:>9}ms")
+        if summary["ttft_real_time_ms"].get("count"):
+            ttft = summary["ttft_real_time_ms"]
+            print(f"   first token         p50 {ttft['p50']:>9}ms  p95 {ttft['p95']:>9}ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "generated_at": datetime.now().isoformat(),
+                "host": platform.node(),
+                "capture": os.path.abspath(args.capture),
+                "requests": len(records),
+                "capture_span_seconds": round(span, 3),
+                "speed": args.speed,
+                "target": base_url if args.url else "in-process",
+                "elapsed_seconds": round(elapsed, 3),
+                **report
+            }, f, indent=2)
+        print(f"\n📝 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
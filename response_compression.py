@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Response Compression
+Negotiated gzip/deflate for JSON, HTML and Server-Sent Event responses
+
+Plain responses (/chat JSON, /stats, the HTML pages) are compressed in one go
+when the client accepts it and the body is at least COMPRESSION_MIN_SIZE
+bytes; below that the headers cost more than compression saves.
+
+Event streams (SSE and NDJSON) are compressed incrementally with a single
+compressor per response. After every chunk that completes an SSE event or an
+NDJSON line the compressor does a sync flush, so the client can decode each
+event as soon as it is sent and streaming latency is unchanged. SSE frames repeat the same JSON keys for
+every token, which is what the shared compression window takes out.
+
+Responses that already carry a Content-Encoding are passed through.
+
+Environment:
+    COMPRESSION_ENABLED     true/false (default true)
+    COMPRESSION_MIN_SIZE    smallest plain body compressed, bytes (default 1024)
+    COMPRESSION_LEVEL       zlib level 1-9 (default 6)
+"""
+
+import logging
+import os
+import zlib
+from typing import Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Preferred first when the client accepts both with the same weight
+ENCODINGS = ("gzip", "deflate")
+
+# zlib window bits: 16+ writes a gzip wrapper, plain 15 the zlib format HTTP calls "deflate"
+WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "text/html",
+    "text/plain",
+    "text/css",
+    "text/event-stream",
+    "application/x-ndjson"
+}
+
+# Streamed types and the byte sequence that ends one event or line in them
+STREAM_BOUNDARIES = {
+    "text/event-stream": b"\n\n",
+    "application/x-ndjson": b"\n"
+}
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Best encoding we support from an Accept-Encoding header, or None"""
+    weights: Dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class ResponseCompressor:
+    """Compresses Flask responses according to the request's Accept-Encoding"""
+
+    def __init__(self, enabled: bool = True, min_size: int = 1024, level: int = 6):
+        self.enabled = enabled
+        self.min_size = min_size
+        self.level = min(max(level, 1), 9)
+        self.stats = {
+            "plain": {"responses": 0, "bytes_in": 0, "bytes_out": 0},
+            "stream": {"responses": 0, "bytes_in": 0, "bytes_out": 0, "flushes": 0},
+            "skipped_small": 0,
+            "not_accepted": 0
+        }
+
+    @classmethod
+    def from_env(cls) -> "ResponseCompressor":
+        return cls(
+            enabled=os.getenv("COMPRESSION_ENABLED", "true").lower() == "true",
+            min_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+            level=int(os.getenv("COMPRESSION_LEVEL", "6"))
+        )
+
+    def _compressor(self, encoding: str):
+        return zlib.compressobj(self.level, zlib.DEFLATED, WBITS[encoding])
+
+    def compress(self, req, response):
+        """Compress `response` in place if worthwhile; returns it either way"""
+        if (not self.enabled or req.method == "HEAD" or response.status_code < 200
+                or response.status_code in (204, 304) or "Content-Encoding" in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate(req.headers.get("Accept-Encoding", ""))
+        if encoding is None:
+            self.stats["not_accepted"] += 1
+            return response
+
+        if response.is_streamed:
+            if response.mimetype in STREAM_BOUNDARIES:
+                self._compress_stream(response, encoding)
+            return response
+
+        body = response.get_data()
+        if len(body) < self.min_size:
+            self.stats["skipped_small"] += 1
+            return response
+
+        compressor = self._compressor(encoding)
+        compressed = compressor.compress(body) + compressor.flush()
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+
+        kind = self.stats["plain"]
+        kind["responses"] += 1
+        kind["bytes_in"] += len(body)
+        kind["bytes_out"] += len(compressed)
+        return response
+
+    def _compress_stream(self, response, encoding: str):
+        """Swap the body for a compressing generator that sync-flushes at event boundaries"""
+        original = response.response
+        chunks = response.iter_encoded()
+        boundary = STREAM_BOUNDARIES[response.mimetype]
+        response.response = self._stream(original, chunks, self._compressor(encoding), boundary)
+        response.headers["Content-Encoding"] = encoding
+        response.headers.pop("Content-Length", None)
+        self.stats["stream"]["responses"] += 1
+
+    def _stream(self, original, chunks: Iterator[bytes], compressor, boundary: bytes) -> Iterator[bytes]:
+        kind = self.stats["stream"]
+        try:
+            for chunk in chunks:
+                kind["bytes_in"] += len(chunk)
+                out = compressor.compress(chunk)
+                if boundary in chunk:
+                    out += compressor.flush(zlib.Z_SYNC_FLUSH)
+                    kind["flushes"] += 1
+                if out:
+                    kind["bytes_out"] += len(out)
+                    yield out
+            tail = compressor.flush()
+            kind["bytes_out"] += len(tail)
+            yield tail
+        finally:
+            # Closing the response closes this generator; pass that on so the producer sees the disconnect
+            close = getattr(original, "close", None)
+            if close:
+                close()
+
+    def get_stats(self) -> Dict:
+        """Summary for /stats"""
+        summary = {"enabled": self.enabled, "min_size": self.min_size, "level": self.level}
+        for name in ("plain", "stream"):
+            kind = dict(self.stats[name])
+            kind["ratio"] = round(kind["bytes_in"] / kind["bytes_out"], 2) if kind["bytes_out"] else None
+            summary[name] = kind
+        summary["skipped_small"] = self.stats["skipped_small"]
+        summary["not_accepted"] = self.stats["not_accepted"]
+        return summary
+
+
+# Applied to every API response in an after_request hook
+compression = ResponseCompressor.from_env()
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Runtime Configuration
+Typed, validated settings loaded from the environment and a JSON config file, hot-reloaded in place
+
+Precedence, lowest to highest:
+    built-in defaults  <  environment (including .env)  <  GENERATION_PROFILE_FILE  <  CONFIG_FILE
+
+GENERATION_PROFILE_FILE (default generation_profile.json) is written by
+autotune_ollama.py and only contributes generation profile options.
+
+The config file is the live tuning layer: it is re-read on SIGHUP and whenever
+its modification time changes. A file that fails validation is rejected as a
+whole and the previous settings stay in effect.
+
+Example config.json:
+    {
+        "model_name": "phi3:mini",
+        "max_conversation_length": 25,
+        "generation_profiles": {
+            "chat": {"temperature": 0.6, "num_predict": 400},
+            "stream": {"num_predict": 800, "keep_alive": "30m"}
+        }
+    }
+"""
+
+import copy
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    from dotenv import load_dotenv
+except ImportError:  # python-dotenv is optional at runtime
+    load_dotenv = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STOP = ["\n\nUser:", "\n\nHuman:"]
+
+# Per-route sampling and runtime options sent to Ollama
+DEFAULT_PROFILES: Dict[str, Dict[str, Any]] = {
+    "chat": {"temperature": 0.7, "top_p": 0.9, "num_predict": 500, "stop": DEFAULT_STOP},
+    "stream": {"temperature": 0.7, "top_p": 0.9, "num_predict": 1000, "stop": DEFAULT_STOP},
+    "webhook": {"temperature": 0.7, "top_p": 0.9, "num_predict": 500}
+}
+
+# Profile keys that belong on the /api/generate request rather than in "options"
+REQUEST_LEVEL_KEYS = ("model", "keep_alive")
+
+# Allowed Ollama options and their value types
+OPTION_TYPES = {
+    "temperature": float, "top_p": float, "top_k": int, "min_p": float,
+    "repeat_penalty": float, "repeat_last_n": int, "presence_penalty": float, "frequency_penalty": float,
+    "seed": int, "num_predict": int, "num_ctx": int, "num_batch": int, "num_thread": int,
+    "num_gpu": int, "num_keep": int, "mirostat": int, "mirostat_tau": float, "mirostat_eta": float,
+    "stop": list, "model": str, "keep_alive": (str, int)
+}
+
+
+class ConfigError(ValueError):
+    """Raised when configuration values fail validation"""
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Effective runtime settings; replaced wholesale on reload, never mutated"""
+
+    ollama_base_url: str = "http://localhost:11434"
+    model_name: str = "phi3:mini"
+    ollama_timeout: int = 600
+    webhook_timeout: int = 30
+    max_conversation_length: int = 25
+    max_context_messages: int = 50
+    context_exchanges: int = 3
+    retrieval_top_k: int = 2
+    retrieval_min_similarity: float = 0.3
+    embed_timeout: float = 1.0
+    sse_heartbeat_interval: float = 15.0
+    sse_flush_interval: float = 0.1
+    sse_flush_chars: int = 64
+    chat_deadline: float = 0.0
+    stream_deadline: float = 0.0
+    webhook_deadline: float = 25.0
+    generation_profiles: Dict[str, Dict[str, Any]] = field(default_factory=lambda: copy.deepcopy(DEFAULT_PROFILES))
+
+    def profile(self, route: str) -> Dict[str, Any]:
+        """Full generation profile for a route, falling back to the chat profile"""
+        return self.generation_profiles.get(route) or self.generation_profiles["chat"]
+
+    def generation_options(self, route: str) -> Dict[str, Any]:
+        """Ollama "options" for a route"""
+        return {k: v for k, v in self.profile(route).items() if k not in REQUEST_LEVEL_KEYS}
+
+    def request_params(self, route: str) -> Dict[str, Any]:
+        """Top-level /api/generate parameters for a route (keep_alive)"""
+        return {k: v for k, v in self.profile(route).items() if k in REQUEST_LEVEL_KEYS and k != "model"}
+
+    def model_for(self, route: str) -> str:
+        """Model pinned by the route profile, or the global model"""
+        return self.profile(route).get("model") or self.model_name
+
+    def num_predict(self, route: str) -> int:
+        """Output token budget for a route"""
+        return int(self.profile(route).get("num_predict", 500))
+
+    def deadline_for(self, route: str) -> float:
+        """Default seconds a caller on this route waits for an answer; 0 means no route deadline"""
+        return {"chat": self.chat_deadline, "stream": self.stream_deadline,
+                "webhook": self.webhook_deadline}.get(route, self.chat_deadline)
+
+
+# Scalar settings: (environment variable, type, validator, description)
+SCALAR_FIELDS = {
+    "ollama_base_url": ("OLLAMA_BASE_URL", str, lambda v: v.startswith(("http://", "https://")), "must be an http(s) URL"),
+    "model_name": ("MODEL_NAME", str, lambda v: bool(v.strip()), "must not be empty"),
+    "ollama_timeout": ("OLLAMA_TIMEOUT", int, lambda v: 1 <= v <= 3600, "must be 1-3600 seconds"),
+    "webhook_timeout": ("WEBHOOK_TIMEOUT", int, lambda v: 1 <= v <= 3600, "must be 1-3600 seconds"),
+    "max_conversation_length": ("MAX_CONVERSATION_LENGTH", int, lambda v: 1 <= v <= 1000, "must be 1-1000"),
+    "max_context_messages": ("MAX_CONTEXT_MESSAGES", int, lambda v: 1 <= v <= 1000, "must be 1-1000"),
+    "context_exchanges": ("CONTEXT_EXCHANGES", int, lambda v: 0 <= v <= 50, "must be 0-50"),
+    "retrieval_top_k": ("RETRIEVAL_TOP_K", int, lambda v: 0 <= v <= 20, "must be 0-20"),
+    "retrieval_min_similarity": ("RETRIEVAL_MIN_SIMILARITY", float, lambda v: -1 <= v <= 1, "must be between -1 and 1"),
+    "embed_timeout": ("EMBED_TIMEOUT", float, lambda v: 0 < v <= 30, "must be 0-30 seconds"),
+    "sse_heartbeat_interval": ("SSE_HEARTBEAT_INTERVAL", float, lambda v: 1 <= v <= 300, "must be 1-300 seconds"),
+    "sse_flush_interval": ("SSE_FLUSH_INTERVAL", float, lambda v: 0 <= v <= 5, "must be 0-5 seconds"),
+    "sse_flush_chars": ("SSE_FLUSH_CHARS", int, lambda v: 1 <= v <= 65536, "must be 1-65536"),
+    "chat_deadline": ("CHAT_DEADLINE", float, lambda v: 0 <= v <= 3600, "must be 0-3600 seconds"),
+    "stream_deadline": ("STREAM_DEADLINE", float, lambda v: 0 <= v <= 3600, "must be 0-3600 seconds"),
+    "webhook_deadline": ("WEBHOOK_DEADLINE", float, lambda v: 0 <= v <= 3600, "must be 0-3600 seconds")
+}
+
+
+def _coerce(name: str, value: Any, expected) -> Any:
+    """Convert env strings and JSON values to the expected type"""
+    if expected is int and isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            raise ValueError(f"{name}: expected an integer, got {value!r}")
+    if expected is int and isinstance(value, float) and value.is_integer():
+        return int(value)
+    if expected is float and isinstance(value, (int, str)) and not isinstance(value, bool):
+        try:
+            return float(value)
+        except ValueError:
+            raise ValueError(f"{name}: expected a number, got {value!r}")
+    if expected is str and isinstance(value, str):
+        return value.strip()
+    if isinstance(expected, tuple) and isinstance(value, expected):
+        return value
+    if isinstance(value, expected) and not isinstance(value, bool):
+        return value
+    raise TypeError(f"{name}: expected {getattr(expected, '__name__', expected)}, got {type(value).__name__}")
+
+
+def _validate_profile(route: str, profile: Dict[str, Any], errors: List[str]) -> Dict[str, Any]:
+    """Validate and normalize one generation profile"""
+    cleaned = {}
+    for key, value in profile.items():
+        expected = OPTION_TYPES.get(key)
+        if expected is None:
+            errors.append(f"generation_profiles.{route}.{key}: unknown option")
+            continue
+        try:
+            value = _coerce(key, value, expected)
+        except (TypeError, ValueError) as e:
+            errors.append(f"generation_profiles.{route}.{e}")
+            continue
+        if key == "stop" and not all(isinstance(s, str) for s in value):
+            errors.append(f"generation_profiles.{route}.stop: must be a list of strings")
+            continue
+        if key in ("temperature", "top_p") and not 0 <= value <= 2:
+            errors.append(f"generation_profiles.{route}.{key}: out of range")
+            continue
+        if key in ("num_ctx", "num_batch", "num_thread") and value < 1:
+            errors.append(f"generation_profiles.{route}.{key}: must be positive")
+            continue
+        cleaned[key] = value
+    return cleaned
+
+
+def build_settings(env: Dict[str, str], file_values: Optional[Dict[str, Any]] = None,
+                   tuned_profiles: Optional[Dict[str, Dict[str, Any]]] = None) -> Settings:
+    """Merge defaults, environment, tuned profiles and file values into validated Settings"""
+    errors: List[str] = []
+    values: Dict[str, Any] = {}
+
+    for name, (env_var, expected, check, message) in SCALAR_FIELDS.items():
+        raw = None
+        if env.get(env_var, "").strip():
+            raw = env[env_var]
+        if file_values and name in file_values:
+            raw = file_values[name]
+        if raw is None:
+            continue
+        try:
+            value = _coerce(name, raw, expected)
+        except (TypeError, ValueError) as e:
+            errors.append(str(e))
+            continue
+        if not check(value):
+            errors.append(f"{name}: {message} (got {value!r})")
+            continue
+        values[name] = value
+
+    profiles = copy.deepcopy(DEFAULT_PROFILES)
+    for layer in (tuned_profiles or {}, (file_values or {}).get("generation_profiles") or {}):
+        for route, overrides in layer.items():
+            if not isinstance(overrides, dict):
+                errors.append(f"generation_profiles.{route}: must be an object")
+                continue
+            profiles[route] = {**profiles.get(route, {}), **_validate_profile(route, overrides, errors)}
+    values["generation_profiles"] = profiles
+
+    unknown = set(file_values or {}) - set(SCALAR_FIELDS) - {"generation_profiles"}
+    for name in sorted(unknown):
+        errors.append(f"{name}: unknown setting")
+
+    if errors:
+        raise ConfigError("; ".join(errors))
+
+    return Settings(**values)
+
+
+class ConfigManager:
+    """Owns the current Settings and swaps them atomically on reload"""
+
+    def __init__(self, config_path: str = "", env_file: str = "", profile_path: str = ""):
+        self.config_path = config_path
+        self.env_file = env_file
+        self.profile_path = profile_path
+        self._listeners: List[Callable[[Settings], None]] = []
+        self._reload_lock = threading.Lock()
+        self._mtime = 0.0
+        self._watcher: Optional[threading.Thread] = None
+
+        self.version = 0
+        self.loaded_at = ""
+        self.last_error = ""
+
+        if load_dotenv and env_file and os.path.exists(env_file):
+            load_dotenv(env_file, override=False)
+
+        try:
+            self._settings = self._load()
+        except ConfigError as e:
+            # Start on env-only settings rather than refusing to serve
+            self.last_error = str(e)
+            logger.error("Invalid configuration, ignoring config files: %s", e)
+            self._settings = build_settings(dict(os.environ))
+        self._mark_loaded()
+
+    @classmethod
+    def from_env(cls) -> "ConfigManager":
+        """Create a manager for CONFIG_FILE (default: config.json next to this module)"""
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        return cls(
+            os.getenv("CONFIG_FILE", os.path.join(base_dir, "config.json")),
+            env_file=os.path.join(base_dir, ".env"),
+            profile_path=os.getenv("GENERATION_PROFILE_FILE", os.path.join(base_dir, "generation_profile.json"))
+        )
+
+    def _read_file(self) -> Optional[Dict[str, Any]]:
+        """Read the JSON config file if present"""
+        if not self.config_path or not os.path.exists(self.config_path):
+            self._mtime = 0.0
+            return None
+        self._mtime = os.path.getmtime(self.config_path)
+        try:
+            with open(self.config_path, "r", encoding="utf-8") as f:
+                values = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ConfigError(f"{self.config_path}: invalid JSON ({e})")
+        if not isinstance(values, dict):
+            raise ConfigError(f"{self.config_path}: top level must be an object")
+        return values
+
+    def _read_tuned_profiles(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Read the autotuner's recommended generation profiles if present"""
+        if not self.profile_path or not os.path.exists(self.profile_path):
+            return None
+        try:
+            with open(self.profile_path, "r", encoding="utf-8") as f:
+                profiles = json.load(f).get("generation_profiles")
+        except (json.JSONDecodeError, AttributeError) as e:
+            raise ConfigError(f"{self.profile_path}: invalid generation profile file ({e})")
+        return profiles if isinstance(profiles, dict) else None
+
+    def _load(self) -> Settings:
+        return build_settings(dict(os.environ), self._read_file(), self._read_tuned_profiles())
+
+    def _mark_loaded(self):
+        self.version += 1
+        self.loaded_at = datetime.now().isoformat()
+
+    def current(self) -> Settings:
+        """The settings in effect right now"""
+        return self._settings
+
+    def on_reload(self, callback: Callable[[Settings], None]):
+        """Register a callback invoked with the new Settings after each successful reload"""
+        self._listeners.append(callback)
+
+    def reload(self) -> bool:
+        """Re-read the config file; keeps the old settings if the new ones are invalid"""
+        with self._reload_lock:
+            try:
+                new_settings = self._load()
+            except ConfigError as e:
+                self.last_error = str(e)
+                logger.error("Configuration reload rejected: %s", e)
+                return False
+
+            old_settings = self._settings
+            self._settings = new_settings
+            self.last_error = ""
+            self._mark_loaded()
+
+        changed = [k for k, v in asdict(new_settings).items() if asdict(old_settings)[k] != v]
+        logger.info("Configuration reloaded (version %d), changed: %s", self.version, ", ".join(changed) or "nothing")
+
+        for callback in self._listeners:
+            try:
+                callback(new_settings)
+            except Exception as e:
+                logger.error("Configuration reload listener failed: %s", e)
+        return True
+
+    def install_sighup_handler(self):
+        """Reload on SIGHUP; only possible from the main thread"""
+        if threading.current_thread() is not threading.main_thread() or not hasattr(signal, "SIGHUP"):
+            return
+
+        def handle_sighup(signum, frame):
+            # Do the file I/O off the signal handler
+            threading.Thread(target=self.reload, name="config-reload", daemon=True).start()
+
+        signal.signal(signal.SIGHUP, handle_sighup)
+
+    def start_watching(self, poll_interval: float = 5.0):
+        """Poll the config file's modification time and reload on change"""
+        if self._watcher or poll_interval <= 0:
+            return
+
+        def watch():
+            while True:
+                time.sleep(poll_interval)
+                try:
+                    mtime = os.path.getmtime(self.config_path) if os.path.exists(self.config_path) else 0.0
+                except OSError:
+                    continue
+                if mtime != self._mtime:
+                    self.reload()
+
+        self._watcher = threading.Thread(target=watch, name="config-watcher", daemon=True)
+        self._watcher.start()
+
+    def describe(self) -> Dict[str, Any]:
+        """Effective configuration and reload status for /stats"""
+        return {
+            **asdict(self._settings),
+            "source": {
+                "config_file": self.config_path if self._mtime else None,
+                "generation_profile_file": self.profile_path if os.path.exists(self.profile_path) else None,
+                "version": self.version,
+                "loaded_at": self.loaded_at,
+                "last_error": self.last_error or None
+            }
+        }
+
+
+config_manager = ConfigManager.from_env()
+
+
+def settings() -> Settings:
+    """Shortcut for the current settings"""
+    return config_manager.current()
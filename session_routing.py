@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Session Routing
+Pins each session to one owning process with consistent hashing and bounded load
+
+Conversation history lives in the memory of the process that served it, so
+with several processes (gunicorn instances on their own ports, or several
+VMs) every turn of a session has to reach the same one. Two ways to get there:
+
+    nginx       `python session_routing.py nginx --members ...` prints an
+                upstream block using `hash $http_x_session_id consistent`
+                (ketama), so nginx picks the owner and nothing else is needed.
+    forwarding  ROUTING_MEMBERS lists every process; a request that lands on
+                the wrong one is proxied to its owner (SSE streams included).
+
+Forwarding adds bounded loads: each session's primary owner on the ring
+decides where it lives. While the primary holds no more than
+ROUTING_LOAD_FACTOR × the average session count, it keeps its sessions;
+beyond that, new sessions spill to the next member clockwise that is under
+the bound, and the primary remembers the spill so later turns follow it.
+Members that stop answering are skipped until they recover, which moves only
+their own sessions.
+
+X-Route-Hops marks a request another member already forwarded, which is then
+served where it landed. It is only honoured on requests from a member's
+address that name another member in X-Routed-By; from anyone else it is
+ignored, so a client can't use it to skip the owner. Where nginx runs on the
+same host as a member, also clear it at nginx (see the generated snippet).
+
+Each member is placed on the ring at ROUTING_VNODES points (weighted), so
+adding or removing one moves about 1/N of the sessions; `python
+session_routing.py plan` shows the exact share for a change.
+
+Environment:
+    ROUTING_MEMBERS         "a=http://10.0.0.4:5000,b=http://10.0.0.5:5000" (optionally name=url*weight)
+    ROUTING_SELF            this process's member name
+    ROUTING_LOAD_FACTOR     bounded-load factor (default 1.25)
+    ROUTING_VNODES          ring points per unit of weight (default 160)
+    ROUTING_POLL_INTERVAL   seconds between member load/health polls (default 5)
+"""
+
+import argparse
+import bisect
+import hashlib
+import logging
+import math
+import os
+import socket
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Set
+from urllib.parse import urlparse
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+ROUTED_BY_HEADER = "X-Routed-By"
+HOPS_HEADER = "X-Route-Hops"
+MAX_HOPS = 2
+
+# Headers that describe a single hop and must not be copied through a proxy
+HOP_BY_HOP = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailers",
+              "transfer-encoding", "upgrade", "content-length", "content-encoding", "host"}
+
+DOWN_COOLDOWN_SECONDS = 15.0
+MAX_SPILLS = 100000
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+def parse_members(value: str) -> Dict[str, Dict]:
+    """Parse "name=url[*weight],..." (bare URLs are named after host:port)"""
+    members = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, url = item.rpartition("=") if "=" in item else ("", "", item)
+        url, _, weight = url.partition("*")
+        if "://" not in url:
+            url = f"http://{url}"
+        members[name.strip() or urlparse(url).netloc] = {"url": url.rstrip("/"), "weight": float(weight or 1)}
+    return members
+
+
+class HashRing:
+    """Consistent-hash ring with weighted virtual nodes"""
+
+    def __init__(self, weights: Dict[str, float], vnodes: int = 160):
+        self.weights = dict(weights)
+        points = []
+        for member, weight in weights.items():
+            for i in range(max(1, int(round(vnodes * weight)))):
+                points.append((_hash(f"{member}#{i}"), member))
+        points.sort()
+        self._hashes = [h for h, _ in points]
+        self._members = [m for _, m in points]
+
+    def candidates(self, key: str) -> Iterator[str]:
+        """Distinct members clockwise from the key's position; the first is its primary"""
+        if not self._hashes:
+            return
+        start = bisect.bisect(self._hashes, _hash(key))
+        seen = set()
+        for i in range(len(self._members)):
+            member = self._members[(start + i) % len(self._members)]
+            if member not in seen:
+                seen.add(member)
+                yield member
+                if len(seen) == len(self.weights):
+                    return
+
+    def owner(self, key: str, loads: Optional[Dict[str, float]] = None, load_factor: float = 0.0,
+              available: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        """First available candidate under the bounded-load capacity (plain owner without loads)"""
+        live = [m for m in self.weights if available is None or available(m)]
+        if not live:
+            return None
+        capacity = None
+        if loads is not None and load_factor:
+            total_weight = sum(self.weights[m] for m in live)
+            total_load = sum(loads.get(m, 0) for m in live) + 1
+            capacity = {m: math.ceil(load_factor * total_load * self.weights[m] / total_weight) for m in live}
+        fallback = None
+        for member in self.candidates(key):
+            if available is not None and not available(member):
+                continue
+            if capacity is None or loads.get(member, 0) < capacity[member]:
+                return member
+            fallback = fallback or member
+        return fallback
+
+
+class SessionRouter:
+    """Decides which member owns a session and forwards requests that landed elsewhere"""
+
+    def __init__(self, members: Dict[str, Dict], self_name: Optional[str], load_factor: float = 1.25,
+                 vnodes: int = 160, poll_interval: float = 5.0):
+        self.members = members
+        self.self_name = self_name
+        self.load_factor = load_factor
+        self.poll_interval = poll_interval
+        self.enabled = bool(members) and self_name in members and len(members) > 1
+        self.ring = HashRing({name: m["weight"] for name, m in members.items()}, vnodes)
+        self.local_load: Callable[[], int] = lambda: 0
+
+        self._lock = threading.Lock()
+        self._loads: Dict[str, int] = {name: 0 for name in members}
+        self._down_until: Dict[str, float] = {}
+        self._spills: "OrderedDict[str, str]" = OrderedDict()  # session -> member, kept by its primary
+        self._poller: Optional[threading.Thread] = None
+        self._session = requests.Session()
+        self._member_addresses = self._resolve_addresses()
+        self.stats = {"local": 0, "forwarded": 0, "spilled": 0, "forward_failures": 0, "by_member": {},
+                      "untrusted_hops": 0}
+
+        if members and not self.enabled:
+            logger.warning("Session routing disabled: ROUTING_SELF %r is not one of %d members",
+                           self_name, len(members))
+
+    @classmethod
+    def from_env(cls) -> "SessionRouter":
+        return cls(
+            parse_members(os.getenv("ROUTING_MEMBERS", "")),
+            os.getenv("ROUTING_SELF") or None,
+            load_factor=float(os.getenv("ROUTING_LOAD_FACTOR", "1.25")),
+            vnodes=int(os.getenv("ROUTING_VNODES", "160")),
+            poll_interval=float(os.getenv("ROUTING_POLL_INTERVAL", "5"))
+        )
+
+    def member_hosts(self) -> List[str]:
+        return [urlparse(m["url"]).hostname for m in self.members.values()]
+
+    def _resolve_addresses(self) -> Set[str]:
+        addresses = set()
+        for host in filter(None, self.member_hosts()):
+            addresses.add(host)
+            try:
+                addresses.update(info[4][0] for info in socket.getaddrinfo(host, None))
+            except OSError:
+                logger.warning("Could not resolve routing member host %s", host)
+        return addresses
+
+    def request_hops(self, req) -> int:
+        """Hops a request has already made; 0 unless another member forwarded it"""
+        value = req.headers.get(HOPS_HEADER)
+        if not value:
+            return 0
+        routed_by = req.headers.get(ROUTED_BY_HEADER)
+        if req.remote_addr not in self._member_addresses or routed_by not in self.members \
+                or routed_by == self.self_name:
+            self.stats["untrusted_hops"] += 1
+            return 0
+        try:
+            return min(max(int(value), 0), MAX_HOPS)
+        except ValueError:
+            return 0
+
+    # ------------------------------------------------------------------
+    # Membership state
+    # ------------------------------------------------------------------
+
+    def _available(self, member: str) -> bool:
+        return member == self.self_name or self._down_until.get(member, 0) <= time.time()
+
+    def _mark_down(self, member: str):
+        self._down_until[member] = time.time() + DOWN_COOLDOWN_SECONDS
+        logger.warning("Routing member %s unreachable; its sessions go to the next member for %.0fs",
+                       member, DOWN_COOLDOWN_SECONDS)
+
+    def start(self):
+        """Poll the other members' loads and health in the background"""
+        if self.enabled and self._poller is None:
+            self._poller = threading.Thread(target=self._poll_loop, name="session-routing", daemon=True)
+            self._poller.start()
+
+    def _poll_loop(self):
+        while True:
+            for name, member in self.members.items():
+                if name == self.self_name:
+                    continue
+                try:
+                    response = self._session.get(f"{member['url']}/routing/status", timeout=2)
+                    response.raise_for_status()
+                    with self._lock:
+                        self._loads[name] = int(response.json().get("load", 0))
+                    self._down_until.pop(name, None)
+                except (requests.RequestException, ValueError):
+                    self._mark_down(name)
+            time.sleep(self.poll_interval)
+
+    def _loads_snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            loads = dict(self._loads)
+        loads[self.self_name] = self.local_load()
+        return loads
+
+    # ------------------------------------------------------------------
+    # Routing decisions
+    # ------------------------------------------------------------------
+
+    def primary(self, session_id: str) -> Optional[str]:
+        return self.ring.owner(session_id, available=self._available)
+
+    def route(self, session_id: str, hops: int, known_locally: bool) -> str:
+        """Member that should serve this request"""
+        member = self._route(session_id, hops, known_locally)
+        if member == self.self_name:
+            self.stats["local"] += 1
+        return member
+
+    def _route(self, session_id: str, hops: int, known_locally: bool) -> str:
+        primary = self.primary(session_id)
+        if known_locally or hops >= MAX_HOPS or primary is None:
+            return self.self_name
+        if primary != self.self_name:
+            # The primary decides; a request it sent on (hops > 0) stays where it landed
+            return primary if hops == 0 else self.self_name
+
+        with self._lock:
+            spilled = self._spills.get(session_id)
+            if spilled:
+                self._spills.move_to_end(session_id)
+        if spilled and self._available(spilled):
+            return spilled
+
+        owner = self.ring.owner(session_id, self._loads_snapshot(), self.load_factor, self._available)
+        if owner and owner != self.self_name:
+            with self._lock:
+                self._spills[session_id] = owner
+                while len(self._spills) > MAX_SPILLS:
+                    self._spills.popitem(last=False)
+                self.stats["spilled"] += 1
+        return owner or self.self_name
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._spills.pop(session_id, None)
+
+    def forward(self, member: str, req, hops: int):
+        """Proxy a Flask request to another member; returns (status, headers, body iterator) or None"""
+        url = f"{self.members[member]['url']}{req.full_path.rstrip('?')}"
+        headers = {k: v for k, v in req.headers.items() if k.lower() not in HOP_BY_HOP}
+        headers[ROUTED_BY_HEADER] = self.self_name
+        headers[HOPS_HEADER] = str(hops + 1)
+        headers["X-Forwarded-For"] = ", ".join(filter(None, [req.headers.get("X-Forwarded-For"), req.remote_addr]))
+        headers.setdefault("X-Real-IP", req.headers.get("X-Real-IP") or req.remote_addr or "")
+        try:
+            upstream = self._session.request(req.method, url, data=req.get_data(), headers=headers,
+                                             stream=True, timeout=(3, 900))
+        except requests.RequestException as e:
+            self.stats["forward_failures"] += 1
+            logger.warning("Forwarding to %s failed: %s", member, e)
+            self._mark_down(member)
+            return None
+
+        self.stats["forwarded"] += 1
+        by_member = self.stats["by_member"]
+        by_member[member] = by_member.get(member, 0) + 1
+        response_headers = [(k, v) for k, v in upstream.headers.items() if k.lower() not in HOP_BY_HOP]
+
+        def body():
+            with upstream:
+                yield from upstream.raw.stream(8192, decode_content=True)
+
+        return upstream.status_code, response_headers, body()
+
+    def get_stats(self) -> Dict:
+        """Summary for /stats"""
+        now = time.time()
+        loads = self._loads_snapshot() if self.enabled else {}
+        return {
+            "enabled": self.enabled,
+            "self": self.self_name,
+            "load_factor": self.load_factor,
+            "members": {
+                name: {"url": m["url"], "weight": m["weight"], "load": loads.get(name),
+                       "available": self._down_until.get(name, 0) <= now}
+                for name, m in self.members.items()
+            },
+            "spilled_sessions": len(self._spills),
+            **self.stats
+        }
+
+
+# Shared by the API and the Zoho webhook blueprint
+router = SessionRouter.from_env()
+
+
+# ----------------------------------------------------------------------
+# Command line: nginx upstream generation and rebalancing plans
+# ----------------------------------------------------------------------
+
+def nginx_upstream(members: Dict[str, Dict], name: str = "ai_assistant_sessions") -> str:
+    """Upstream block pinning X-Session-ID to a backend with nginx's ketama hashing"""
+    lines = [
+        "# Generated by session_routing.py: one backend per process, sessions pinned by X-Session-ID",
+        f"upstream {name} {{",
+        "    hash $http_x_session_id consistent;"
+    ]
+    for member, info in members.items():
+        weight = int(round(info["weight"]))
+        lines.append(f"    server {urlparse(info['url']).netloc}{f' weight={weight}' if weight != 1 else ''} "
+                     f"max_fails=2 fail_timeout=15s;  # {member}")
+    lines += [
+        "    keepalive 16;",
+        "}",
+        "",
+        "# In the server block, send session traffic through it (keep the existing proxy settings):",
+        "#   location ~ ^/(chat|webhook) {",
+        f"#       proxy_pass http://{name};",
+        "#       proxy_http_version 1.1;",
+        "#       proxy_set_header Connection \"\";",
+        f"#       proxy_set_header {HOPS_HEADER} \"\";  # only members may set it",
+        "#   }"
+    ]
+    return "\n".join(lines)
+
+
+def plan(before: Dict[str, Dict], after: Dict[str, Dict], samples: int, vnodes: int) -> Dict:
+    """Share of sessions that change owner between two memberships"""
+    ring_before = HashRing({n: m["weight"] for n, m in before.items()}, vnodes)
+    ring_after = HashRing({n: m["weight"] for n, m in after.items()}, vnodes)
+    moved = 0
+    per_member = {name: 0 for name in after}
+    for i in range(samples):
+        key = f"session-{i}"
+        owner = ring_after.owner(key)
+        per_member[owner] += 1
+        moved += ring_before.owner(key) != owner
+    return {
+        "moved_fraction": round(moved / samples, 4),
+        "ideal_fraction": round(abs(len(after) - len(before)) / max(len(after), len(before)), 4),
+        "share_after": {name: round(count / samples, 4) for name, count in per_member.items()}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Session routing helpers")
+    sub = parser.add_subparsers(dest="command", required=True)
+    nginx = sub.add_parser("nginx", help="Print an nginx upstream block hashing on X-Session-ID")
+    nginx.add_argument("--members", default=os.getenv("ROUTING_MEMBERS", ""),
+                       help="e.g. 127.0.0.1:5001,127.0.0.1:5002 (default: ROUTING_MEMBERS)")
+    nginx.add_argument("--name", default="ai_assistant_sessions")
+    rebalance = sub.add_parser("plan", help="Show how many sessions move when membership changes")
+    rebalance.add_argument("--before", required=True)
+    rebalance.add_argument("--after", required=True)
+    rebalance.add_argument("--samples", type=int, default=100000)
+    rebalance.add_argument("--vnodes", type=int, default=int(os.getenv("ROUTING_VNODES", "160")))
+    args = parser.parse_args()
+
+    if args.command == "nginx":
+        members = parse_members(args.members)
+        if not members:
+            print("❌ No members given (--members or ROUTING_MEMBERS)")
+            sys.exit(1)
+        print(nginx_upstream(members, args.name))
+    else:
+        result = plan(parse_members(args.before), parse_members(args.after), args.samples, args.vnodes)
+        print(f"🔀 {result['moved_fraction']:.1%} of sessions move (ideal {result['ideal_fraction']:.1%})")
+        for name, share in result["share_after"].items():
+            print(f"   {name}: {share:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -179,6 +179,20 @@ server {
         proxy_busy_buffers_size 256k;
     }
 
+    # WebSocket transport: one long-lived connection per browser
+    location /ws {
+        proxy_pass http://127.0.0.1:5000/ws;
+        proxy_http_version 1.1;
+        proxy_set_header Upgrade \$http_upgrade;
+        proxy_set_header Connection "upgrade";
+        proxy_set_header Host \$host;
+        proxy_set_header X-Real-IP \$remote_addr;
+        proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
+        proxy_buffering off;
+        proxy_read_timeout 3600s;
+        proxy_send_timeout 3600s;
+    }
+
     # Health check endpoint
     location /health {
         proxy_pass http://127.0.0.1:5000/health;
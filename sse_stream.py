@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+SSE Stream Relay
+Runs a generation producer on a worker thread and relays its output as Server-Sent Events
+
+The relay keeps the connection alive while nothing is happening (queued behind
+other sessions, or Ollama still evaluating a long prompt) by sending SSE
+comment heartbeats, which browsers ignore but which reset nginx and browser
+idle timers. Tokens are coalesced and flushed on a time/size window instead of
+one frame per token.
+"""
+
+import contextvars
+import json
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional
+
+HEARTBEAT_FRAME = ": heartbeat\n\n"
+
+# Headers that keep proxies from buffering or caching the event stream
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Session-ID'
+}
+
+
+def sse_event(payload: Dict) -> str:
+    """Format one SSE data frame"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+class StreamRelay:
+    """Bridges a producer thread to an SSE generator with heartbeats and token coalescing
+
+    The producer is called as produce(emit, cancelled) where emit(kind, payload)
+    accepts "token" (text to coalesce) or "event" (a dict sent as-is, after any
+    pending tokens). `cancelled` is set when the client goes away.
+    """
+
+    def __init__(self, heartbeat_interval: float = 15.0, flush_interval: float = 0.1,
+                 flush_chars: int = 64, token_frame: Optional[Callable[[str, str], Dict]] = None):
+        self.heartbeat_interval = heartbeat_interval
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self.token_frame = token_frame or (
+            lambda chunk, full: {'status': 'streaming', 'chunk': chunk, 'full_response': full}
+        )
+        self.heartbeats_sent = 0
+
+    def run(self, produce: Callable, frame: Callable[[Dict], object] = sse_event,
+            heartbeat: Optional[str] = HEARTBEAT_FRAME, cancelled: Optional[threading.Event] = None) -> Iterator:
+        """Start the producer and yield SSE frames until it finishes
+
+        Other transports pass their own `frame` formatter (and heartbeat=None
+        when they keep the connection alive themselves), and may pass the
+        `cancelled` event so they can stop the producer from outside.
+        """
+        events: "queue.SimpleQueue" = queue.SimpleQueue()
+        cancelled = cancelled or threading.Event()
+
+        def emit(kind: str, payload=None):
+            events.put((kind, payload))
+
+        def worker():
+            try:
+                produce(emit, cancelled)
+            finally:
+                events.put(("end", None))
+
+        # Copy the request's context so the producer's log records keep its request/session IDs
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(worker,), name="sse-producer", daemon=True).start()
+
+        pending = []
+        pending_chars = 0
+        pending_since = 0.0
+        full_text = ""
+        last_sent = time.time()
+
+        def flush() -> str:
+            nonlocal pending, pending_chars, full_text
+            chunk = "".join(pending)
+            full_text += chunk
+            pending, pending_chars = [], 0
+            return frame(self.token_frame(chunk, full_text))
+
+        try:
+            while True:
+                now = time.time()
+                wait = last_sent + self.heartbeat_interval - now
+                if pending:
+                    wait = min(wait, pending_since + self.flush_interval - now)
+
+                try:
+                    kind, payload = events.get(timeout=max(wait, 0.0))
+                except queue.Empty:
+                    if pending:
+                        yield flush()
+                    elif heartbeat is not None:
+                        self.heartbeats_sent += 1
+                        yield heartbeat
+                    last_sent = time.time()
+                    continue
+
+                if kind == "token":
+                    if not pending:
+                        pending_since = time.time()
+                    pending.append(payload)
+                    pending_chars += len(payload)
+                    if pending_chars >= self.flush_chars:
+                        yield flush()
+                        last_sent = time.time()
+                elif kind == "event":
+                    if pending:
+                        yield flush()
+                    yield frame(payload)
+                    last_sent = time.time()
+                elif kind == "end":
+                    if pending:
+                        yield flush()
+                    break
+        finally:
+            # Client disconnected or stream finished; stop the producer either way
+            cancelled.set()
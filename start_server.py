@@ -2,15 +2,48 @@
 """
 FastAPI Server Startup Script
 Handles proper server configuration, health checks, and debugging
+
+Pre-flight checks only look packages up (nothing is imported or installed
+unless --install is given), and the Ollama check runs alongside the server
+start instead of in front of it. The server is launched under gunicorn with
+the preloaded app when gunicorn is installed, otherwise with the standalone
+server in fast_chatbot_api.py.
+
+Readiness comes from the server itself (startup.py): this script hands the
+child a notify socket and blocks on it until a worker reports READY=1, with
+READY_FILE as the fallback where Unix datagram sockets aren't available. No
+/health polling, so a missing Ollama doesn't hold up the start.
+
+Usage:
+    python start_server.py
+    python start_server.py --dev            # Flask debug server with reloader
+    python start_server.py --install        # pip install missing packages first
 """
 
+import argparse
+import importlib.util
+import json
 import os
-import sys
-import time
+import shutil
+import socket
 import subprocess
-import requests
+import sys
+import tempfile
 import threading
+import time
 from pathlib import Path
+from typing import Optional
+
+import requests
+
+from startup import sd_notify
+
+REQUIRED_PACKAGES = {
+    # import name: pip name
+    'flask': 'flask',
+    'flask_cors': 'flask-cors',
+    'requests': 'requests'
+}
 
 def check_python_version():
     """Ensure we're running Python 3.7+"""
@@ -19,40 +52,35 @@ def check_python_version():
         sys.exit(1)
     print(f"✅ Python {sys.version.split()[0]} detected")
 
-def check_dependencies():
-    """Check if required packages are installed"""
-    required_packages = [
-        'flask',
-        'flask_cors',
-        'requests'
-    ]
+def check_dependencies(install: bool = False):
+    """Check that required packages are installed (located, not imported)"""
+    missing_packages = [pip_name for name, pip_name in REQUIRED_PACKAGES.items()
+                        if importlib.util.find_spec(name) is None]
 
-    missing_packages = []
+    if not missing_packages:
+        print(f"✅ {', '.join(REQUIRED_PACKAGES)} installed")
+        return
 
-    for package in required_packages:
-        try:
-            __import__(package)
-            print(f"✅ {package} is installed")
-        except ImportError:
-            missing_packages.append(package)
-            print(f"❌ {package} is missing")
-
-    if missing_packages:
-        print(f"\n📦 Installing missing packages: {', '.join(missing_packages)}")
-        try:
-            subprocess.check_call([
-                sys.executable, '-m', 'pip', 'install'
-            ] + missing_packages)
-            print("✅ Dependencies installed successfully")
-        except subprocess.CalledProcessError:
-            print("❌ Failed to install dependencies")
-            print("Please run: pip install flask flask-cors requests")
-            sys.exit(1)
+    print(f"❌ Missing packages: {', '.join(missing_packages)}")
+    if not install:
+        print(f"Please run: pip install {' '.join(missing_packages)}  (or pass --install)")
+        sys.exit(1)
+
+    print(f"\n📦 Installing missing packages: {', '.join(missing_packages)}")
+    try:
+        subprocess.check_call([
+            sys.executable, '-m', 'pip', 'install'
+        ] + missing_packages)
+        print("✅ Dependencies installed successfully")
+    except subprocess.CalledProcessError:
+        print("❌ Failed to install dependencies")
+        print(f"Please run: pip install {' '.join(missing_packages)}")
+        sys.exit(1)
 
 def check_ollama():
     """Check if Ollama is running and accessible"""
     try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=5)
+        response = requests.get("http://localhost:11434/api/tags", timeout=2)
         if response.status_code == 200:
             models = response.json().get('models', [])
             print(f"✅ Ollama is running with {len(models)} models")
@@ -70,15 +98,13 @@ def check_ollama():
             print("⚠️ Ollama responded but with non-200 status")
     except requests.RequestException:
         print("❌ Ollama is not running or not accessible at localhost:11434")
-        print("Please start Ollama first: ollama serve")
+        print("   The server starts anyway; AI responses fail until you run: ollama serve")
         return False
 
     return True
 
 def test_port_availability(port=5000):
     """Test if the port is available"""
-    import socket
-
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
         sock.bind(('localhost', port))
@@ -89,8 +115,65 @@ def test_port_availability(port=5000):
         print(f"❌ Port {port} is already in use")
         return False
 
-def start_server():
-    """Start the FastAPI server"""
+class ReadyWaiter:
+    """Receives the server's readiness signal: a private notify socket, or READY_FILE"""
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix="ai-assistant-")
+        self.ready_file = os.path.join(self.directory, "ready.json")
+        self.socket_path = os.path.join(self.directory, "notify.sock")
+        self.sock = None
+        if hasattr(socket, "AF_UNIX"):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.bind(self.socket_path)
+
+    def environment(self) -> dict:
+        env = {"READY_FILE": self.ready_file}
+        if self.sock:
+            env["NOTIFY_SOCKET"] = self.socket_path
+        return env
+
+    def wait(self, process: subprocess.Popen, timeout: float) -> Optional[str]:
+        """STATUS reported by the server once ready; None on timeout or if the server exited"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and process.poll() is None:
+            if self.sock:
+                self.sock.settimeout(min(0.5, max(deadline - time.monotonic(), 0.01)))
+                try:
+                    message = self.sock.recv(4096).decode(errors="replace")
+                except socket.timeout:
+                    continue
+                fields = dict(line.split("=", 1) for line in message.splitlines() if "=" in line)
+                # gunicorn's master reports READY=1 too, before its workers; a worker writes the file first
+                if fields.get("READY") == "1" and os.path.exists(self.ready_file):
+                    return fields.get("STATUS", "ready")
+            elif os.path.exists(self.ready_file):
+                return "ready"
+            else:
+                time.sleep(0.05)
+        return None
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def phases(self) -> list:
+        try:
+            with open(self.ready_file, "r", encoding="utf-8") as f:
+                return json.load(f).get("phases", [])
+        except (OSError, ValueError):
+            return []
+
+def server_command(dev: bool) -> list:
+    """gunicorn with the preloaded app when available, else the standalone server"""
+    if not dev and importlib.util.find_spec('gunicorn') is not None:
+        return [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', '0.0.0.0:5000',
+                'fast_chatbot_api:app']
+    return [sys.executable, 'fast_chatbot_api.py']
+
+def start_server(dev: bool = False, ready_timeout: float = 30.0):
+    """Start the API server and wait for it to report ready"""
     script_dir = Path(__file__).parent
     api_file = script_dir / "fast_chatbot_api.py"
 
@@ -103,48 +186,56 @@ def start_server():
     # Change to the script directory
     os.chdir(script_dir)
 
-    # Set environment variables
-    os.environ['FLASK_APP'] = 'fast_chatbot_api.py'
-    os.environ['FLASK_ENV'] = 'development'
-    os.environ['FLASK_DEBUG'] = '1'
+    waiter = ReadyWaiter()
+    env = dict(os.environ, **waiter.environment())
+    if dev:
+        env['FLASK_DEBUG'] = '1'
 
+    launched = time.monotonic()
+    process = subprocess.Popen(server_command(dev), env=env)
     try:
-        # Start the Flask server
-        subprocess.run([
-            sys.executable,
-            'fast_chatbot_api.py'
-        ], check=True)
+        status = waiter.wait(process, ready_timeout)
+        if status is None:
+            if process.poll() is not None:
+                print(f"❌ Server failed to start (exit code {process.returncode})")
+                sys.exit(1)
+            print(f"⚠️ No readiness signal within {ready_timeout:g}s; the server is still starting")
+        else:
+            print(f"✅ Ready in {time.monotonic() - launched:.2f}s ({status})")
+            phases = waiter.phases()
+            if phases:
+                print("   " + ", ".join(f"{p['phase']} {p['seconds'] * 1000:.0f}ms" for p in phases))
+            # Started by systemd ourselves? Pass the signal on
+            sd_notify(f"READY=1\nSTATUS={status}")
+            threading.Thread(target=run_startup_tests, daemon=True).start()
+
+        process.wait()
+        if process.returncode:
+            print(f"❌ Server exited with code {process.returncode}")
+            sys.exit(1)
     except KeyboardInterrupt:
         print("\n🛑 Server stopped by user")
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Server failed to start: {e}")
-        sys.exit(1)
+        process.terminate()  # drains in-flight requests (lifecycle.py)
+        process.wait()
+    finally:
+        waiter.close()
 
 def health_check():
     """Perform health check on the running server"""
-    max_attempts = 30
-    attempt = 0
-
-    print("🔍 Waiting for server to start...")
+    try:
+        response = requests.get("http://localhost:5000/health", timeout=5)
+    except requests.RequestException as e:
+        print(f"❌ Server health check failed: {e}")
+        return False
 
-    while attempt < max_attempts:
-        try:
-            response = requests.get("http://localhost:5000/health", timeout=2)
-            if response.status_code == 200:
-                print("✅ Server is healthy and responding")
-                data = response.json()
-                print(f"   Status: {data.get('status')}")
-                print(f"   Uptime: {data.get('uptime', 'unknown')}")
-                return True
-        except requests.RequestException:
-            pass
-
-        attempt += 1
-        time.sleep(1)
-        print(f"   Attempt {attempt}/{max_attempts}...")
-
-    print("❌ Server health check failed")
-    return False
+    data = response.json()
+    if response.status_code == 200 and data.get('status') == 'healthy':
+        print("✅ Server is healthy and responding")
+    else:
+        print(f"⚠️ Server is up but reports: {data.get('status')} (is Ollama running?)")
+    print(f"   Status: {data.get('status')}")
+    print(f"   Uptime: {data.get('uptime_seconds', 'unknown')}")
+    return response.status_code == 200
 
 def test_webhook():
     """Test the Zoho webhook endpoint"""
@@ -188,9 +279,7 @@ def test_webhook():
         return False
 
 def run_startup_tests():
-    """Run all startup tests in background after server starts"""
-    time.sleep(3)  # Give server time to start
-
+    """Run the startup tests once the server has reported ready"""
     print("\n" + "="*50)
     print("🧪 RUNNING STARTUP TESTS")
     print("="*50)
@@ -214,32 +303,31 @@ def run_startup_tests():
 
 def main():
     """Main startup function"""
+    parser = argparse.ArgumentParser(description="Start the Personal AI Assistant API")
+    parser.add_argument("--dev", action="store_true", help="Flask debug server with reloader instead of gunicorn")
+    parser.add_argument("--install", action="store_true", help="pip install missing packages")
+    parser.add_argument("--ready-timeout", type=float, default=30.0, help="Seconds to wait for the ready signal")
+    args = parser.parse_args()
+
     print("🚀 PERSONAL AI ASSISTANT - SERVER STARTUP")
     print("="*50)
 
     # Pre-flight checks
     check_python_version()
-    check_dependencies()
+    check_dependencies(args.install)
 
     if not test_port_availability():
         print("⚠️ Port 5000 is in use. Attempting to continue anyway...")
 
-    if not check_ollama():
-        print("⚠️ Ollama issues detected. Server will start but AI responses may fail.")
-        response = input("Continue anyway? (y/N): ")
-        if response.lower() != 'y':
-            sys.exit(1)
+    # Ollama is only needed for answers, not to start: check it while the server boots
+    threading.Thread(target=check_ollama, daemon=True).start()
 
     print("\n" + "="*50)
     print("🎯 STARTING SERVER")
     print("="*50)
 
-    # Start health check in background
-    test_thread = threading.Thread(target=run_startup_tests, daemon=True)
-    test_thread.start()
-
     # Start the server (this will block)
-    start_server()
+    start_server(args.dev, args.ready_timeout)
 
 if __name__ == "__main__":
     main()
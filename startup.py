@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Startup
+Per-process initialization, phase timings and readiness signalling
+
+Importing fast_chatbot_api only does work that survives a fork: routes,
+configuration, restoring conversations. Anything that belongs to a single
+process (background threads, signal handlers, the journal writer) is
+registered with on_start() and run by start(), once per process:
+
+    gunicorn (gunicorn.conf.py)     post_worker_init calls start() in each worker;
+                                    with preload_app the master imports once and
+                                    the workers share that memory copy-on-write
+    python fast_chatbot_api.py      create_app() calls start()
+    anything else serving `app`     the first request calls start()
+
+Once a process can serve, mark_ready() reports it to whoever started it:
+
+    - systemd (Type=notify, NotifyAccess=all): READY=1 on $NOTIFY_SOCKET
+    - READY_FILE: written atomically with the pid and the phase timings
+
+and logs how long each startup phase took, so slow restarts show up in the
+journal with the phase to blame. Every path above calls it too (post_worker_init,
+create_app(), or the first request, since a process answering requests is
+serving), so GET /ready turns 200 wherever the app runs.
+
+Environment:
+    READY_FILE      file written when a process is ready to serve (optional)
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def sd_notify(message: str) -> bool:
+    """Send a state message to systemd's notify socket; False when not running under Type=notify"""
+    address = os.getenv("NOTIFY_SOCKET")
+    if not address or not hasattr(socket, "AF_UNIX"):
+        return False
+    if address.startswith("@"):
+        address = "\0" + address[1:]  # abstract namespace
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(message.encode())
+        return True
+    except OSError as e:
+        logger.warning("Could not notify systemd: %s", e)
+        return False
+
+
+class Startup:
+    """Startup phases, deferred per-process initialization and the ready signal"""
+
+    def __init__(self, ready_file: Optional[str] = None):
+        self.ready_file = ready_file
+        self.ready_at: Optional[float] = None
+        self.phases: List[Dict] = []
+        self._callbacks: List[tuple] = []
+        self._started = False
+        self._forked = False
+        self._lock = threading.Lock()
+        self._origin = time.monotonic()
+        self._checkpoint = self._origin
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    @classmethod
+    def from_env(cls) -> "Startup":
+        return cls(ready_file=os.getenv("READY_FILE", "").strip() or None)
+
+    def _after_fork(self):
+        # A preloaded worker: imported by the master, still to be started and readied here
+        self._started = False
+        self._forked = True
+        self.ready_at = None
+        self._lock = threading.Lock()
+        self._origin = self._checkpoint = time.monotonic()
+
+    # ------------------------------------------------------------------
+    # Phases
+    # ------------------------------------------------------------------
+
+    def _record(self, name: str, seconds: float):
+        self.phases.append({"phase": name, "seconds": round(seconds, 4), "pid": os.getpid()})
+
+    def checkpoint(self, name: str):
+        """Record the time since the previous checkpoint as phase `name`"""
+        now = time.monotonic()
+        self._record(name, now - self._checkpoint)
+        self._checkpoint = now
+
+    # ------------------------------------------------------------------
+    # Per-process initialization
+    # ------------------------------------------------------------------
+
+    def on_start(self, name: str, callback: Callable[[], None]):
+        """Register work that has to run in every serving process (not in a preloading master)"""
+        self._callbacks.append((name, callback))
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    @property
+    def forked(self) -> bool:
+        """Whether this process was forked after the app was imported (gunicorn preload)"""
+        return self._forked
+
+    def start(self):
+        """Run the on_start callbacks once in this process; cheap to call again"""
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            for name, callback in self._callbacks:
+                began = time.monotonic()
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error("Startup step %s failed: %s", name, e)
+                self._record(f"start:{name}", time.monotonic() - began)
+            self._checkpoint = time.monotonic()
+            self._started = True
+
+    # ------------------------------------------------------------------
+    # Readiness
+    # ------------------------------------------------------------------
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+
+    def mark_ready(self):
+        """Signal that this process is serving: systemd notify socket, READY_FILE and the log"""
+        if self.ready:
+            return
+        self.ready_at = time.time()
+        elapsed = time.monotonic() - self._origin
+        pid = os.getpid()
+        own = [phase for phase in self.phases if phase["pid"] == pid]
+
+        if self.ready_file:
+            self._write_ready_file(elapsed)
+        sd_notify(f"READY=1\nSTATUS=Serving (pid {pid} ready in {elapsed:.2f}s)")
+
+        logger.info("Ready to serve in %.3fs%s: %s", elapsed, " (forked from preloaded app)" if self._forked else "",
+                    ", ".join(f"{phase['phase']} {phase['seconds'] * 1000:.0f}ms" for phase in own))
+
+    def _write_ready_file(self, elapsed: float):
+        tmp_path = f"{self.ready_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"pid": os.getpid(), "t": self.ready_at, "startup_seconds": round(elapsed, 4),
+                           "forked": self._forked, "phases": self.phases}, f)
+            os.replace(tmp_path, self.ready_file)
+        except OSError as e:
+            logger.warning("Could not write ready file %s: %s", self.ready_file, e)
+
+    def get_stats(self) -> Dict:
+        """Summary for /stats"""
+        return {
+            "ready": self.ready,
+            "ready_at": self.ready_at,
+            "forked_from_preload": self._forked,
+            "phases": list(self.phases)
+        }
+
+
+# Imported first by the API so the import phase is timed from the start
+startup = Startup.from_env()
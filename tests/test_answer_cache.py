@@ -0,0 +1,42 @@
+"""Regression tests for the semantic answer cache (answer_cache.py)"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("numpy")
+
+from answer_cache import SemanticAnswerCache  # noqa: E402
+from embeddings import Embedder  # noqa: E402
+
+
+@pytest.fixture
+def hash_cache() -> SemanticAnswerCache:
+    return SemanticAnswerCache(Embedder(backend="hash"))
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("How do I unwind after a long day at work?", "How do I unwind after a long night at work?"),
+    ("How do I sort a list in ascending order?", "How do I sort a list in descending order?"),
+])
+def test_hash_backend_near_miss_is_not_a_hit(hash_cache, stored, asked):
+    hash_cache.store(stored, "cached answer", "phi3:mini", 1.0)
+    assert hash_cache.lookup(asked) is None
+    # ... and storing the other question adds an entry instead of reusing the first
+    hash_cache.store(asked, "other answer", "phi3:mini", 1.0)
+    assert hash_cache.get_stats()["entries"] == 2
+
+
+def test_hash_backend_hits_on_the_same_question(hash_cache):
+    hash_cache.store("How do I reset my password?", "Use the reset link.", "phi3:mini", 1.0)
+    hit = hash_cache.lookup("  how do I reset my PASSWORD ")
+    assert hit is not None and hit["answer"] == "Use the reset link."
+
+
+@pytest.mark.parametrize("threshold", [0.0, -0.5, 1.5, float("nan"), float("inf")])
+def test_invalid_threshold_is_rejected(threshold):
+    with pytest.raises(ValueError):
+        SemanticAnswerCache(Embedder(backend="hash"), threshold=threshold)
@@ -0,0 +1,73 @@
+"""Output budget tests for request deadlines (deadlines.py)"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import deadlines  # noqa: E402
+from deadlines import MIN_USEFUL_TOKENS, SAFETY_MARGIN, Deadline, ThroughputTracker  # noqa: E402
+from generation_scheduler import DeadlineExceeded  # noqa: E402
+
+NOW = 1_000_000.0
+MODEL = "phi3:mini"
+
+
+@pytest.fixture(autouse=True)
+def frozen_time(monkeypatch):
+    monkeypatch.setattr(deadlines.time, "time", lambda: NOW)
+    monkeypatch.setattr(Deadline, "ceiling", None)
+
+
+@pytest.fixture
+def tracker() -> ThroughputTracker:
+    tracker = ThroughputTracker()
+    # 50 output tokens/s, 1000 prompt tokens/s
+    tracker.record(MODEL, {"eval_count": 500, "eval_duration": 10e9,
+                           "prompt_eval_count": 1000, "prompt_eval_duration": 1e9})
+    return tracker
+
+
+def in_seconds(seconds: float) -> Deadline:
+    return Deadline(NOW + seconds, "header")
+
+
+def test_budget_is_capped_to_what_fits(tracker):
+    # 10s usable, 2s of it spent on the prompt: 8s * 50 tokens/s
+    capped = tracker.cap_num_predict(MODEL, 1000, 2000, in_seconds(10 + SAFETY_MARGIN))
+    assert capped == 400
+    assert tracker.stats["capped"] == 1 and tracker.stats["tokens_trimmed"] == 600
+
+
+def test_budget_that_fits_is_left_alone(tracker):
+    assert tracker.cap_num_predict(MODEL, 200, 2000, in_seconds(10 + SAFETY_MARGIN)) == 200
+    assert tracker.stats["capped"] == 0
+
+
+def test_request_is_dropped_when_too_little_fits(tracker):
+    seconds = (MIN_USEFUL_TOKENS - 1) / 50
+    with pytest.raises(DeadlineExceeded):
+        tracker.cap_num_predict(MODEL, 1000, 0, in_seconds(seconds + SAFETY_MARGIN))
+    assert tracker.stats["dropped_before_start"] == 1
+
+
+def test_prompt_time_alone_can_exhaust_the_deadline(tracker):
+    with pytest.raises(DeadlineExceeded):
+        tracker.cap_num_predict(MODEL, 1000, 5000, in_seconds(4 + SAFETY_MARGIN))
+
+
+def test_expired_deadline_is_dropped_even_without_a_rate():
+    with pytest.raises(DeadlineExceeded):
+        ThroughputTracker().cap_num_predict(MODEL, 1000, 0, in_seconds(SAFETY_MARGIN / 2))
+
+
+def test_unmeasured_model_or_no_deadline_keeps_the_budget(tracker):
+    assert ThroughputTracker().cap_num_predict(MODEL, 1000, 2000, in_seconds(2 + SAFETY_MARGIN)) == 1000
+    assert tracker.cap_num_predict(MODEL, 1000, 2000, Deadline(None)) == 1000
+
+
+def test_rates_are_smoothed(tracker):
+    tracker.record(MODEL, {"eval_count": 100, "eval_duration": 1e9})
+    assert tracker.get_stats()["measured_rates"][MODEL]["eval_tps"] == pytest.approx(0.8 * 50 + 0.2 * 100)
@@ -0,0 +1,82 @@
+"""Fairness and deadline tests for the generation dispatcher (generation_scheduler.py)"""
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generation_scheduler import DeadlineExceeded, GenerationDispatcher  # noqa: E402
+
+
+def grant_order(dispatcher, running, tickets):
+    """Release `running`, then each ticket as it is granted; returns the sessions in grant order"""
+    order = []
+    pending = list(tickets)
+    current = running
+    while pending:
+        dispatcher._release(current)
+        granted = [t for t in pending if t.granted_at]
+        assert len(granted) == 1
+        current = granted[0]
+        pending.remove(current)
+        order.append(current.session_id)
+    dispatcher._release(current)
+    return order
+
+
+def test_busy_session_does_not_starve_a_new_one():
+    dispatcher = GenerationDispatcher(max_concurrent=1, quantum=1000)
+    running = dispatcher._enqueue("busy", 1000, "default")
+    assert running.granted_at
+
+    queued = [dispatcher._enqueue("busy", 1000, "default") for _ in range(4)]
+    queued.append(dispatcher._enqueue("visitor", 1000, "default"))
+
+    # One quantum-sized request per session per round: the visitor is served second, not last
+    assert grant_order(dispatcher, running, queued) == ["busy", "visitor", "busy", "busy", "busy"]
+    assert dispatcher.get_stats()["dispatched"] == 6
+
+
+def test_class_weight_scales_the_share():
+    dispatcher = GenerationDispatcher(max_concurrent=1, quantum=1000,
+                                      weights={"default": 1.0, "zoho": 2.0})
+    running = dispatcher._enqueue("hold", 1, "default")
+    queued = [dispatcher._enqueue("plain", 1000, "default") for _ in range(3)]
+    queued += [dispatcher._enqueue("webhook", 1000, "zoho") for _ in range(4)]
+
+    order = grant_order(dispatcher, running, queued)
+    assert order[:6] == ["plain", "webhook", "webhook", "plain", "webhook", "webhook"]
+
+
+def test_queued_request_raises_when_its_deadline_passes():
+    dispatcher = GenerationDispatcher(max_concurrent=1)
+    running = dispatcher._enqueue("hold", 100, "default")
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        with dispatcher.slot("late", 100, deadline=time.time() + 0.05):
+            pytest.fail("slot granted while another request holds the only one")
+    assert time.monotonic() - started < 1.0
+
+    stats = dispatcher.get_stats()
+    assert stats["expired"] == 1 and stats["cancelled"] == 0
+    assert dispatcher.queue_depth() == 0
+    dispatcher._release(running)
+
+
+def test_expired_head_is_skipped_without_a_slot():
+    dispatcher = GenerationDispatcher(max_concurrent=1)
+    running = dispatcher._enqueue("hold", 100, "default")
+    stale = dispatcher._enqueue("gone", 100, "default", deadline=time.time() - 1)
+    waiting = dispatcher._enqueue("waiting", 100, "default")
+
+    dispatcher._release(running)
+
+    assert stale.expired and not stale.granted_at and stale.event.is_set()
+    assert waiting.granted_at
+    assert dispatcher.get_stats()["expired"] == 1
+    dispatcher._release(waiting)
+    assert dispatcher.get_stats()["in_flight"] == 0
@@ -0,0 +1,46 @@
+"""Tests for the metrics ring buffer (metrics_history.py)"""
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics_history import MetricsHistory  # noqa: E402
+
+
+@pytest.fixture
+def history() -> MetricsHistory:
+    metrics = MetricsHistory(resolution=10, window=600)
+    metrics.record_sample(queue_depth=3, requests=5, failures=1)
+    metrics.record_generation("phi3:mini", {"eval_count": 50, "eval_duration": 2e9, "total_duration": 3e9})
+    return metrics
+
+
+@pytest.mark.parametrize("step", [None, 10, 60, 600, 10 ** 9, 10 ** 10])
+def test_history_stays_inside_the_window(history, step):
+    started = time.monotonic()
+    result = history.history(step=step)
+    assert time.monotonic() - started < 0.5
+
+    now = time.time()
+    assert result["step_seconds"] <= result["window_seconds"]
+    assert 1 <= len(result["points"]) <= history.slots + 1
+    for point in result["points"]:
+        assert now - result["window_seconds"] - history.resolution <= point["t"] <= now
+
+
+def test_history_keeps_recorded_totals(history):
+    points = history.history(minutes=10, step=600)["points"]
+    assert sum(p["requests"] for p in points) == 5
+    assert sum(p["failures"] for p in points) == 1
+    assert sum(p["tokens"] for p in points) == 50
+    assert max(p["queue_depth"]["max"] for p in points) == 3
+
+
+def test_history_minutes_limits_the_points(history):
+    assert len(history.history(minutes=1)["points"]) <= 7
+    assert len(history.history(minutes=10 ** 6)["points"]) <= history.slots + 1
+    assert len(history.history(minutes=1e308)["points"]) <= history.slots + 1
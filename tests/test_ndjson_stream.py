@@ -0,0 +1,80 @@
+"""Chunk-boundary tests for the NDJSON passthrough scanner (ndjson_stream.py)"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ndjson_stream import NDJSONScanner, ndjson_line  # noqa: E402
+
+TOKENS = ["Hello", ", ", "wörld", " \"quoted\"", "\n", 'tricky ","done":false', " 🙂", ""]
+
+
+def ollama_line(payload) -> bytes:
+    # Ollama's own encoding: default separators are compact, non-ASCII kept as-is
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode() + b"\n"
+
+
+def stream():
+    lines = [ollama_line({"model": "phi3:mini", "created_at": "2024-01-01T00:00:00Z", "response": token,
+                          "done": False}) for token in TOKENS]
+    # A line in a different key order takes the json.loads path
+    lines.append(ollama_line({"done": False, "response": " slow", "model": "phi3:mini"}))
+    final = ollama_line({"model": "phi3:mini", "response": "", "done": True, "context": [1, 2, 3],
+                         "eval_count": 9, "eval_duration": 1000})
+    return lines, final
+
+
+def scan(data: bytes, sizes) -> tuple:
+    scanner = NDJSONScanner()
+    forwarded = b""
+    offset = 0
+    for size in sizes:
+        forwarded += scanner.feed(data[offset:offset + size])
+        offset += size
+    forwarded += scanner.feed(data[offset:])
+    return scanner, forwarded
+
+
+def check(scanner, forwarded, lines):
+    assert forwarded == b"".join(lines)
+    assert scanner.text() == "".join(TOKENS) + " slow"
+    assert scanner.last_chunk() == " slow"
+    assert scanner.final["done"] is True and scanner.final["eval_count"] == 9
+    assert scanner.slow_lines == 1
+
+
+def test_whole_stream_in_one_read():
+    lines, final = stream()
+    check(*scan(b"".join(lines) + final, []), lines)
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_lines_split_across_reads(size):
+    lines, final = stream()
+    data = b"".join(lines) + final
+    check(*scan(data, [size] * (len(data) // size)), lines)
+
+
+def test_every_single_split_point():
+    lines, final = stream()
+    data = b"".join(lines) + final
+    for cut in range(1, len(data)):
+        check(*scan(data, [cut]), lines)
+
+
+def test_nothing_after_the_final_line_is_forwarded():
+    lines, final = stream()
+    scanner, forwarded = scan(b"".join(lines) + final + ollama_line({"response": "late", "done": False}), [])
+    assert forwarded == b"".join(lines)
+    assert "late" not in scanner.text()
+
+
+def test_ndjson_line_round_trips():
+    payload = {"done": True, "session_id": "abc", "truncated": False}
+    line = ndjson_line(payload)
+    assert line.endswith(b"\n") and line.count(b"\n") == 1
+    assert json.loads(line) == payload
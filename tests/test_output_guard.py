@@ -0,0 +1,54 @@
+"""Regression tests for the streaming output guard (output_guard.py)"""
+
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from output_guard import OutputGuard  # noqa: E402
+
+
+def stream(text: str) -> OutputGuard:
+    """Feed text the way Ollama streams it: one word (with its whitespace) per token"""
+    guard = OutputGuard()
+    for token in re.findall(r"\s*\S+", text):
+        guard.feed(token)
+    guard.flush()
+    return guard
+
+
+def test_markdown_table_separator_is_not_a_loop():
+    tables = "\n".join(
+        f"| {name} | Size | Type | Owner | Date |\n"
+        "| --- | --- | --- | --- | --- |\n"
+        f"| {name}.txt | 1 | file | me | today |\n"
+        for name in ("notes", "draft", "final")
+    )
+    guard = stream(tables + "\nThat's all of them.")
+    assert guard.stop_reason is None
+    assert guard.text.endswith("That's all of them.")
+
+
+def test_numeric_run_is_not_a_loop():
+    guard = stream("The initial state vector is 0 0 0 0 0 0 0 0 0 0 and it stays that way.")
+    assert guard.stop_reason is None
+
+
+def test_short_repeated_phrase_is_not_a_loop():
+    guard = stream("The directions are: go left, go left, go left, go left, go left, then stop.")
+    assert guard.stop_reason is None
+    assert guard.text.endswith("then stop.")
+
+
+def test_genuine_loop_is_still_aborted():
+    guard = stream("Sure! " + "go left, " * 40)
+    assert guard.stop_reason == "repetition"
+    assert guard.text == "Sure! go left,"
+
+
+def test_repeated_sentence_loop_is_still_aborted():
+    sentence = "I am happy to help you with that question today. "
+    guard = stream("Hello. " + sentence * 4)
+    assert guard.stop_reason in ("repetition", "sentence_loop")
+    assert guard.text.startswith("Hello. I am happy")
@@ -0,0 +1,82 @@
+"""Token bucket burst and refill tests for the rate limiter (rate_limiter.py)"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rate_limiter  # noqa: E402
+from rate_limiter import RateLimiter  # noqa: E402
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "time", clock)
+    return clock
+
+
+def make_limiter(tmp_path, **rules) -> RateLimiter:
+    defaults = {"ip": (1000.0, 100.0), "session": (1000.0, 100.0), "route": (1000.0, 100.0)}
+    return RateLimiter(str(tmp_path / "ratelimit.db"), rules={**defaults, **rules},
+                       costs={"generation": 10.0, "cheap": 1.0})
+
+
+def test_burst_up_to_capacity_then_reject(tmp_path, clock):
+    limiter = make_limiter(tmp_path, ip=(30.0, 1.0))
+
+    assert [limiter.check("10.0.0.1", None, "/chat")[0] for _ in range(4)] == [True, True, True, False]
+    allowed, retry_after, rule = limiter.check("10.0.0.1", None, "/chat")
+    assert not allowed and rule == "ip"
+    assert retry_after == pytest.approx(10.0)
+
+    # Another client has its own bucket
+    assert limiter.check("10.0.0.2", None, "/chat")[0]
+    assert limiter.get_stats()["worker"] == {"allowed": 4, "rejected": 2, "store_errors": 0}
+
+
+def test_refill_is_proportional_to_elapsed_time(tmp_path, clock):
+    limiter = make_limiter(tmp_path, session=(20.0, 2.0))
+    assert limiter.check(None, "s1", "/chat")[0]
+    assert limiter.check(None, "s1", "/chat")[0]
+    assert not limiter.check(None, "s1", "/chat")[0]
+
+    clock.now += 4.0  # 8 tokens: still short of one generation
+    allowed, retry_after, _ = limiter.check(None, "s1", "/chat")
+    assert not allowed and retry_after == pytest.approx(1.0)
+
+    clock.now += 1.0
+    assert limiter.check(None, "s1", "/chat")[0]
+    assert not limiter.check(None, "s1", "/chat")[0]
+
+
+def test_refill_never_exceeds_capacity(tmp_path, clock):
+    limiter = make_limiter(tmp_path, ip=(20.0, 1.0))
+    assert limiter.check("10.0.0.1", None, "/chat")[0]
+
+    clock.now += 3600.0
+    assert [limiter.check("10.0.0.1", None, "/chat")[0] for _ in range(3)] == [True, True, False]
+
+
+def test_rejection_debits_no_bucket(tmp_path, clock):
+    # The session bucket is empty, so the IP bucket must not be charged for the rejected request
+    limiter = make_limiter(tmp_path, ip=(20.0, 0.0), session=(10.0, 0.0))
+    assert limiter.check("10.0.0.1", "s1", "/chat")[0]
+    assert not limiter.check("10.0.0.1", "s1", "/chat")[0]
+    assert limiter.check("10.0.0.1", "s2", "/chat")[0]
+
+
+def test_cheap_requests_cost_less(tmp_path, clock):
+    limiter = make_limiter(tmp_path, ip=(10.0, 0.0))
+    assert all(limiter.check("10.0.0.1", None, "/stats", "cheap")[0] for _ in range(10))
+    assert not limiter.check("10.0.0.1", None, "/stats", "cheap")[0]
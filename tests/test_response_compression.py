@@ -0,0 +1,85 @@
+"""Streaming and negotiation tests for response compression (response_compression.py)"""
+
+import gzip
+import json
+import os
+import sys
+import zlib
+
+import pytest
+from flask import Flask, Response, request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from response_compression import WBITS, ResponseCompressor, negotiate  # noqa: E402
+
+app = Flask(__name__)
+
+
+def sse_events(count: int):
+    return [f"data: {json.dumps({'token': f'word{i} ', 'done': False})}\n\n".encode() for i in range(count)]
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "deflate"])
+def test_each_event_decodes_as_soon_as_it_is_sent(encoding):
+    events = sse_events(20)
+    closed = []
+
+    class Events:
+        def __iter__(self):
+            return iter(events)
+
+        def close(self):
+            closed.append(True)
+
+    compressor = ResponseCompressor()
+    with app.test_request_context(headers={"Accept-Encoding": encoding}):
+        response = compressor.compress(request, Response(Events(), mimetype="text/event-stream"))
+
+    assert response.headers["Content-Encoding"] == encoding
+    decoder = zlib.decompressobj(WBITS[encoding])
+    received = b""
+    for i, chunk in enumerate(response.response):
+        received += decoder.decompress(chunk)
+        if i < len(events):
+            # Everything sent so far is decodable without waiting for the end of the stream
+            assert received == b"".join(events[:i + 1])
+    received += decoder.flush()
+
+    assert received == b"".join(events) and decoder.eof
+    assert closed == [True]
+    stats = compressor.get_stats()["stream"]
+    assert stats["flushes"] == len(events) and stats["ratio"] > 1
+
+
+def test_gzip_stream_is_a_valid_gzip_file():
+    events = sse_events(5)
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = ResponseCompressor().compress(request, Response(iter(events), mimetype="text/event-stream"))
+    assert gzip.decompress(b"".join(response.response)) == b"".join(events)
+
+
+def test_plain_body_compressed_only_above_min_size():
+    compressor = ResponseCompressor(min_size=100)
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        small = compressor.compress(request, Response('{"ok":true}', mimetype="application/json"))
+        body = json.dumps({"answer": "x " * 500})
+        large = compressor.compress(request, Response(body, mimetype="application/json"))
+
+    assert "Content-Encoding" not in small.headers and small.get_data() == b'{"ok":true}'
+    assert large.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(large.get_data()).decode() == body
+    assert "Accept-Encoding" in large.headers["Vary"]
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, deflate, br", "gzip"),
+    ("deflate;q=1.0, gzip;q=0.5", "deflate"),
+    ("gzip;q=0, deflate;q=0", None),
+    ("*;q=0.3", "gzip"),
+    ("br, identity", None),
+    ("gzip;q=abc, deflate", "deflate"),
+    ("", None),
+])
+def test_negotiate(header, expected):
+    assert negotiate(header) == expected
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Traffic Capture
+Opt-in, anonymized log of request timing and shape for offline replay
+
+When TRAFFIC_CAPTURE_FILE is set, every /chat, /chat/stream, /chat/continue
+and Zoho webhook request appends one JSON line describing its shape, never
+its content:
+
+    t   arrival time (epoch seconds)        r   route
+    s   session (keyed hash, stable)        h   history depth at arrival
+    m   message length (chars)              p   prompt length (chars)
+    o   answer length (chars)               n   generated tokens
+    st  HTTP status or stream outcome       ms  latency until the response ended
+    tier, model, cached, truncated          when known
+
+Session IDs are hashed with TRAFFIC_CAPTURE_SALT (random per process when
+unset, so captures from different runs can't be joined). Lines are written
+by a background thread with one O_APPEND write per batch, so gunicorn
+workers can share a file. replay_traffic.py turns a capture back into load.
+
+Environment:
+    TRAFFIC_CAPTURE_FILE     path of the capture log (unset: disabled)
+    TRAFFIC_CAPTURE_SALT     key for session hashing
+    TRAFFIC_CAPTURE_SAMPLE   fraction of sessions captured (default 1.0)
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_PENDING = 10000
+MAX_BATCH_LINES = 256
+
+
+class TrafficRecorder:
+    """Collects per-request shape records and appends them to the capture log"""
+
+    def __init__(self, path: Optional[str] = None, salt: Optional[str] = None, sample: float = 1.0):
+        self.path = path
+        self.enabled = bool(path)
+        self.sample = min(max(sample, 0.0), 1.0)
+        self._key = (salt or os.urandom(16).hex()).encode()
+        self._queue: "queue.Queue" = queue.Queue(maxsize=MAX_PENDING)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.stats = {"captured": 0, "written": 0, "dropped": 0, "write_errors": 0}
+
+    @classmethod
+    def from_env(cls) -> "TrafficRecorder":
+        return cls(
+            path=os.getenv("TRAFFIC_CAPTURE_FILE") or None,
+            salt=os.getenv("TRAFFIC_CAPTURE_SALT") or None,
+            sample=float(os.getenv("TRAFFIC_CAPTURE_SAMPLE", "1.0"))
+        )
+
+    def anonymize(self, session_id: str) -> str:
+        return hmac.new(self._key, session_id.encode(), hashlib.sha256).hexdigest()[:12]
+
+    def start(self, route: str, session_id: Optional[str]) -> Optional[Dict]:
+        """A new record for an arriving request, or None when not captured"""
+        if not self.enabled:
+            return None
+        session = self.anonymize(session_id) if session_id else None
+        if session and self.sample < 1.0 and int(session[:8], 16) / 0xFFFFFFFF >= self.sample:
+            return None
+        return {"t": round(time.time(), 3), "r": route, "s": session, "_started": time.perf_counter()}
+
+    @staticmethod
+    def note(entry: Optional[Dict], **fields):
+        """Add fields to a record (no-op for uncaptured requests)"""
+        if entry is not None:
+            entry.update({k: v for k, v in fields.items() if v is not None})
+
+    def finish(self, entry: Optional[Dict], status=None):
+        """Close a record and hand it to the writer; safe to call more than once"""
+        if entry is None or "_started" not in entry:
+            return
+        entry["ms"] = round((time.perf_counter() - entry.pop("_started")) * 1000, 1)
+        entry.setdefault("st", status)
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(json.dumps(entry, separators=(",", ":")))
+            self.stats["captured"] += 1
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def _ensure_writer(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            lines = [self._queue.get()]
+            try:
+                while len(lines) < MAX_BATCH_LINES:
+                    lines.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            self._write(lines)
+            for _ in lines:
+                self._queue.task_done()
+
+    def _write(self, lines):
+        data = ("\n".join(lines) + "\n").encode()
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            self.stats["written"] += len(lines)
+        except OSError as e:
+            self.stats["write_errors"] += 1
+            logger.warning("Traffic capture write failed: %s", e)
+
+    def flush(self, timeout: float = 2.0):
+        """Wait briefly for queued records to reach the file"""
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def get_stats(self) -> Dict:
+        """Summary for /stats"""
+        return {
+            "enabled": self.enabled,
+            "file": self.path,
+            "sample": self.sample,
+            "pending": self._queue.qsize(),
+            **self.stats
+        }
+
+
+# Shared by the API and the Zoho webhook blueprint
+traffic = TrafficRecorder.from_env()
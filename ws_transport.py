@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+WebSocket Transport
+Chat turns, token streams, cancellation and pushed health/stats over one connection
+
+index.html normally pays one HTTP request per message plus periodic /health
+and /stats polls. With flask-sock installed, /ws carries all of it over a
+single long-lived connection per browser. Every frame is a JSON object.
+
+Client to server:
+    {"type": "chat", "id": "t1", "message": "...", "model": "..."}   start a turn
+    {"type": "cancel", "id": "t1"}                                    stop a turn
+    {"type": "subscribe", "topics": ["health", "stats"]}              pushed updates
+    {"type": "ping"}
+
+Server to client:
+    {"type": "hello", "session_id": ..., "max_turns": ..., "topics": [...]}
+    {"type": "event", "id": "t1", "status": "queued" | "prompt_eval" |
+        "streaming" | "complete" | "error", ...}   same fields as the SSE events
+    {"type": "end", "id": "t1"}                    the turn is over, id reusable
+    {"type": "health", ...} / {"type": "stats", ...}
+    {"type": "draining"}                           reconnect elsewhere when idle
+    {"type": "error", "error": ...}                protocol errors
+    {"type": "pong"}
+
+Several turns may be in flight at once, up to WS_MAX_TURNS per connection;
+each runs on its own thread and is tagged with its id. Health and stats are
+computed once per WS_PUSH_INTERVAL for all subscribers, not per connection;
+snapshot functions run on the push thread, so they must only read state.
+
+Each open connection holds one gunicorn thread for its lifetime, so size
+GUNICORN_THREADS with that in mind. When the worker drains, every connection
+is told so and closed as soon as its turns have finished.
+
+Environment:
+    WS_ENABLED          true/false (default true; needs flask-sock)
+    WS_MAX_TURNS        turns in flight per connection (default 4)
+    WS_PUSH_INTERVAL    seconds between health/stats pushes (default 10)
+"""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional, Set
+
+from flask import copy_current_request_context, request
+
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+except ImportError:
+    Sock = None
+    ConnectionClosed = OSError
+
+logger = logging.getLogger(__name__)
+
+# How often an idle connection loop wakes up to notice a drain
+RECEIVE_POLL_SECONDS = 1.0
+
+MAX_FRAME_BYTES = 64 * 1024
+
+
+class Connection:
+    """One client socket: serialized sends plus the turns it has in flight"""
+
+    def __init__(self, ws, session_id: str):
+        self.ws = ws
+        self.session_id = session_id
+        self.topics: Set[str] = set()
+        self.turns: Dict[str, threading.Event] = {}
+        self.closed = False
+        self._send_lock = threading.Lock()
+
+    def send(self, payload: Dict) -> bool:
+        """Send one frame; False once the client is gone"""
+        if self.closed:
+            return False
+        data = json.dumps(payload)
+        try:
+            with self._send_lock:
+                self.ws.send(data)
+            return True
+        except (ConnectionClosed, OSError):
+            self.closed = True
+            return False
+
+
+class WebSocketTransport:
+    """Serves /ws: multiplexed chat turns and pushed health/stats updates"""
+
+    def __init__(self, enabled: bool = True, max_turns: int = 4, push_interval: float = 10.0):
+        self.enabled = enabled and Sock is not None
+        self.max_turns = max_turns
+        self.push_interval = push_interval
+        self.draining = False
+        self._connections: Set[Connection] = set()
+        self._lock = threading.Lock()
+        self._run_turn: Optional[Callable] = None
+        self._snapshots: Dict[str, Callable[[], Dict]] = {}
+        self._pusher: Optional[threading.Thread] = None
+        self.stats = {
+            "connections_total": 0,
+            "turns_started": 0,
+            "turns_cancelled": 0,
+            "turns_rejected": 0,
+            "frames_in": 0,
+            "frames_out": 0,
+            "pushes": 0,
+            "protocol_errors": 0
+        }
+
+    @classmethod
+    def from_env(cls) -> "WebSocketTransport":
+        return cls(
+            enabled=os.getenv("WS_ENABLED", "true").lower() == "true",
+            max_turns=int(os.getenv("WS_MAX_TURNS", "4")),
+            push_interval=float(os.getenv("WS_PUSH_INTERVAL", "10"))
+        )
+
+    def register(self, app, run_turn: Callable, snapshots: Dict[str, Callable[[], Dict]]) -> bool:
+        """Serve /ws on `app`; False when disabled or flask-sock isn't installed
+
+        run_turn(data, send, cancelled) runs one chat turn inside the
+        upgrade request's context, sending event dicts through send(); it
+        applies the same checks as the HTTP route it stands in for.
+        snapshots maps topic names to read-only functions producing pushed
+        updates.
+        """
+        if not self.enabled:
+            return False
+        self._run_turn = run_turn
+        self._snapshots = snapshots
+        app.config.setdefault("SOCK_SERVER_OPTIONS", {"ping_interval": 25, "max_message_size": MAX_FRAME_BYTES})
+        Sock(app).route("/ws")(self._serve)
+        return True
+
+    # ------------------------------------------------------------------
+    # Connection loop
+    # ------------------------------------------------------------------
+
+    def _serve(self, ws):
+        session_id = request.args.get("session_id") or f"ws_{uuid.uuid4().hex[:16]}"
+        conn = Connection(ws, session_id)
+        if self.draining:
+            conn.send({"type": "draining"})
+            return
+
+        with self._lock:
+            self._connections.add(conn)
+            self.stats["connections_total"] += 1
+        self._ensure_pusher()
+        self._send(conn, {"type": "hello", "session_id": session_id, "max_turns": self.max_turns,
+                          "topics": sorted(self._snapshots)})
+
+        try:
+            while not conn.closed:
+                if self.draining and not conn.turns:
+                    break
+                try:
+                    raw = ws.receive(timeout=RECEIVE_POLL_SECONDS)
+                except ConnectionClosed:
+                    break
+                if raw is None:
+                    continue
+                self.stats["frames_in"] += 1
+                self._handle(conn, raw)
+        finally:
+            conn.closed = True
+            for cancelled in list(conn.turns.values()):
+                cancelled.set()
+            with self._lock:
+                self._connections.discard(conn)
+
+    def _handle(self, conn: Connection, raw):
+        try:
+            message = json.loads(raw)
+            kind = message.get("type")
+        except (ValueError, AttributeError):
+            self.stats["protocol_errors"] += 1
+            self._send(conn, {"type": "error", "error": "Frames must be JSON objects"})
+            return
+
+        if kind == "chat":
+            self._start_turn(conn, message)
+        elif kind == "cancel":
+            cancelled = conn.turns.get(str(message.get("id")))
+            if cancelled:
+                cancelled.set()
+                self.stats["turns_cancelled"] += 1
+        elif kind == "subscribe":
+            topics = set(message.get("topics") or []) & set(self._snapshots)
+            conn.topics = topics
+            for topic in topics:
+                self._send(conn, {"type": topic, **self._snapshot(topic)})
+        elif kind == "ping":
+            self._send(conn, {"type": "pong"})
+        else:
+            self.stats["protocol_errors"] += 1
+            self._send(conn, {"type": "error", "error": f"Unknown frame type: {kind}"})
+
+    def _start_turn(self, conn: Connection, message: Dict):
+        turn_id = str(message.get("id") or "")
+        if not turn_id or turn_id in conn.turns:
+            self.stats["protocol_errors"] += 1
+            self._send(conn, {"type": "error", "id": turn_id or None,
+                              "error": "Each chat frame needs an id not already in flight"})
+            return
+        if len(conn.turns) >= self.max_turns or self.draining:
+            self.stats["turns_rejected"] += 1
+            self._send(conn, {"type": "event", "id": turn_id, "status": "error", "retryable": True,
+                              "error": "Server is restarting, please retry" if self.draining
+                              else f"At most {self.max_turns} messages in flight per connection"})
+            self._send(conn, {"type": "end", "id": turn_id})
+            return
+
+        cancelled = threading.Event()
+        conn.turns[turn_id] = cancelled
+        self.stats["turns_started"] += 1
+        message.setdefault("session_id", conn.session_id)
+
+        def send(event: Dict):
+            self._send(conn, {"type": "event", "id": turn_id, **event})
+
+        @copy_current_request_context
+        def run():
+            try:
+                self._run_turn(message, send, cancelled)
+            except Exception as e:
+                logger.error("WebSocket turn failed: %s", e)
+                send({"status": "error", "error": "Internal server error"})
+            finally:
+                conn.turns.pop(turn_id, None)
+                self._send(conn, {"type": "end", "id": turn_id})
+
+        # Keep the connection's log context (request and session IDs) on the turn's records
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(run,), name="ws-turn", daemon=True).start()
+
+    def _send(self, conn: Connection, payload: Dict):
+        if conn.send(payload):
+            self.stats["frames_out"] += 1
+
+    # ------------------------------------------------------------------
+    # Pushed updates
+    # ------------------------------------------------------------------
+
+    def _snapshot(self, topic: str) -> Dict:
+        try:
+            return self._snapshots[topic]()
+        except Exception as e:
+            logger.warning("WebSocket %s snapshot failed: %s", topic, e)
+            return {"error": str(e)}
+
+    def _ensure_pusher(self):
+        if self._pusher is None and self._snapshots and self.push_interval > 0:
+            with self._lock:
+                if self._pusher is None:
+                    self._pusher = threading.Thread(target=self._push_loop, name="ws-push", daemon=True)
+                    self._pusher.start()
+
+    def _push_loop(self):
+        while True:
+            time.sleep(self.push_interval)
+            with self._lock:
+                connections = list(self._connections)
+            for topic in self._snapshots:
+                subscribers = [conn for conn in connections if topic in conn.topics]
+                if not subscribers:
+                    continue
+                frame = {"type": topic, **self._snapshot(topic)}
+                for conn in subscribers:
+                    self._send(conn, frame)
+                self.stats["pushes"] += 1
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def drain(self, drain_deadline: Optional[float] = None):
+        """Refuse new turns, tell clients to reconnect, close each connection once its turns end"""
+        self.draining = True
+        with self._lock:
+            connections = list(self._connections)
+        for conn in connections:
+            self._send(conn, {"type": "draining"})
+
+    def get_stats(self) -> Dict:
+        """Summary for /stats"""
+        with self._lock:
+            connections = list(self._connections)
+        return {
+            "enabled": self.enabled,
+            "available": Sock is not None,
+            "connections": len(connections),
+            "turns_in_flight": sum(len(conn.turns) for conn in connections),
+            "subscribers": {topic: sum(1 for conn in connections if topic in conn.topics)
+                            for topic in self._snapshots},
+            **self.stats
+        }
+
+
+# Registered on the API app when flask-sock is installed
+ws_transport = WebSocketTransport.from_env()
@@ -4,22 +4,29 @@ Zoho SalesIQ Webhook Handler
 Handles incoming webhook requests from Zoho SalesIQ and routes them to the LLM API
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, request, jsonify, g
 import requests
 import json
 import logging
+import time
 from datetime import datetime
 import os
+from typing import Optional, Union
+
+from rate_limiter import rate_limited
+from generation_scheduler import DeadlineExceeded, dispatcher, estimate_cost
+from deadlines import Deadline, throughput
+from answer_cache import answer_cache
+from model_residency import residency
+from traffic_capture import traffic
+from runtime_config import settings
+from log_pipeline import configure_logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+zoho_bp = Blueprint('zoho', __name__)
 
-# Configuration
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
-MODEL_NAME = "phi3"  # or "mistral" depending on your setup
+# Configuration (Ollama URL, model and the "webhook" generation profile come from runtime_config)
 MAX_CONTEXT_LENGTH = 4000
 CONVERSATION_MEMORY = {}  # Store conversation history by visitor ID
 
@@ -72,26 +79,134 @@ Keep your responses conversational and engaging."""
 
     return conversation_text
 
-def call_ollama_api(prompt):
+def call_ollama_api(prompt, num_predict=None, timeout=None):
     """Call Ollama API with the prompt"""
+    config = settings()
+    model = config.model_for("webhook")
     try:
+        options = config.generation_options("webhook")
+        if num_predict:
+            options["num_predict"] = num_predict
+
         payload = {
-            "model": MODEL_NAME,
+            "model": model,
             "prompt": prompt,
             "stream": False,
-            "options": {
-                "temperature": 0.7,
-                "max_tokens": 500,
-                "top_p": 0.9
-            }
+            "options": options,
+            **config.request_params("webhook")
         }
 
         response = requests.post(
-            OLLAMA_API_URL,
+            f"{config.ollama_base_url}/api/generate",
             json=payload,
-            timeout=30
+            timeout=timeout or config.webhook_timeout
         )
 
         if response.status_code == 200:
             result = response.json()
-            return result.
+            throughput.record(model, result)
+            return result.get("response", "").strip(), True
+        else:
+            logger.error("Ollama API error: %s - %s", response.status_code, response.text)
+            return "Sorry, I'm experiencing technical difficulties. Please try again in a moment.", False
+
+    except requests.exceptions.Timeout:
+        logger.error("Ollama request timed out")
+        return "I'm taking longer than usual to respond. Please try again.", False
+    except requests.RequestException as e:
+        logger.error("Request to Ollama failed: %s", e)
+        return "Sorry, I'm currently unavailable. Please try again later.", False
+
+def visitor_id_of(req) -> Optional[Union[str, int]]:
+    """visitor.id from a webhook body, or None when the body doesn't have that shape
+
+    Used by hooks that run before zoho_webhook validates the payload, so it
+    must not assume the body or visitor are objects.
+    """
+    body = req.get_json(silent=True)
+    visitor = body.get('visitor') if isinstance(body, dict) else None
+    visitor_id = visitor.get('id') if isinstance(visitor, dict) else None
+    if isinstance(visitor_id, bool) or not isinstance(visitor_id, (str, int)) or visitor_id == "":
+        return None
+    return visitor_id
+
+@zoho_bp.route('/webhook/zoho', methods=['POST'])
+@rate_limited('/webhook/zoho', per_ip=False, session_key=visitor_id_of)
+def zoho_webhook():
+    """Webhook endpoint for Zoho SalesIQ integration"""
+    try:
+        data = request.get_json(silent=True) or {}
+
+        # Extract message and visitor from Zoho payload
+        message = data.get('message') if isinstance(data, dict) else None
+        text = message.get('text') if isinstance(message, dict) else None
+        message = text.strip() if isinstance(text, str) else ''
+        visitor_id = visitor_id_of(request) or 'zoho_default'
+
+        if not message:
+            return jsonify({'success': False, 'error': 'No message found'}), 400
+
+        # A visitor's first question may already be answered in the cross-session cache
+        history = get_conversation_context(visitor_id)
+        first_turn = not history
+        capture = g.get('traffic')
+        traffic.note(capture, s=traffic.anonymize(f"zoho_{visitor_id}"), m=len(message), h=len(history))
+        cached = answer_cache.lookup(message) if first_turn else None
+        if cached:
+            update_conversation_context(visitor_id, message, cached['answer'])
+            traffic.note(capture, cached=True, tier="cache", o=len(cached['answer']))
+            return jsonify({
+                'success': True,
+                'response': cached['answer'],
+                'visitor_id': visitor_id,
+                'cached': True,
+                'timestamp': datetime.now().isoformat()
+            })
+
+        # Zoho stops waiting after its webhook budget; don't queue or generate past it
+        config = settings()
+        deadline = Deadline.for_request(request, "webhook", config)
+        throughput.note_source(deadline)
+
+        prompt = build_prompt_with_context(visitor_id, message)
+        model = config.model_for("webhook")
+        with dispatcher.slot(f"zoho_{visitor_id}", estimate_cost(prompt, config.num_predict("webhook")), "zoho",
+                             deadline=deadline.expires_at, model=model), residency.use(model):
+            num_predict = throughput.cap_num_predict(model, config.num_predict("webhook"),
+                                                     len(prompt) // 4, deadline)
+            started = time.time()
+            ai_response, success = call_ollama_api(prompt, num_predict, deadline.timeout(config.webhook_timeout))
+            generation_seconds = time.time() - started
+            traffic.note(capture, p=len(prompt), o=len(ai_response) if success else None, model=model)
+
+        if success and ai_response:
+            update_conversation_context(visitor_id, message, ai_response)
+            if first_turn:
+                answer_cache.store(message, ai_response, model, generation_seconds)
+            return jsonify({
+                'success': True,
+                'response': ai_response,
+                'visitor_id': visitor_id,
+                'timestamp': datetime.now().isoformat()
+            })
+
+        return jsonify({
+            'success': False,
+            'error': 'Failed to generate response',
+            'response': ai_response
+        }), 500
+
+    except DeadlineExceeded as e:
+        logger.info("Zoho webhook for visitor %s dropped: %s", visitor_id, e)
+        return jsonify({'success': False, 'error': 'Request deadline passed'}), 504
+    except Exception as e:
+        logger.error("Zoho webhook error: %s", e)
+        return jsonify({'success': False, 'error': 'Internal server error'}), 500
+
+# Standalone app for running the webhook on its own
+app = Flask(__name__)
+app.register_blueprint(zoho_bp)
+
+if __name__ == '__main__':
+    configure_logging()
+    app.run(host='0.0.0.0', port=5001, debug=False)